@@ -0,0 +1,180 @@
+# analytics.py - Occupancy, ADR and RevPAR analytics for Gest'Hôtel
+#
+# Pulls every stay overlapping the requested range in one columnar query,
+# expands stays into nights with NumPy (np.repeat + an arange offset, no
+# per-row loop) and aggregates rooms sold and room revenue per night and room
+# type with pandas. Period figures (day / week / month) are then:
+#   occupancy = rooms sold / rooms available
+#   ADR       = room revenue / rooms sold         (prix_nuit_applique)
+#   RevPAR    = room revenue / rooms available
+# Nights before today are closed: their daily aggregates are cached in-process
+# and only the open part of a range is recomputed.
+#
+# Rooms available come from the current chambres inventory.
+#
+# Usage:
+#   python analytics.py 2026-01-01 2026-12-31 [day|week|month]
+
+import sys
+import threading
+import time
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+GRANULARITIES = {'day': 'D', 'week': 'W-SUN', 'month': 'M'}
+MAX_RANGE_DAYS = 366 * 5
+
+# Stays that occupy their room (cancelled and pending ones do not)
+# (the room type is mapped in pandas: a join here costs a lookup per stay)
+_STAYS_SQL = '''SELECT id_chambre, date_debut, date_fin, prix_nuit_applique FROM reservations
+                WHERE statut IN ('Confirmée', 'Terminée') AND date_debut <= ? AND date_fin > ?'''
+
+def _day_index(start, end):
+    return pd.date_range(start, end, freq='D')
+
+def nightly_totals(conn, start, end):
+    """Rooms sold and room revenue per (night, type_chambre) for nights in [start, end]."""
+    stays = pd.read_sql_query(_STAYS_SQL, conn, params=(end.isoformat(), start.isoformat()))
+    room_types = dict(conn.execute('SELECT id_chambre, type_chambre FROM chambres').fetchall())
+    stays['type_chambre'] = stays['id_chambre'].map(room_types)
+    stays = stays[stays['type_chambre'].notna()].reset_index(drop=True)
+    columns = ['night', 'type_chambre', 'rooms_sold', 'revenue']
+    if stays.empty:
+        return pd.DataFrame(columns=columns)
+    first = np.datetime64(start, 'D')
+    arrive = np.maximum(stays['date_debut'].to_numpy(dtype='datetime64[D]'), first)
+    depart = np.minimum(stays['date_fin'].to_numpy(dtype='datetime64[D]'), np.datetime64(end + timedelta(days=1), 'D'))
+    nights = (depart - arrive).astype(np.int64)
+    keep = nights > 0
+    arrive, nights = arrive[keep], nights[keep]
+    # Stay i contributes nights arrive[i], arrive[i] + 1, ..., arrive[i] + nights[i] - 1
+    stay = np.repeat(np.flatnonzero(keep), nights)
+    offsets = np.arange(nights.sum()) - np.repeat(np.cumsum(nights) - nights, nights)
+    expanded = pd.DataFrame({
+        'night': (np.repeat(arrive, nights) + offsets.astype('timedelta64[D]')).astype('datetime64[ns]'),
+        'type_chambre': stays['type_chambre'].to_numpy()[stay],
+        'revenue': stays['prix_nuit_applique'].to_numpy(dtype=np.float64)[stay],
+    })
+    grouped = expanded.groupby(['night', 'type_chambre'], sort=True)['revenue'].agg(['size', 'sum']).reset_index()
+    return grouped.rename(columns={'size': 'rooms_sold', 'sum': 'revenue'})[columns]
+
+class AnalyticsEngine:
+    """Nightly aggregates with a cache of closed nights (contiguous range [lo, hi])."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._closed = None # DataFrame like nightly_totals()
+        self._lo = self._hi = None
+
+    def invalidate(self):
+        """Drops the cache, e.g. after a write that changed past nights."""
+        with self._lock:
+            self._closed, self._lo, self._hi = None, None, None
+
+    def nightly(self, conn, start, end, today=None):
+        today = today or date.today()
+        with self._lock:
+            cached, lo, hi = self._closed, self._lo, self._hi
+        if cached is not None and (end < lo - timedelta(days=1) or start > hi + timedelta(days=1)):
+            cached = None # Range apart from the cache: compute just the range (_remember keeps the cache contiguous)
+        if cached is None:
+            missing = [(start, end)]
+        else:
+            # Compute only what lies outside the cached range; both pieces touch it
+            missing = []
+            if start < lo:
+                missing.append((start, lo - timedelta(days=1)))
+            if end > hi:
+                missing.append((hi + timedelta(days=1), end))
+        pieces = [nightly_totals(conn, a, b) for a, b in missing]
+        self._remember(pieces, missing, today)
+        if cached is not None:
+            pieces.append(cached)
+        frame = pd.concat([p for p in pieces if not p.empty]) if any(not p.empty for p in pieces) else pieces[0]
+        if frame.empty:
+            return frame
+        days = frame['night']
+        return frame[(days >= pd.Timestamp(start)) & (days <= pd.Timestamp(end))]
+
+    def _remember(self, pieces, ranges, today):
+        last_closed = today - timedelta(days=1)
+        with self._lock:
+            for frame, (a, b) in zip(pieces, ranges):
+                b = min(b, last_closed)
+                if a > b:
+                    continue
+                if self._closed is not None and (b < self._lo - timedelta(days=1) or a > self._hi + timedelta(days=1)):
+                    continue # Not adjacent (cache changed meanwhile); keep the cache contiguous
+                closed = frame[frame['night'] <= pd.Timestamp(b)] if not frame.empty else frame
+                self._closed = closed if self._closed is None else pd.concat([self._closed, closed])
+                self._lo = a if self._lo is None else min(self._lo, a)
+                self._hi = b if self._hi is None else max(self._hi, b)
+
+    def stats(self):
+        with self._lock:
+            return {'closed_from': self._lo.isoformat() if self._lo else None,
+                    'closed_to': self._hi.isoformat() if self._hi else None,
+                    'cached_rows': 0 if self._closed is None else len(self._closed)}
+
+engine = AnalyticsEngine()
+
+def report(conn, start, end, granularity='month', by_type=False, today=None):
+    """Occupancy / ADR / RevPAR per period (and per type_chambre if `by_type`).
+
+    Returns {'rows': [...], 'elapsed_ms': ...}; each row has period (first day),
+    type_chambre (or None), rooms_available, rooms_sold, revenue, occupancy
+    (percent), adr and revpar.
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Unknown granularity '{granularity}' (use {', '.join(GRANULARITIES)}).")
+    if end < start:
+        raise ValueError('End date must not be before start date.')
+    if (end - start).days > MAX_RANGE_DAYS:
+        raise ValueError(f'Range is limited to {MAX_RANGE_DAYS} days.')
+    started = time.perf_counter()
+    inventory = pd.read_sql_query('SELECT type_chambre, COUNT(*) AS rooms FROM chambres GROUP BY type_chambre', conn)
+    nightly = engine.nightly(conn, start, end, today)
+
+    # Full night x type grid so nights with nothing sold still count as available
+    grid = pd.MultiIndex.from_product([_day_index(start, end), inventory['type_chambre']], names=['night', 'type_chambre'])
+    frame = pd.DataFrame(index=grid).reset_index()
+    frame = frame.merge(inventory, on='type_chambre', how='left')
+    if not nightly.empty:
+        frame = frame.merge(nightly, on=['night', 'type_chambre'], how='left')
+    else:
+        frame['rooms_sold'], frame['revenue'] = 0, 0.0
+    frame[['rooms_sold', 'revenue']] = frame[['rooms_sold', 'revenue']].fillna(0)
+    frame['period'] = frame['night'].dt.to_period(GRANULARITIES[granularity]).dt.start_time
+
+    keys = ['period', 'type_chambre'] if by_type else ['period']
+    totals = frame.groupby(keys, sort=True).agg(rooms_available=('rooms', 'sum'), rooms_sold=('rooms_sold', 'sum'),
+                                                revenue=('revenue', 'sum')).reset_index()
+    available = totals['rooms_available'].replace(0, np.nan)
+    sold = totals['rooms_sold'].replace(0, np.nan)
+    totals['occupancy'] = (totals['rooms_sold'] / available * 100).fillna(0).round(2)
+    totals['adr'] = (totals['revenue'] / sold).fillna(0).round(2)
+    totals['revpar'] = (totals['revenue'] / available).fillna(0).round(2)
+    totals['revenue'] = totals['revenue'].round(2)
+    totals['period'] = totals['period'].dt.strftime('%Y-%m-%d')
+    if not by_type:
+        totals['type_chambre'] = None
+    rows = totals[['period', 'type_chambre', 'rooms_available', 'rooms_sold', 'revenue', 'occupancy', 'adr', 'revpar']]
+    rows = rows.astype({'rooms_available': int, 'rooms_sold': int}).to_dict('records')
+    return {'date_from': start.isoformat(), 'date_to': end.isoformat(), 'granularity': granularity, 'by_type': by_type,
+            'rows': rows, 'elapsed_ms': round((time.perf_counter() - started) * 1000, 2), 'cache': engine.stats()}
+
+if __name__ == '__main__':
+    from contextlib import closing
+    from db import connect
+    if len(sys.argv) not in (3, 4):
+        print("Usage: python analytics.py START END [day|week|month]")
+        sys.exit(2)
+    with closing(connect()) as conn:
+        result = report(conn, date.fromisoformat(sys.argv[1]), date.fromisoformat(sys.argv[2]),
+                        sys.argv[3] if len(sys.argv) == 4 else 'month')
+    for row in result['rows']:
+        print(f"{row['period']}  occ {row['occupancy']:6.2f}%  ADR {row['adr']:8.2f}  RevPAR {row['revpar']:8.2f}  "
+              f"({row['rooms_sold']}/{row['rooms_available']} room-nights)")
+    print(f"Computed in {result['elapsed_ms']} ms")
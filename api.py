@@ -0,0 +1,420 @@
+# api.py - Versioned JSON API for Gest'Hôtel (Flask blueprint mounted at /api/v1)
+#
+# Serves the same tables as the HTML views to API clients such as frontend.py,
+# without Jinja rendering. Writes go through booking.py, so business rules and
+# the in-process caches stay identical to the form routes.
+#
+# Every endpoint but /login needs the signed token it returns (see auth.py),
+# sent as "Authorization: Bearer <token>" (or the bare token); POST /logout
+# revokes it. Responses are serialized
+# with orjson when it is installed, the standard json module otherwise.
+#
+# GET /changes?since=<version> returns the rows changed since a version, for
+# clients that sync incrementally (see cdc.py).
+#
+# List endpoints stream a JSON array in batches and page with keyset cursors:
+# ?limit= (default 100, max 5000) and ?after=<cursor>. When more rows follow,
+# the next cursor is sent in the X-Next-Cursor and Link headers.
+#
+# Usage:
+#   curl -X POST -H 'Content-Type: application/json' -d '{"username": "admin", "password": "..."}' \
+#        http://localhost:5000/api/v1/login
+#   curl -H 'Authorization: Bearer <token>' 'http://localhost:5000/api/v1/reservations?statut=Confirmée&limit=500'
+
+import sqlite3
+from datetime import datetime
+from functools import wraps
+from urllib.parse import urlencode
+
+from flask import Blueprint, Response, g, request, stream_with_context
+
+import auth
+import booking
+import cdc
+import kpi
+import versions
+from availability import index as availability
+from db import pool
+from pagination import build_filters, decode_cursor, encode_cursor, iso_date
+
+try:
+    import orjson
+    def dumps(obj):
+        return orjson.dumps(obj)
+except ImportError:
+    import json
+    def dumps(obj):
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode()
+
+bp = Blueprint('api', __name__, url_prefix='/api/v1')
+
+LIMIT_DEFAULT = 100
+LIMIT_MAX = 5000
+STREAM_BATCH = 500 # Rows fetched and serialized per chunk
+
+# --- Helpers ---
+def get_db():
+    """The request's pooled connection; shares g.db with app.get_db_connection, which releases it."""
+    if 'db' not in g:
+        g.db = pool.acquire()
+    return g.db
+
+def json_response(payload, status=200, headers=None):
+    return Response(dumps(payload), status=status, headers=headers, mimetype='application/json')
+
+def error(message, status=400):
+    return json_response({'error': message}, status)
+
+def body():
+    """The request's JSON object (empty dict if absent or not an object)."""
+    data = request.get_json(silent=True)
+    return data if isinstance(data, dict) else {}
+
+def token_required(required_role='client'):
+    """Accepts only requests with a valid API token whose role meets `required_role`."""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            claims = auth.claims_from_header(request.headers.get('Authorization'))
+            if claims is None:
+                return error('Authentication required: missing, invalid or expired token.', 401)
+            if not auth.role_allows(claims['role'], required_role):
+                return error(f"Access denied: '{required_role}' role required.", 403)
+            g.api_user = claims
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+def stream_list(columns, from_sql, order_by, filter_spec=None, where=(), params=(), descending=False):
+    """Streams one keyset page of `SELECT columns from_sql` as a JSON array.
+
+    `order_by` lists the SQL expressions of a unique sort key; `filter_spec`
+    maps query-string filters to conditions (see pagination.build_filters).
+    """
+    try:
+        limit = max(1, min(int(request.args.get('limit', LIMIT_DEFAULT)), LIMIT_MAX))
+        _, filter_where, filter_params = build_filters(request.args, filter_spec or {})
+    except ValueError as e:
+        return error(f'Invalid parameters: {e}')
+    conditions, values = [*where, *filter_where], [*params, *filter_params]
+    after = decode_cursor(request.args.get('after'))
+    if after is not None and len(after) == len(order_by):
+        conditions.append(f"({', '.join(order_by)}) {'<' if descending else '>'} ({', '.join('?' for _ in order_by)})")
+        values.extend(after)
+    tail = (' WHERE ' + ' AND '.join(f'({c})' for c in conditions) if conditions else '') \
+        + ' ORDER BY ' + ', '.join(f"{expr} {'DESC' if descending else 'ASC'}" for expr in order_by)
+
+    conn = get_db()
+    conn.execute('BEGIN') # One read snapshot for the cursor probe and the streamed rows
+    # Key-only probe: the page's last key, and whether any row follows it
+    probe = conn.execute(f"SELECT {', '.join(order_by)} {from_sql}{tail} LIMIT 2 OFFSET ?", (*values, limit - 1)).fetchall()
+    headers = {}
+    if len(probe) == 2:
+        next_cursor = encode_cursor(list(probe[0]))
+        args = {k: v for k, v in request.args.items() if k != 'after'}
+        headers['X-Next-Cursor'] = next_cursor
+        headers['Link'] = f'<{request.base_url}?{urlencode({**args, "after": next_cursor})}>; rel="next"'
+    rows = conn.execute(f'SELECT {columns} {from_sql}{tail} LIMIT ?', (*values, limit))
+
+    def generate():
+        yield b'['
+        separator = b''
+        while batch := rows.fetchmany(STREAM_BATCH):
+            yield separator + b','.join(dumps(dict(row)) for row in batch)
+            separator = b','
+        yield b']'
+        conn.rollback() # Ends the read snapshot
+    return Response(stream_with_context(generate()), headers=headers, mimetype='application/json')
+
+# --- Authentication ---
+@bp.route('/login', methods=['POST'])
+def login():
+    data = body()
+    username, password = data.get('username'), data.get('password')
+    if not username or not password:
+        return error('Username and password are required.')
+    user = auth.authenticate(get_db(), username, password)
+    if not user:
+        return error('Invalid username or password.', 401)
+    return json_response({'token': auth.issue_token(user), 'username': user['username'], 'role': user['role'],
+                          'expires_in': auth.TOKEN_MAX_AGE})
+
+@bp.route('/logout', methods=['POST'])
+@token_required()
+def logout():
+    auth.revoke_token(get_db(), g.api_user)
+    return json_response({'revoked': True})
+
+# --- Chambres (Rooms) ---
+@bp.route('/chambres', methods=['GET'])
+@token_required()
+@versions.conditional('chambres')
+def list_chambres():
+    return stream_list('*, prix_nuit_base AS prix_nuit', 'FROM chambres', ['numero_chambre', 'id_chambre'],
+                       {'statut': ('statut = ?', str), 'type_chambre': ('type_chambre = ?', str)})
+
+@bp.route('/chambres', methods=['POST'])
+@token_required('admin')
+def add_chambre():
+    data = body()
+    prix = data.get('prix_nuit_base', data.get('prix_nuit'))
+    if not all([data.get('numero_chambre'), data.get('type_chambre'), prix is not None, data.get('statut')]):
+        return error('numero_chambre, type_chambre, prix_nuit_base and statut are required.')
+    try:
+        conn = get_db()
+        cursor = conn.execute('INSERT INTO chambres (numero_chambre, type_chambre, prix_nuit_base, statut) VALUES (?, ?, ?, ?)',
+                              (data['numero_chambre'], data['type_chambre'], float(prix), data['statut']))
+        conn.commit()
+    except (TypeError, ValueError):
+        return error('Invalid base price format.')
+    except sqlite3.IntegrityError:
+        return error(f"Room number {data['numero_chambre']} already exists or invalid type/status.", 409)
+    return json_response({'id_chambre': cursor.lastrowid}, 201)
+
+# --- Clients ---
+@bp.route('/clients', methods=['GET'])
+@token_required('staff')
+@versions.conditional('clients')
+def list_clients():
+    return stream_list('*', 'FROM clients', ['nom', 'prenom', 'id_client'], {
+        'q': ('nom >= ? AND nom < ?', lambda v: (v, v + '\U0010ffff')), # Last-name prefix, index friendly
+        'statut_fidelite': ('statut_fidelite = ?', str),
+    })
+
+@bp.route('/clients', methods=['POST'])
+@token_required('staff')
+def add_client():
+    data = body()
+    if not data.get('nom') or not data.get('prenom') or not data.get('email'):
+        return error('nom, prenom and email are required.')
+    try:
+        conn = get_db()
+        cursor = conn.execute('INSERT INTO clients (nom, prenom, telephone, email, adresse, statut_fidelite) VALUES (?, ?, ?, ?, ?, ?)',
+                              (data['nom'], data['prenom'], data.get('telephone'), data['email'], data.get('adresse'),
+                               data.get('statut_fidelite') or 'Standard'))
+        conn.commit()
+    except sqlite3.IntegrityError:
+        return error(f"Client with email {data['email']} already exists or invalid loyalty status.", 409)
+    return json_response({'id_client': cursor.lastrowid}, 201)
+
+# --- Reservations ---
+_RESERVATION_FROM = '''FROM reservations r
+    JOIN clients c ON r.id_client = c.id_client
+    JOIN chambres ch ON r.id_chambre = ch.id_chambre
+    JOIN tarifs t ON r.id_tarif = t.id_tarif'''
+
+@bp.route('/reservations', methods=['GET'])
+@token_required('staff')
+@versions.conditional('reservations', 'clients', 'chambres', 'tarifs')
+def list_reservations():
+    return stream_list("r.*, c.nom || ' ' || c.prenom AS client_name, c.email, ch.numero_chambre, ch.type_chambre, t.nom_tarif",
+                       _RESERVATION_FROM, ['r.date_debut', 'r.id_reservation'], {
+                           'statut': ('r.statut = ?', str),
+                           'id_chambre': ('r.id_chambre = ?', int),
+                           'id_client': ('r.id_client = ?', int),
+                           'date_from': ('r.date_debut >= ?', iso_date),
+                           'date_to': ('r.date_debut <= ?', iso_date),
+                       }, descending=True)
+
+@bp.route('/reservations', methods=['POST'])
+@token_required('staff')
+def add_reservation():
+    data = body()
+    if not all(data.get(k) for k in ('id_client', 'id_chambre', 'date_debut', 'date_fin')):
+        return error('id_client, id_chambre, date_debut and date_fin are required.')
+    try: # Without id_tarif, the best applicable tariff (tariff_rules.py)
+        id_reservation, prix_applique, tarif = booking.create_reservation(get_db(), availability, data['id_client'], data['id_chambre'],
+                                                                          data.get('id_tarif'), data['date_debut'], data['date_fin'])
+    except booking.BookingError as e:
+        return error(e.message, e.status)
+    except ValueError:
+        return error('Invalid date format (use YYYY-MM-DD).')
+    except sqlite3.IntegrityError as e:
+        return error(f'Database integrity error: {e}. Ensure valid IDs.')
+    return json_response({'id_reservation': id_reservation, 'prix_nuit_applique': prix_applique,
+                          'id_tarif': tarif.id_tarif, 'nom_tarif': tarif.nom_tarif}, 201)
+
+@bp.route('/reservations/<int:id>', methods=['DELETE'])
+@token_required('staff')
+def cancel_reservation(id):
+    try:
+        booking.cancel_reservation(get_db(), availability, id)
+    except booking.BookingError as e:
+        return error(e.message, e.status)
+    return json_response({'id_reservation': id, 'statut': 'Annulée'})
+
+@bp.route('/reservation_services', methods=['POST'])
+@token_required('staff')
+def add_reservation_service():
+    data = body()
+    try:
+        id_reservation, id_service = int(data['id_reservation']), int(data['id_service'])
+        quantite = int(data.get('quantite') or 1)
+    except (KeyError, TypeError, ValueError):
+        return error('id_reservation and id_service are required integers.')
+    conn = get_db()
+    service = conn.execute('SELECT disponibilite FROM services WHERE id_service = ?', (id_service,)).fetchone()
+    if not service:
+        return error(f'Service {id_service} not found.', 404)
+    if service['disponibilite'] != 'Disponible':
+        return error(f'Service {id_service} is not available.', 409)
+    try:
+        # Ordering the same service again adds to its quantity
+        conn.execute('''INSERT INTO reservation_services (id_reservation, id_service, quantite, date_service) VALUES (?, ?, ?, ?)
+                        ON CONFLICT(id_reservation, id_service) DO UPDATE SET quantite = quantite + excluded.quantite''',
+                     (id_reservation, id_service, quantite, data.get('date_service') or datetime.now().strftime('%Y-%m-%d')))
+        conn.commit()
+    except sqlite3.IntegrityError:
+        return error(f'Reservation {id_reservation} not found or invalid quantity.')
+    return json_response({'id_reservation': id_reservation, 'id_service': id_service}, 201)
+
+# --- Services ---
+@bp.route('/services', methods=['GET'])
+@token_required()
+@versions.conditional('services')
+def list_services():
+    return stream_list('*', 'FROM services', ['nom_service', 'id_service'], {'disponibilite': ('disponibilite = ?', str)})
+
+@bp.route('/services', methods=['POST'])
+@token_required('admin')
+def add_service():
+    data = body()
+    if not all([data.get('nom_service'), data.get('prix') is not None, data.get('disponibilite')]):
+        return error('nom_service, prix and disponibilite are required.')
+    try:
+        conn = get_db()
+        cursor = conn.execute('INSERT INTO services (nom_service, description, prix, disponibilite) VALUES (?, ?, ?, ?)',
+                              (data['nom_service'], data.get('description'), float(data['prix']), data['disponibilite']))
+        conn.commit()
+    except (TypeError, ValueError):
+        return error('Invalid price format.')
+    except sqlite3.IntegrityError:
+        return error(f"Service \"{data['nom_service']}\" already exists or invalid availability.", 409)
+    return json_response({'id_service': cursor.lastrowid}, 201)
+
+# --- Factures (Invoices) ---
+@bp.route('/factures', methods=['GET'])
+@token_required('staff')
+@versions.conditional('factures', 'reservations', 'clients', 'chambres')
+def list_factures():
+    return stream_list("f.*, r.date_debut, r.date_fin, c.nom || ' ' || c.prenom AS client_name, ch.numero_chambre",
+                       '''FROM factures f
+                          JOIN reservations r ON f.id_reservation = r.id_reservation
+                          JOIN clients c ON r.id_client = c.id_client
+                          JOIN chambres ch ON r.id_chambre = ch.id_chambre''', ['f.date_emission', 'f.id_facture'], {
+                           'statut': ('f.statut = ?', str),
+                           'id_reservation': ('f.id_reservation = ?', int),
+                           'date_from': ('f.date_emission >= ?', iso_date),
+                           'date_to': ('f.date_emission <= ?', iso_date),
+                       }, descending=True)
+
+@bp.route('/factures', methods=['POST'])
+@token_required('staff')
+def add_facture():
+    id_reservation = body().get('id_reservation')
+    if not id_reservation:
+        return error('id_reservation is required.')
+    try:
+        invoice = booking.generate_invoice(get_db(), id_reservation)
+    except booking.BookingError as e:
+        return error(e.message, e.status)
+    return json_response(invoice, 201)
+
+@bp.route('/factures/<int:id>', methods=['PUT'])
+@token_required('staff')
+def update_facture(id):
+    data = body()
+    if not data.get('statut'):
+        return error('statut is required (mode_paiement too when it is Payée).')
+    try:
+        booking.update_invoice(get_db(), id, data['statut'], data.get('mode_paiement') or '')
+    except booking.BookingError as e:
+        return error(e.message, e.status)
+    return json_response(dict(get_db().execute('SELECT * FROM factures WHERE id_facture = ?', (id,)).fetchone()))
+
+# --- Avis (Reviews) ---
+@bp.route('/avis', methods=['GET'])
+@token_required()
+@versions.conditional('avis', 'clients')
+def list_avis():
+    # Approved reviews for everyone; admins also see pending ones (filter with ?moderated=0|1)
+    where = [] if g.api_user['role'] == 'admin' else ['a.moderated = 1']
+    return stream_list("a.*, c.nom || ' ' || c.prenom AS client_name", 'FROM avis a JOIN clients c ON a.id_client = c.id_client',
+                       ['a.date_avis', 'a.id_avis'], {
+                           'moderated': ('a.moderated = ?', int),
+                           'note_min': ('a.note >= ?', int),
+                           'date_from': ('a.date_avis >= ?', iso_date),
+                           'date_to': ('a.date_avis <= ?', iso_date),
+                       }, where=where, descending=True)
+
+@bp.route('/avis', methods=['POST'])
+@token_required()
+def add_avis():
+    data = body()
+    # Clients review their own stays; staff may submit on behalf of a client
+    id_client = g.api_user['id_user'] if g.api_user['role'] == 'client' else data.get('id_client')
+    if not all([id_client, data.get('id_reservation'), data.get('note'), data.get('commentaire')]):
+        return error('id_reservation, note and commentaire are required.')
+    try:
+        note = int(data['note'])
+    except (TypeError, ValueError):
+        return error('Invalid rating value.')
+    if not 1 <= note <= 5:
+        return error('Rating must be between 1 and 5.')
+    conn = get_db()
+    check = conn.execute("SELECT 1 FROM reservations WHERE id_reservation = ? AND id_client = ? AND statut = 'Terminée'",
+                         (data['id_reservation'], id_client)).fetchone()
+    if not check:
+        return error('Cannot review: Reservation not found, not completed, or not made by this client.', 404)
+    try:
+        cursor = conn.execute('INSERT INTO avis (id_client, id_reservation, note, commentaire, date_avis, moderated) VALUES (?, ?, ?, ?, ?, 0)',
+                              (id_client, data['id_reservation'], note, data['commentaire'], datetime.now().strftime('%Y-%m-%d')))
+        conn.commit()
+    except sqlite3.IntegrityError: # UNIQUE constraint on id_reservation
+        return error('A review has already been submitted for this reservation.', 409)
+    return json_response({'id_avis': cursor.lastrowid, 'moderated': 0}, 201)
+
+@bp.route('/avis/<int:id>/moderate', methods=['PUT'])
+@token_required('admin')
+def moderate_avis(id):
+    conn = get_db()
+    result = conn.execute('UPDATE avis SET moderated = 1 WHERE id_avis = ? AND moderated = 0', (id,))
+    conn.commit()
+    if result.rowcount == 0:
+        return error(f'Review {id} not found or already moderated.', 404)
+    return json_response({'id_avis': id, 'moderated': 1})
+
+# --- Change Data Capture ---
+@bp.route('/changes', methods=['GET'])
+@token_required('staff')
+def changes():
+    try:
+        since = int(request.args.get('since', 0))
+        limit = max(1, min(int(request.args.get('limit', cdc.LIMIT_DEFAULT)), cdc.LIMIT_MAX))
+    except ValueError:
+        return error("'since' and 'limit' must be integers.")
+    tables = [t for t in request.args.get('tables', '').split(',') if t] or None
+    unknown = [t for t in tables or () if t not in cdc.TABLES]
+    if unknown:
+        return error(f"Unknown tables: {', '.join(unknown)} (captured: {', '.join(cdc.TABLES)}).")
+    conn = get_db()
+    conn.execute('BEGIN') # The log and the rows it points to, from one snapshot
+    try:
+        return json_response(cdc.changes(conn, since, limit, tables))
+    except cdc.ResyncRequired as e:
+        return json_response({'error': str(e), 'horizon': e.horizon, 'latest': cdc.latest(conn)}, 410)
+    finally:
+        conn.rollback()
+
+# --- Dashboard ---
+@bp.route('/dashboard', methods=['GET'])
+@token_required('admin')
+@versions.conditional('reservations', 'chambres', 'clients', 'avis')
+def dashboard():
+    conn = get_db()
+    today = datetime.now().strftime('%Y-%m-%d')
+    kpis = kpi.dashboard_kpis(conn, today)
+    kpis['occupancy_rate'] = round(kpis['occupancy_rate'], 2)
+    kpis['average_rating'] = round(kpis['average_rating'], 2)
+    kpis['upcoming_checkins'] = [dict(row) for row in kpi.upcoming_checkins(conn, today)]
+    return json_response(kpis)
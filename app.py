@@ -1,12 +1,36 @@
 # app.py (Corrected - Includes view_services and other Phase 2 updates)
 
+import csv
 import sqlite3
 from datetime import datetime, timedelta, date
 from functools import wraps
-from flask import (Flask, abort, flash, jsonify, redirect,
+from flask import (Flask, abort, flash, g, jsonify, redirect,
                    render_template, request, session, url_for)
 import os
 import math # For ceiling calculation
+from contextlib import closing
+import analytics
+import api
+import auth
+import billing
+import booking
+import compression
+import folio
+import fragments
+import ingest
+import kpi
+import metrics
+import migrate
+import night_audit
+import querylog
+import room_search
+import rollups
+import tariff_rules
+import versions
+from availability import index as availability
+from fragments import Lazy
+from pagination import build_filters, iso_date, keyset_page
+from db import DATABASE, connect, pool
 
 app = Flask(__name__, template_folder='templates')
 
@@ -15,6 +39,17 @@ app = Flask(__name__, template_folder='templates')
 app.secret_key = os.environ.get('FLASK_SECRET_KEY', 'fallback - change this default key very securely')
 app.permanent_session_lifetime = timedelta(hours=8) # Example session duration
 
+# JSON API for frontend.py and other integrations (api.py), with signed tokens (auth.py)
+auth.init_app(app)
+app.register_blueprint(api.bp)
+# Fragment cache and precompiled templates (fragments.py), optional gzip/brotli (compression.py)
+fragments.init_app(app)
+compression.init_app(app)
+# Per-request query counts and timings in Server-Timing, slow-query log (querylog.py)
+querylog.init_app(app)
+# Prometheus-style /metrics aggregated across worker processes (metrics.py)
+metrics.init_app(app)
+
 # --- Context Processor ---
 @app.context_processor
 def inject_now():
@@ -23,20 +58,33 @@ def inject_now():
 
 # --- Database Connection Helper ---
 def get_db_connection():
-    """Establishes a connection to the SQLite database."""
-    conn = sqlite3.connect('gesthotel.db')
-    conn.row_factory = sqlite3.Row # Access columns by name
-    conn.execute("PRAGMA foreign_keys = ON") # Ensure FK constraints are active
-    return conn
+    """Returns the request's pooled SQLite connection (see db.py).
+
+    The connection is borrowed once per app context and handed back to the pool
+    by close_db_connection, so routes must not close it themselves.
+    """
+    if 'db' not in g:
+        g.db = pool.acquire()
+    return g.db
+
+@app.teardown_appcontext
+def close_db_connection(exception=None):
+    """Returns the connection to the pool; uncommitted work is rolled back."""
+    conn = g.pop('db', None)
+    if conn is not None:
+        pool.release(conn)
 
 # --- Authentication & Authorization Decorators ---
 def login_required(f):
-    """Redirects to login if user is not authenticated."""
+    """Redirects to login if user is not authenticated. API clients may send a token instead (auth.py)."""
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if 'user_id' not in session:
-            flash('Please log in to access this page.', 'warning')
-            return redirect(url_for('login', next=request.url))
+            claims = auth.claims_from_header(request.headers.get('Authorization'))
+            if claims is None:
+                flash('Please log in to access this page.', 'warning')
+                return redirect(url_for('login', next=request.url))
+            g.api_user = claims
         return f(*args, **kwargs)
     return decorated_function
 
@@ -46,17 +94,9 @@ def require_role(required_role):
         @wraps(f)
         @login_required # User must be logged in first
         def decorated_function(*args, **kwargs):
-            user_role = session.get('role')
-            allowed = False
             # Check if the user's role meets the requirement (includes inheritance)
-            if user_role == required_role:
-                allowed = True
-            elif user_role == 'admin' and required_role in ['staff', 'client']:
-                allowed = True
-            elif user_role == 'staff' and required_role == 'client':
-                 allowed = True
-
-            if not allowed:
+            user_role = session['role'] if 'user_id' in session else g.api_user['role']
+            if not auth.role_allows(user_role, required_role):
                 # Show an unauthorized page if permission denied
                 return render_template('unauthorized.html', required_role=required_role), 403
             # If allowed, proceed with the original function
@@ -65,31 +105,9 @@ def require_role(required_role):
     return decorator
 
 # --- Helper Functions ---
-def calculate_applied_price(base_price, reduction_percentage):
-    """Calculates price after percentage reduction, ensuring valid inputs."""
-    try:
-        base = float(base_price)
-        reduction = float(reduction_percentage)
-        discount = max(0.0, min(100.0, reduction)) # Clamp reduction between 0 and 100
-        applied = base * (1 - discount / 100.0)
-        return round(applied, 2)
-    except (ValueError, TypeError):
-        # Return base price or raise an error if inputs are invalid
-        print(f"Warning: Invalid input for price calculation: base={base_price}, reduction={reduction_percentage}")
-        return base_price # Fallback to base price
-
-def get_applicable_tariffs(db_conn, client_status=None, booking_dates=None):
-     """Fetches tariffs potentially applicable (simplified logic)."""
-     # This logic should be expanded based on actual business rules (season, day, etc.)
-     tariffs = db_conn.execute('SELECT * FROM tarifs ORDER BY nom_tarif').fetchall()
-     applicable = [t for t in tariffs if t['condition_application'] == 'None' or t['nom_tarif'] == 'Standard']
-     if client_status == 'VIP':
-         vip_tariffs = [t for t in tariffs if 'VIP' in t['condition_application']]
-         applicable.extend(vip_tariffs)
-     # Remove duplicates
-     unique_tariffs = {t['id_tarif']: t for t in applicable}
-     return list(unique_tariffs.values())
-
+def flash_booking_error(error):
+    """Flashes a booking.BookingError: conflicts and server-side problems as errors, the rest as warnings."""
+    flash(error.message, 'danger' if error.status in (409, 500) else 'warning')
 
 # --- Routes ---
 
@@ -100,15 +118,12 @@ def login():
 
     if request.method == 'POST':
         username = request.form.get('username')
-        password = request.form.get('password') # WARNING: Plain text password check!
+        password = request.form.get('password')
         if not username or not password:
             flash('Username and password are required.', 'danger')
             return render_template('login.html')
 
-        conn = get_db_connection()
-        user = conn.execute('SELECT id_user, username, role FROM users WHERE username = ? AND password = ?',
-                            (username, password)).fetchone()
-        conn.close()
+        user = auth.authenticate(get_db_connection(), username, password)
 
         if user:
             session.permanent = True
@@ -141,37 +156,85 @@ def home():
 
 @app.route('/dashboard')
 @require_role('admin')
+@versions.conditional('reservations', 'chambres', 'clients', 'avis')
 def dashboard():
     try:
         conn = get_db_connection()
         today = datetime.now().strftime('%Y-%m-%d')
-        total_rooms_res = conn.execute('SELECT COUNT(*) as total FROM chambres').fetchone()
-        total_rooms = total_rooms_res['total'] if total_rooms_res else 0
-        occupied_rooms_res = conn.execute('''SELECT COUNT(DISTINCT id_chambre) as occupied FROM reservations
-                                            WHERE statut = 'Confirmée' AND date(date_debut) <= date(?) AND date(date_fin) > date(?)''', (today, today)).fetchone()
-        occupied_rooms = occupied_rooms_res['occupied'] if occupied_rooms_res else 0
-        occupancy_rate = (occupied_rooms / total_rooms * 100) if total_rooms > 0 else 0
-        avg_rating_res = conn.execute('SELECT AVG(note) as avg_note FROM avis WHERE moderated = 1').fetchone()
-        avg_rating = avg_rating_res['avg_note'] if avg_rating_res and avg_rating_res['avg_note'] is not None else 0
-        upcoming_checkins = conn.execute(''' SELECT r.id_reservation, r.date_debut, c.nom, c.prenom, ch.numero_chambre
-                                             FROM reservations r JOIN clients c ON r.id_client = c.id_client JOIN chambres ch ON r.id_chambre = ch.id_chambre
-                                             WHERE r.statut = 'Confirmée' AND date(r.date_debut) BETWEEN date(?) AND date(?, '+7 days')
-                                             ORDER BY r.date_debut ASC LIMIT 5 ''', (today, today)).fetchall()
-        conn.close()
+        # Counters maintained by triggers (kpi.py), so this stays constant-time as history grows
+        kpis = kpi.dashboard_kpis(conn, today)
+        occupancy_rate, avg_rating = kpis['occupancy_rate'], kpis['average_rating']
+        upcoming_checkins = kpi.upcoming_checkins(conn, today)
         return render_template('dashboard.html', occupancy_rate=round(occupancy_rate, 2), average_rating=round(avg_rating, 2), upcoming_checkins=upcoming_checkins)
     except Exception as e:
         flash(f'Error loading dashboard data: {str(e)}', 'danger')
         return render_template('dashboard.html', occupancy_rate=0, average_rating=0, upcoming_checkins=[], error=str(e))
 
+@app.route('/admin/pool')
+@require_role('admin')
+def pool_stats():
+    # JSON hit/miss counters of this worker's connection pool. Admin only.
+    return jsonify(pool.stats())
+
+@app.route('/admin/availability/check')
+@require_role('admin')
+def availability_check():
+    # JSON comparison of this worker's availability index with the database. Admin only.
+    conn = get_db_connection()
+    availability.ensure_fresh(conn)
+    return jsonify(dict(availability.check_consistency(conn), **availability.stats()))
+
+@app.route('/admin/night-audit', methods=['GET', 'POST'])
+@require_role('admin')
+def night_audit_runs():
+    # GET: JSON log of recent night-audit runs. POST: re-runs today's audit now. Admin only.
+    conn = get_db_connection()
+    if request.method == 'POST':
+        summary = night_audit.run_night_audit(conn, force=True)
+        availability.complete_before(summary['business_date'])
+        return jsonify(summary)
+    return jsonify(night_audit.recent_runs(conn))
+
+def _analytics_params():
+    # Reads ?date_from=&date_to=&granularity=&by_type= (default: the current calendar year by month)
+    today = date.today()
+    start = date.fromisoformat(request.args.get('date_from') or today.replace(month=1, day=1).isoformat())
+    end = date.fromisoformat(request.args.get('date_to') or today.replace(month=12, day=31).isoformat())
+    return start, end, request.args.get('granularity', 'month'), request.args.get('by_type') == '1'
+
+@app.route('/admin/analytics')
+@require_role('admin')
+def view_analytics():
+    # Renders occupancy / ADR / RevPAR per period. Admin only.
+    try:
+        start, end, granularity, by_type = _analytics_params()
+        result = analytics.report(get_db_connection(), start, end, granularity, by_type)
+    except ValueError as e:
+        flash(f'Invalid analytics parameters: {e}', 'warning')
+        result = None
+    except Exception as e:
+        flash(f'Error computing analytics: {str(e)}', 'danger')
+        result = None
+    return render_template('analytics.html', result=result, granularities=analytics.GRANULARITIES)
+
+@app.route('/admin/analytics/data')
+@require_role('admin')
+def analytics_data():
+    # JSON version of the analytics page, same query parameters. Admin only.
+    try:
+        return jsonify(analytics.report(get_db_connection(), *_analytics_params()))
+    except ValueError as e:
+        return jsonify({'error': f'Invalid analytics parameters: {e}'}), 400
+
 # --- Chambres (Rooms) ---
 @app.route('/chambres')
 @login_required
+@versions.conditional('chambres')
 def view_chambres():
     # Renders the list of rooms. Accessible by logged-in users.
     try:
         conn = get_db_connection()
         chambres = conn.execute('SELECT * FROM chambres ORDER BY numero_chambre').fetchall()
-        conn.close()
         # Renders templates/chambres.html
         return render_template('chambres.html', chambres=chambres)
     except Exception as e:
@@ -194,7 +257,6 @@ def add_chambre():
         conn.execute('INSERT INTO chambres (numero_chambre, type_chambre, prix_nuit_base, statut) VALUES (?, ?, ?, ?)',
                      (numero, type_chambre, float(prix_base), statut))
         conn.commit()
-        conn.close()
         flash(f'Room {numero} added successfully!', 'success')
     except sqlite3.IntegrityError:
         flash(f'Room number {numero} already exists or invalid type/status.', 'danger')
@@ -212,7 +274,6 @@ def edit_chambre(id):
     # Fetch the room first for both GET and potential POST failure
     chambre = conn.execute('SELECT * FROM chambres WHERE id_chambre = ?', (id,)).fetchone()
     if not chambre:
-        conn.close()
         abort(404) # Room not found
 
     if request.method == 'POST':
@@ -222,7 +283,6 @@ def edit_chambre(id):
         statut = request.form.get('statut')
         if not all([numero, type_chambre, prix_base, statut]):
             flash('All fields are required.', 'warning')
-            conn.close()
             # Renders templates/chambre_edit.html on validation failure
             return render_template('chambre_edit.html', chambre=chambre)
         try:
@@ -231,7 +291,6 @@ def edit_chambre(id):
                          (numero, type_chambre, float(prix_base), statut, id))
             conn.commit()
             flash(f'Room {numero} updated successfully!', 'success')
-            conn.close()
             return redirect(url_for('view_chambres'))
         except sqlite3.IntegrityError:
             conn.rollback()
@@ -242,12 +301,10 @@ def edit_chambre(id):
         except Exception as e:
             conn.rollback()
             flash(f'Error updating room: {str(e)}', 'danger')
-        # If POST fails after DB attempts, close connection and render form again
-        conn.close()
+        # If POST fails after DB attempts, render form again
         # Renders templates/chambre_edit.html on DB error
         return render_template('chambre_edit.html', chambre=chambre)
     else: # GET Request
-        conn.close()
         # Renders templates/chambre_edit.html for viewing/editing
         return render_template('chambre_edit.html', chambre=chambre)
 
@@ -260,7 +317,6 @@ def delete_chambre(id):
         # Attempt deletion - FOREIGN KEY constraint should prevent if reserved
         result = conn.execute('DELETE FROM chambres WHERE id_chambre = ?', (id,))
         conn.commit()
-        conn.close()
         if result.rowcount > 0:
             flash(f'Room {id} deleted successfully.', 'success')
         else:
@@ -275,12 +331,17 @@ def delete_chambre(id):
 # --- Clients ---
 @app.route('/clients')
 @require_role('staff')
+@versions.conditional('clients')
 def view_clients():
     # Renders the list of clients. Staff/Admin access.
     try:
         conn = get_db_connection()
-        clients = conn.execute('SELECT * FROM clients ORDER BY nom, prenom').fetchall()
-        conn.close()
+        filters, where, params = build_filters(request.args, {
+            'q': ('nom >= ? AND nom < ?', lambda v: (v, v + '\U0010ffff')), # Last-name prefix, index friendly
+            'statut_fidelite': ('statut_fidelite = ?', str),
+        })
+        clients = keyset_page(conn, 'SELECT * FROM clients', [('nom', 'nom'), ('prenom', 'prenom'), ('id_client', 'id_client')],
+                              request.args, where, params, filters, descending=False)
         # Renders templates/clients.html
         return render_template('clients.html', clients=clients)
     except Exception as e:
@@ -305,7 +366,6 @@ def add_client():
         conn.execute('INSERT INTO clients (nom, prenom, telephone, email, adresse, statut_fidelite) VALUES (?, ?, ?, ?, ?, ?)',
                      (nom, prenom, telephone, email, adresse, statut_fidelite))
         conn.commit()
-        conn.close()
         flash(f'Client {prenom} {nom} added successfully!', 'success')
     except sqlite3.IntegrityError:
         flash(f'Client with email {email} already exists or invalid loyalty status.', 'danger')
@@ -320,7 +380,6 @@ def edit_client(id):
     conn = get_db_connection()
     client = conn.execute('SELECT * FROM clients WHERE id_client = ?', (id,)).fetchone()
     if not client:
-        conn.close()
         abort(404)
 
     if request.method == 'POST':
@@ -332,7 +391,6 @@ def edit_client(id):
         statut_fidelite = request.form.get('statut_fidelite')
         if not nom or not prenom or not email or not statut_fidelite:
             flash('First name, last name, email, and loyalty status are required.', 'warning')
-            conn.close()
             # Renders templates/client_edit.html on validation failure
             return render_template('client_edit.html', client=client)
         try:
@@ -341,7 +399,6 @@ def edit_client(id):
                          (nom, prenom, telephone, email, adresse, statut_fidelite, id))
             conn.commit()
             flash(f'Client {prenom} {nom} updated successfully!', 'success')
-            conn.close()
             return redirect(url_for('view_clients'))
         except sqlite3.IntegrityError:
             conn.rollback()
@@ -349,11 +406,9 @@ def edit_client(id):
         except Exception as e:
             conn.rollback()
             flash(f'Error updating client: {str(e)}', 'danger')
-        conn.close()
         # Renders templates/client_edit.html on DB error
         return render_template('client_edit.html', client=client)
     else: # GET
-        conn.close()
         # Renders templates/client_edit.html for viewing/editing
         return render_template('client_edit.html', client=client)
 
@@ -365,7 +420,6 @@ def delete_client(id):
         conn = get_db_connection()
         result = conn.execute('DELETE FROM clients WHERE id_client = ?', (id,))
         conn.commit()
-        conn.close()
         if result.rowcount > 0:
             flash(f'Client {id} deleted successfully.', 'success')
         else:
@@ -380,12 +434,12 @@ def delete_client(id):
 # --- Tarifs (Pricing Tiers) ---
 @app.route('/tarifs')
 @require_role('staff')
+@versions.conditional('tarifs')
 def view_tarifs():
     # Renders the list of tariffs. Staff/Admin access.
     try:
         conn = get_db_connection()
         tarifs = conn.execute('SELECT * FROM tarifs ORDER BY nom_tarif').fetchall()
-        conn.close()
         # Renders templates/tarifs.html
         return render_template('tarifs.html', tarifs=tarifs)
     except Exception as e:
@@ -404,14 +458,17 @@ def add_tarif():
         flash('Tariff name is required.', 'warning')
         return redirect(url_for('view_tarifs'))
     try:
+        tariff_rules.parse(condition) # Rejects conditions the rules engine cannot apply
         conn = get_db_connection()
         conn.execute('INSERT INTO tarifs (nom_tarif, description, reduction_pourcentage, condition_application) VALUES (?, ?, ?, ?)',
                      (nom, description, float(reduction), condition))
         conn.commit()
-        conn.close()
+        tariff_rules.engine.invalidate()
         flash(f'Tariff "{nom}" added successfully!', 'success')
     except sqlite3.IntegrityError:
         flash(f'Tariff name "{nom}" already exists.', 'danger')
+    except tariff_rules.ConditionError as e:
+        flash(str(e), 'danger')
     except ValueError:
         flash('Invalid reduction percentage format. Must be a number.', 'danger')
     except Exception as e:
@@ -425,7 +482,6 @@ def edit_tarif(id):
     conn = get_db_connection()
     tarif = conn.execute('SELECT * FROM tarifs WHERE id_tarif = ?', (id,)).fetchone()
     if not tarif:
-        conn.close()
         abort(404)
 
     if request.method == 'POST':
@@ -435,32 +491,32 @@ def edit_tarif(id):
         condition = request.form.get('condition_application')
         if not nom:
              flash('Tariff name is required.', 'warning')
-             conn.close()
              # Renders templates/tarif_edit.html on validation failure
              return render_template('tarif_edit.html', tarif=tarif)
         try:
+             tariff_rules.parse(condition)
              conn.execute('''UPDATE tarifs SET nom_tarif = ?, description = ?,
                              reduction_pourcentage = ?, condition_application = ?
                              WHERE id_tarif = ?''',
                           (nom, description, float(reduction), condition, id))
              conn.commit()
+             tariff_rules.engine.invalidate()
              flash(f'Tariff "{nom}" updated successfully!', 'success')
-             conn.close()
              return redirect(url_for('view_tarifs'))
         except sqlite3.IntegrityError:
              conn.rollback()
              flash(f'Update failed. Tariff name "{nom}" might already exist.', 'danger')
+        except tariff_rules.ConditionError as e:
+             flash(str(e), 'danger')
         except ValueError:
              conn.rollback()
              flash('Invalid reduction percentage format.', 'danger')
         except Exception as e:
              conn.rollback()
              flash(f'Error updating tariff: {str(e)}', 'danger')
-        conn.close()
         # Renders templates/tarif_edit.html on DB error
         return render_template('tarif_edit.html', tarif=tarif)
     else: # GET
-        conn.close()
         # Renders templates/tarif_edit.html for viewing/editing
         return render_template('tarif_edit.html', tarif=tarif)
 
@@ -472,7 +528,7 @@ def delete_tarif(id):
         conn = get_db_connection()
         result = conn.execute('DELETE FROM tarifs WHERE id_tarif = ?', (id,))
         conn.commit()
-        conn.close()
+        tariff_rules.engine.invalidate()
         if result.rowcount > 0:
             flash(f'Tariff {id} deleted successfully.', 'success')
         else:
@@ -487,12 +543,12 @@ def delete_tarif(id):
 # **** THIS IS THE FUNCTION THAT WAS MISSING OR CAUSING THE ERROR ****
 @app.route('/services')
 @login_required
+@versions.conditional('services')
 def view_services():
     # Renders the list of services. Accessible by logged-in users.
     try:
         conn = get_db_connection()
         services = conn.execute('SELECT * FROM services ORDER BY nom_service').fetchall()
-        conn.close()
         # Renders templates/services.html
         return render_template('services.html', services=services)
     except Exception as e:
@@ -516,7 +572,6 @@ def add_service():
         conn.execute('INSERT INTO services (nom_service, description, prix, disponibilite) VALUES (?, ?, ?, ?)',
                      (nom, desc, float(prix), disp))
         conn.commit()
-        conn.close()
         flash(f'Service "{nom}" added successfully!', 'success')
     except sqlite3.IntegrityError:
         flash(f'Service "{nom}" already exists or invalid availability.', 'danger')
@@ -531,37 +586,51 @@ def add_service():
 # --- Reservations ---
 @app.route('/reservations')
 @require_role('staff')
+@versions.conditional('reservations', 'clients', 'chambres', 'tarifs')
 def view_reservations():
     # Renders the list of reservations. Staff/Admin access.
     try:
         conn = get_db_connection()
         today = datetime.now().strftime('%Y-%m-%d')
-        # Auto-update completed reservations
-        conn.execute("UPDATE reservations SET statut = 'Terminée' WHERE statut = 'Confirmée' AND date(date_fin) < date(?)", (today,))
-        conn.commit()
-
-        reservations = conn.execute('''
+        # Expired stays are completed by the night audit (night_audit.py); this view only reads
+        availability.ensure_fresh(conn)
+
+        filters, where, params = build_filters(request.args, {
+            'statut': ('r.statut = ?', str),
+            'id_chambre': ('r.id_chambre = ?', int),
+            'id_client': ('r.id_client = ?', int),
+            'date_from': ('r.date_debut >= ?', iso_date),
+            'date_to': ('r.date_debut <= ?', iso_date),
+        })
+        reservations = keyset_page(conn, '''
             SELECT r.*, c.nom, c.prenom, c.email, c.statut_fidelite,
                    ch.numero_chambre, ch.type_chambre, t.nom_tarif
             FROM reservations r
             JOIN clients c ON r.id_client = c.id_client
             JOIN chambres ch ON r.id_chambre = ch.id_chambre
             JOIN tarifs t ON r.id_tarif = t.id_tarif
-            ORDER BY r.date_debut DESC, r.id_reservation DESC
-        ''').fetchall()
-
-        clients = conn.execute('SELECT id_client, nom, prenom, email, statut_fidelite FROM clients ORDER BY nom, prenom').fetchall()
-        # Fetch rooms available (not Occupé today)
-        chambres = conn.execute("SELECT id_chambre, numero_chambre, type_chambre, prix_nuit_base FROM chambres WHERE statut != 'Occupé' ORDER BY numero_chambre").fetchall()
-        # Fetch all tariffs for the dropdown
-        tarifs = conn.execute('SELECT * FROM tarifs ORDER BY nom_tarif').fetchall()
+        ''', [('r.date_debut', 'date_debut'), ('r.id_reservation', 'id_reservation')], request.args, where, params, filters)
+
+        # Dropdown rows are fetched lazily: the template serves those blocks from the fragment cache (fragments.py)
+        clients = Lazy(lambda: conn.execute('SELECT id_client, nom, prenom, email, statut_fidelite FROM clients ORDER BY nom, prenom'))
+        # Rooms free for the requested stay (tonight by default), from the availability index
+        stay_start = date.fromisoformat(request.args.get('date_debut') or today)
+        stay_end = date.fromisoformat(request.args['date_fin']) if request.args.get('date_fin') else stay_start + timedelta(days=1)
+        all_rooms = Lazy(lambda: conn.execute('SELECT id_chambre, numero_chambre, type_chambre, prix_nuit_base FROM chambres ORDER BY numero_chambre'))
+        def free_rooms():
+            free_ids = set(availability.free_rooms([r['id_chambre'] for r in all_rooms], stay_start, stay_end))
+            return [r for r in all_rooms if r['id_chambre'] in free_ids]
+        chambres = Lazy(free_rooms) # Cached per index state too: the index may lag the reservations version
+        # All tariffs for the dropdown
+        tarifs = Lazy(lambda: conn.execute('SELECT * FROM tarifs ORDER BY nom_tarif'))
 
-        conn.close()
         # Renders templates/reservations.html
-        return render_template('reservations.html', reservations=reservations, clients=clients, chambres=chambres, tarifs=tarifs)
+        return render_template('reservations.html', reservations=reservations, clients=clients, chambres=chambres, tarifs=tarifs,
+                               all_rooms=all_rooms, stay_start=stay_start.isoformat(), stay_end=stay_end.isoformat(),
+                               availability_version=availability.version)
     except Exception as e:
         flash(f'Error fetching reservations: {str(e)}', 'danger')
-        return render_template('reservations.html', reservations=[], clients=[], chambres=[], tarifs=[])
+        return render_template('reservations.html', reservations=[], clients=[], chambres=[], tarifs=[], all_rooms=[])
 
 @app.route('/reservations/add', methods=['POST'])
 @require_role('staff')
@@ -569,64 +638,20 @@ def add_reservation():
     # Handles form submission for adding a reservation. Staff/Admin access.
     id_client = request.form.get('id_client')
     id_chambre = request.form.get('id_chambre')
-    id_tarif = request.form.get('id_tarif')
+    id_tarif = request.form.get('id_tarif') or None # Empty: best applicable tariff
     date_debut_str = request.form.get('date_debut')
     date_fin_str = request.form.get('date_fin')
 
-    if not all([id_client, id_chambre, id_tarif, date_debut_str, date_fin_str]):
-        flash('Client, Room, Tariff, Start Date, and End Date are required.', 'warning')
+    if not all([id_client, id_chambre, date_debut_str, date_fin_str]):
+        flash('Client, Room, Start Date, and End Date are required.', 'warning')
         return redirect(url_for('view_reservations'))
 
     try:
-        date_debut = date.fromisoformat(date_debut_str)
-        date_fin = date.fromisoformat(date_fin_str)
-        today = date.today()
-        if date_debut < today:
-             flash('Check-in date cannot be in the past.', 'warning')
-             return redirect(url_for('view_reservations'))
-        if date_debut >= date_fin:
-            flash('Check-out date must be after check-in date.', 'warning')
-            return redirect(url_for('view_reservations'))
-
         conn = get_db_connection()
-        # Check for booking conflicts for the chosen room
-        conflict = conn.execute('''
-            SELECT 1 FROM reservations WHERE id_chambre = ? AND statut = 'Confirmée'
-            AND date(date_debut) < date(?) AND date(date_fin) > date(?) LIMIT 1
-        ''', (id_chambre, date_fin_str, date_debut_str)).fetchone()
-        if conflict:
-            conn.close()
-            flash(f'Room conflict: This room is already booked for the selected dates.', 'danger')
-            return redirect(url_for('view_reservations'))
-
-        # Fetch data needed for price calculation
-        chambre = conn.execute('SELECT prix_nuit_base FROM chambres WHERE id_chambre = ?', (id_chambre,)).fetchone()
-        tarif = conn.execute('SELECT reduction_pourcentage FROM tarifs WHERE id_tarif = ?', (id_tarif,)).fetchone()
-
-        if not chambre or not tarif:
-            conn.close()
-            flash('Invalid room or tariff selected.', 'danger')
-            return redirect(url_for('view_reservations'))
-
-        # --- Apply Tariff Logic ---
-        # Add checks here later if tariff application has conditions (e.g., VIP status)
-        prix_applique = calculate_applied_price(chambre['prix_nuit_base'], tarif['reduction_pourcentage'])
-
-        # Insert the reservation
-        cursor = conn.cursor()
-        cursor.execute('''INSERT INTO reservations
-                          (id_client, id_chambre, id_tarif, date_debut, date_fin, prix_nuit_applique, statut)
-                          VALUES (?, ?, ?, ?, ?, ?, ?)''',
-                       (id_client, id_chambre, id_tarif, date_debut_str, date_fin_str, prix_applique, 'Confirmée'))
-
-        # Update room status if reservation starts today
-        if date_debut == today:
-             cursor.execute('UPDATE chambres SET statut = ? WHERE id_chambre = ?', ('Occupé', id_chambre))
-
-        conn.commit()
-        conn.close()
-        flash(f'Reservation added successfully! Applied price/night: {prix_applique:.2f} €', 'success')
-
+        _, prix_applique, tarif = booking.create_reservation(conn, availability, id_client, id_chambre, id_tarif, date_debut_str, date_fin_str)
+        flash(f'Reservation added successfully! Tariff: {tarif.nom_tarif}, applied price/night: {prix_applique:.2f} €', 'success')
+    except booking.BookingError as e:
+        flash_booking_error(e)
     except ValueError:
         flash('Invalid date format or numeric value.', 'danger')
     except sqlite3.IntegrityError as e:
@@ -636,36 +661,42 @@ def add_reservation():
 
     return redirect(url_for('view_reservations'))
 
+@app.route('/reservations/availability')
+@require_role('staff')
+def search_availability():
+    # JSON availability search: ?date_debut=&date_fin=[&type_chambre=&prix_max=&flex=&min_nights=]. Staff/Admin access.
+    try:
+        date_debut = date.fromisoformat(request.args.get('date_debut', ''))
+        date_fin = date.fromisoformat(request.args.get('date_fin', ''))
+        prix_max = float(request.args['prix_max']) if request.args.get('prix_max') else None
+        flex = max(0, min(int(request.args.get('flex', 3)), room_search.MAX_FLEX_DAYS))
+        min_nights = int(request.args['min_nights']) if request.args.get('min_nights') else None
+        conn = get_db_connection()
+        availability.ensure_fresh(conn)
+        result = room_search.search(conn, availability, date_debut, date_fin, type_chambre=request.args.get('type_chambre') or None,
+                                    prix_max=prix_max, flex_days=flex, min_nights=min_nights)
+        return jsonify(result)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid search parameters: {e}'}), 400
+
+@app.route('/reservations/<int:id>/folio')
+@require_role('staff')
+def reservation_folio(id):
+    # JSON running balance of a reservation (room, services, consumptions). Staff/Admin access.
+    folio_row = folio.get_folio(get_db_connection(), id)
+    if folio_row is None:
+        return jsonify({'error': f'No folio for reservation {id}.'}), 404
+    return jsonify(folio_row)
+
 @app.route('/reservations/<int:id>/cancel', methods=['POST'])
 @require_role('staff')
 def cancel_reservation(id):
     # Handles reservation cancellation. Staff/Admin access.
     try:
-        conn = get_db_connection()
-        reservation = conn.execute('SELECT id_chambre, statut, date_debut FROM reservations WHERE id_reservation = ?', (id,)).fetchone()
-        if not reservation:
-            conn.close(); flash('Reservation not found.', 'warning'); return redirect(url_for('view_reservations'))
-        if reservation['statut'] != 'Confirmée':
-             conn.close(); flash(f'Reservation {id} is already {reservation["statut"]} and cannot be cancelled.', 'warning'); return redirect(url_for('view_reservations'))
-        # Check if cancellation is allowed (before check-in date)
-        # if date.fromisoformat(reservation['date_debut']) <= date.today():
-        #      conn.close(); flash('Cannot cancel reservation on or after check-in date.', 'warning'); return redirect(url_for('view_reservations'))
-
-        id_chambre = reservation['id_chambre']
-        conn.execute('UPDATE reservations SET statut = ? WHERE id_reservation = ?', ('Annulée', id))
-
-        # Check if room should become 'Libre' (no other *current* confirmed bookings)
-        today_str = datetime.now().strftime('%Y-%m-%d')
-        other_booking = conn.execute('''SELECT 1 FROM reservations WHERE id_chambre = ? AND id_reservation != ? AND statut = 'Confirmée'
-                                        AND date(date_debut) <= date(?) AND date(date_fin) > date(?) LIMIT 1''',
-                                     (id_chambre, id, today_str, today_str)).fetchone()
-        if not other_booking:
-             # Only set to Libre if not currently 'En nettoyage'
-             conn.execute("UPDATE chambres SET statut = 'Libre' WHERE id_chambre = ? AND statut != 'En nettoyage'", (id_chambre,))
-
-        conn.commit()
-        conn.close()
+        booking.cancel_reservation(get_db_connection(), availability, id)
         flash(f'Reservation {id} cancelled successfully.', 'success')
+    except booking.BookingError as e:
+        flash_booking_error(e)
     except Exception as e:
         flash(f'Error cancelling reservation {id}: {str(e)}', 'danger')
     return redirect(url_for('view_reservations'))
@@ -676,23 +707,45 @@ def cancel_reservation(id):
 # --- Consommations (Utilities) ---
 @app.route('/consommations')
 @require_role('staff')
+@versions.conditional('consommations', 'chambres')
 def view_consommations():
     # Renders the list of consumptions. Staff/Admin access.
     try:
         conn = get_db_connection()
-        consommations = conn.execute('''
+        filters, where, params = build_filters(request.args, {
+            'id_chambre': ('co.id_chambre = ?', int),
+            'type_consommation': ('co.type_consommation = ?', str),
+            'date_from': ('co.date_releve >= ?', iso_date),
+            'date_to': ('co.date_releve <= ?', iso_date),
+        })
+        consommations = keyset_page(conn, '''
             SELECT co.*, ch.numero_chambre
             FROM consommations co
             JOIN chambres ch ON co.id_chambre = ch.id_chambre
-            ORDER BY co.date_releve DESC, co.id_consommation DESC
-        ''').fetchall()
-        chambres = conn.execute('SELECT id_chambre, numero_chambre FROM chambres ORDER BY numero_chambre').fetchall()
-        conn.close()
+        ''', [('co.date_releve', 'date_releve'), ('co.id_consommation', 'id_consommation')], request.args, where, params, filters)
+        chambres = Lazy(lambda: conn.execute('SELECT id_chambre, numero_chambre FROM chambres ORDER BY numero_chambre'))
+        # Monthly totals for the same filters, from the rollup tables (rollups.py)
+        monthly = rollups.summary(conn, 'month', filters.get('date_from'), filters.get('date_to'),
+                                  filters.get('id_chambre'), filters.get('type_consommation'))
         # Renders templates/consommations.html
-        return render_template('consommations.html', consommations=consommations, chambres=chambres)
+        return render_template('consommations.html', consommations=consommations, chambres=chambres, monthly=monthly)
     except Exception as e:
         flash(f'Error fetching consumptions: {str(e)}', 'danger')
-        return render_template('consommations.html', consommations=[], chambres=[])
+        return render_template('consommations.html', consommations=[], chambres=[], monthly=[])
+
+@app.route('/consommations/summary')
+@require_role('staff')
+def consommations_summary():
+    # JSON totals per period and type: ?granularity=day|month&date_from=&date_to=&id_chambre=&type_consommation=&by_room=1
+    try:
+        args = request.args
+        rows = rollups.summary(get_db_connection(), args.get('granularity', 'month'),
+                               iso_date(args['date_from']) if args.get('date_from') else None,
+                               iso_date(args['date_to']) if args.get('date_to') else None,
+                               args.get('id_chambre') or None, args.get('type_consommation') or None, args.get('by_room') == '1')
+        return jsonify(rows)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid summary parameters: {e}'}), 400
 
 @app.route('/consommations/add', methods=['POST'])
 @require_role('staff')
@@ -711,10 +764,9 @@ def add_consommation():
     # Try to find active reservation for linking
     id_reservation = None
     try:
+        date_releve = date.fromisoformat(date_releve).isoformat() # Normalised so indexed comparisons hold
         conn = get_db_connection()
-        res = conn.execute('''SELECT id_reservation FROM reservations WHERE id_chambre = ? AND statut = 'Confirmée'
-                              AND date(?) BETWEEN date(date_debut) AND date(date_fin, '-1 day')
-                              ORDER BY id_reservation DESC LIMIT 1''', (id_chambre, date_releve)).fetchone()
+        res = conn.execute(booking.ACTIVE_RESERVATION_SQL, (id_chambre, date_releve, date_releve)).fetchone()
         if res: id_reservation = res['id_reservation']
 
         conn.execute('''INSERT INTO consommations
@@ -724,13 +776,35 @@ def add_consommation():
         conn.commit()
         flash('Consumption record added successfully!', 'success')
     except ValueError:
-        flash('Invalid numeric value for consumption or cost.', 'danger')
+        flash('Invalid reading date or numeric value for consumption or cost.', 'danger')
     except sqlite3.IntegrityError as e:
         flash(f'Database error: {e}. Check types/constraints.', 'danger')
     except Exception as e:
         flash(f'Error adding consumption: {str(e)}', 'danger')
-    finally:
-        if conn: conn.close() # Ensure connection is closed
+    return redirect(url_for('view_consommations'))
+
+@app.route('/consommations/import', methods=['POST'])
+@require_role('staff')
+def import_consommations():
+    # Bulk CSV/JSONL import, from a 'file' upload or the raw request body. Staff/Admin access.
+    # Answers JSON to API clients (Accept: application/json), otherwise flashes and redirects.
+    upload = request.files.get('file')
+    fmt = request.values.get('format') or ingest.detect_format(upload.filename if upload else None,
+                                                               'jsonl' if 'json' in (request.mimetype or '') else 'csv')
+    wants_json = request.accept_mimetypes.accept_json and not request.accept_mimetypes.accept_html
+    try:
+        stream = ingest.text_stream(upload.stream if upload else request.stream)
+        report = ingest.import_readings(get_db_connection(), stream, fmt)
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        if wants_json:
+            return jsonify({'error': f'Invalid import file: {e}'}), 400
+        flash(f'Invalid import file: {e}', 'danger'); return redirect(url_for('view_consommations'))
+    if wants_json:
+        return jsonify(report)
+    flash(f"Imported {report['inserted']} readings ({report['linked']} linked to a stay) in {report['elapsed_ms']} ms "
+          f"({report['rows_per_second']} rows/s); {report['rejected']} rejected.", 'success' if not report['rejected'] else 'warning')
+    for error in report['errors'][:5]:
+        flash(f"Line {error['line']}: {error['error']}", 'warning')
     return redirect(url_for('view_consommations'))
 
 # Add Edit/Delete routes for Consommations if needed
@@ -738,11 +812,19 @@ def add_consommation():
 # --- Factures (Invoices) ---
 @app.route('/factures')
 @require_role('staff')
+@versions.conditional('factures', 'reservations', 'clients', 'chambres')
 def view_factures():
     # Renders the list of invoices. Staff/Admin access.
     try:
         conn = get_db_connection()
-        factures = conn.execute('''
+        filters, where, params = build_filters(request.args, {
+            'statut': ('f.statut = ?', str),
+            'id_chambre': ('r.id_chambre = ?', int),
+            'id_client': ('r.id_client = ?', int),
+            'date_from': ('f.date_emission >= ?', iso_date),
+            'date_to': ('f.date_emission <= ?', iso_date),
+        })
+        factures = keyset_page(conn, '''
             SELECT f.*, r.date_debut, r.date_fin,
                    c.nom || ' ' || c.prenom AS client_name, c.email,
                    ch.numero_chambre
@@ -750,16 +832,14 @@ def view_factures():
             JOIN reservations r ON f.id_reservation = r.id_reservation
             JOIN clients c ON r.id_client = c.id_client
             JOIN chambres ch ON r.id_chambre = ch.id_chambre
-            ORDER BY f.date_emission DESC, f.id_facture DESC
-        ''').fetchall()
-        reservations_needing_invoice = conn.execute('''
+        ''', [('f.date_emission', 'date_emission'), ('f.id_facture', 'id_facture')], request.args, where, params, filters)
+        reservations_needing_invoice = Lazy(lambda: conn.execute('''
             SELECT r.id_reservation, r.date_debut, r.date_fin, c.nom || ' ' || c.prenom AS client_name, ch.numero_chambre
             FROM reservations r JOIN clients c ON r.id_client = c.id_client JOIN chambres ch ON r.id_chambre = ch.id_chambre
             WHERE r.statut IN ('Confirmée', 'Terminée')
             AND r.id_reservation NOT IN (SELECT id_reservation FROM factures)
             ORDER BY r.date_fin DESC, r.id_reservation DESC
-        ''').fetchall()
-        conn.close()
+        '''))
         # Renders templates/factures.html
         return render_template('factures.html', factures=factures, reservations_needing_invoice=reservations_needing_invoice)
     except Exception as e:
@@ -775,52 +855,32 @@ def generate_facture():
         flash('Please select a reservation to generate an invoice.', 'warning')
         return redirect(url_for('view_factures'))
     try:
-        conn = get_db_connection()
-        # Check if invoice already exists for this reservation
-        existing = conn.execute('SELECT 1 FROM factures WHERE id_reservation = ?', (id_reservation,)).fetchone()
-        if existing:
-             conn.close(); flash(f'Invoice already exists for reservation {id_reservation}.', 'warning'); return redirect(url_for('view_factures'))
-
-        # Get reservation details needed for calculation
-        reservation = conn.execute('''SELECT id_chambre, date_debut, date_fin, prix_nuit_applique, statut
-                                     FROM reservations WHERE id_reservation = ?''', (id_reservation,)).fetchone()
-        if not reservation or reservation['statut'] == 'Annulée':
-            conn.close(); flash('Cannot generate invoice: Reservation not found or is cancelled.', 'warning'); return redirect(url_for('view_factures'))
-
-        # --- Calculate Invoice Components ---
-        date_debut = date.fromisoformat(reservation['date_debut'])
-        date_fin = date.fromisoformat(reservation['date_fin'])
-        nights = max(1, (date_fin - date_debut).days)
-        montant_chambre = nights * reservation['prix_nuit_applique']
-
-        # Calculate total cost of services linked to this reservation
-        services_res = conn.execute('SELECT SUM(s.prix * rs.quantite) as total FROM reservation_services rs JOIN services s ON rs.id_service = s.id_service WHERE rs.id_reservation = ?', (id_reservation,)).fetchone()
-        montant_services = services_res['total'] if services_res and services_res['total'] is not None else 0
-
-        # Calculate total cost of consumptions during the reservation period
-        consommations_res = conn.execute('''SELECT SUM(co.valeur * co.cout_unitaire) as total FROM consommations co
-                                           WHERE co.id_chambre = ? AND date(co.date_releve) >= date(?) AND date(co.date_releve) < date(?)''',
-                                        (reservation['id_chambre'], reservation['date_debut'], reservation['date_fin'])).fetchone()
-        montant_consommations = consommations_res['total'] if consommations_res and consommations_res['total'] is not None else 0
-
-        montant_total = round(montant_chambre + montant_services + montant_consommations, 2)
-        today_str = datetime.now().strftime('%Y-%m-%d')
-
-        # Insert the new invoice record
-        conn.execute('''INSERT INTO factures (id_reservation, montant_chambre, montant_services, montant_consommations, montant_total, date_emission, statut)
-                        VALUES (?, ?, ?, ?, ?, ?, ?)''',
-                     (id_reservation, montant_chambre, montant_services, montant_consommations, montant_total, today_str, 'Non payée'))
-        conn.commit()
-        flash(f'Invoice generated for reservation {id_reservation}. Total: {montant_total:.2f} €', 'success')
-
-    except ValueError:
-        flash('Invalid date or number format during calculation.', 'danger')
+        invoice = booking.generate_invoice(get_db_connection(), id_reservation)
+        flash(f"Invoice generated for reservation {id_reservation}. Total: {invoice['montant_total']:.2f} €", 'success')
+    except booking.BookingError as e:
+        flash_booking_error(e)
     except sqlite3.Error as e:
          flash(f'Database error generating invoice: {str(e)}', 'danger')
     except Exception as e:
         flash(f'Error generating invoice: {str(e)}', 'danger')
-    finally:
-        if conn: conn.close()
+    return redirect(url_for('view_factures'))
+
+@app.route('/factures/generate-batch', methods=['POST'])
+@require_role('staff')
+def generate_factures_batch():
+    # Invoices every eligible reservation at once (optionally only stays ended by 'until'). Staff/Admin access.
+    try:
+        until = date.fromisoformat(request.form['until']) if request.form.get('until') else None
+        summary = billing.generate_invoices(get_db_connection(), until=until)
+        if summary['invoices']:
+            flash(f"Generated {summary['invoices']} invoice(s), total {summary['montant_total']:.2f} €, "
+                  f"in {summary['elapsed_ms']} ms ({summary['per_second']} invoices/s).", 'success')
+        else:
+            flash('No reservations need an invoice.', 'info')
+    except ValueError:
+        flash('Invalid date format for batch invoicing.', 'danger')
+    except sqlite3.Error as e:
+        flash(f'Database error generating invoices: {str(e)}', 'danger')
     return redirect(url_for('view_factures'))
 
 @app.route('/factures/<int:id>/update', methods=['POST'])
@@ -829,35 +889,30 @@ def update_facture(id):
     # Handles updating invoice status and payment method. Staff/Admin access.
     new_status = request.form.get('statut')
     mode_paiement = request.form.get('mode_paiement')
-    valid_statuses = ['Non payée', 'Payée', 'Partiellement payée']
-    valid_payments = ['Carte', 'Espèces', 'Virement', 'Chèque', ''] # Allow empty
-
-    if new_status not in valid_statuses: flash('Invalid status selected.', 'warning'); return redirect(url_for('view_factures'))
-    if mode_paiement not in valid_payments: flash('Invalid payment method selected.', 'warning'); return redirect(url_for('view_factures'))
-    if new_status == 'Payée' and not mode_paiement: flash('Payment method required when marking invoice as Paid.', 'warning'); return redirect(url_for('view_factures'))
-    if new_status == 'Non payée': mode_paiement = None # Clear payment method if unpaid
-
     try:
-        conn = get_db_connection()
-        result = conn.execute('UPDATE factures SET statut = ?, mode_paiement = ? WHERE id_facture = ?',
-                              (new_status, mode_paiement if mode_paiement else None, id))
-        conn.commit()
-        conn.close()
-        if result.rowcount > 0: flash(f'Invoice #{id} status updated to {new_status}.', 'success')
-        else: flash(f'Invoice #{id} not found or no change made.', 'warning')
+        booking.update_invoice(get_db_connection(), id, new_status, mode_paiement)
+        flash(f'Invoice #{id} status updated to {new_status}.', 'success')
+    except booking.BookingError as e:
+        flash_booking_error(e)
     except Exception as e:
         flash(f'Error updating invoice #{id}: {str(e)}', 'danger')
     return redirect(url_for('view_factures'))
 
-
-# --- Avis (Reviews) ---
 @app.route('/avis')
 @login_required
+@versions.conditional('avis', 'clients', 'reservations', 'chambres')
 def view_avis():
     # Renders approved reviews, pending reviews (for admin), and review form (for clients).
     conn = get_db_connection()
     try:
-        approved_avis = conn.execute('SELECT a.*, c.nom || " " || c.prenom AS client_name FROM avis a JOIN clients c ON a.id_client = c.id_client WHERE a.moderated = 1 ORDER BY a.date_avis DESC, a.id_avis DESC').fetchall()
+        filters, where, params = build_filters(request.args, {
+            'note_min': ('a.note >= ?', int),
+            'date_from': ('a.date_avis >= ?', iso_date),
+            'date_to': ('a.date_avis <= ?', iso_date),
+        })
+        approved_avis = keyset_page(conn, '''SELECT a.*, c.nom || ' ' || c.prenom AS client_name FROM avis a JOIN clients c ON a.id_client = c.id_client''',
+                                    [('a.date_avis', 'date_avis'), ('a.id_avis', 'id_avis')], request.args,
+                                    ['a.moderated = 1', *where], params, filters)
         pending_avis = []
         client_reservations_for_review = []
 
@@ -868,18 +923,10 @@ def view_avis():
         if session.get('role') == 'client':
              client_id = session.get('user_id') # Assumes user_id = client_id
              if client_id:
-                 client_reservations_for_review = conn.execute('''
-                     SELECT r.id_reservation, r.date_fin, ch.numero_chambre
-                     FROM reservations r JOIN chambres ch ON r.id_chambre = ch.id_chambre
-                     WHERE r.id_client = ? AND r.statut = 'Terminée'
-                     AND r.id_reservation NOT IN (SELECT id_reservation FROM avis WHERE id_client = ?)
-                     ORDER BY r.date_fin DESC
-                 ''', (client_id, client_id)).fetchall()
+                 client_reservations_for_review = conn.execute(booking.REVIEWABLE_RESERVATIONS_SQL, (client_id, client_id)).fetchall()
     except Exception as e:
         flash(f'Error fetching reviews: {str(e)}', 'danger')
         approved_avis, pending_avis, client_reservations_for_review = [], [], []
-    finally:
-        if conn: conn.close()
 
     # Renders templates/avis.html
     return render_template('avis.html', approved_avis=approved_avis, pending_avis=pending_avis, client_reservations=client_reservations_for_review)
@@ -905,13 +952,12 @@ def add_avis():
         # Verify client owns this completed reservation and hasn't reviewed it yet
         check = conn.execute("SELECT 1 FROM reservations WHERE id_reservation = ? AND id_client = ? AND statut = 'Terminée'", (id_reservation, client_id)).fetchone()
         if not check:
-            conn.close(); flash('Cannot review: Reservation not found, not completed, or does not belong to you.', 'warning'); return redirect(url_for('view_avis'))
+            flash('Cannot review: Reservation not found, not completed, or does not belong to you.', 'warning'); return redirect(url_for('view_avis'))
 
         today = datetime.now().strftime('%Y-%m-%d')
         conn.execute('INSERT INTO avis (id_client, id_reservation, note, commentaire, date_avis, moderated) VALUES (?, ?, ?, ?, ?, 0)',
                      (client_id, id_reservation, note_int, commentaire, today))
         conn.commit()
-        conn.close()
         flash('Review submitted for moderation. Thank you!', 'success')
     except ValueError:
         flash('Invalid rating value.', 'danger')
@@ -919,8 +965,6 @@ def add_avis():
         flash('A review has already been submitted for this reservation.', 'danger')
     except Exception as e:
         flash(f'Error submitting review: {str(e)}', 'danger')
-    finally:
-        if conn and not conn.closed: conn.close() # Ensure connection is closed
 
     return redirect(url_for('view_avis'))
 
@@ -931,7 +975,7 @@ def approve_avis(id):
     try:
         conn = get_db_connection()
         result = conn.execute('UPDATE avis SET moderated = 1 WHERE id_avis = ? AND moderated = 0', (id,))
-        conn.commit(); conn.close()
+        conn.commit()
         if result.rowcount > 0: flash(f'Review {id} approved.', 'success')
         else: flash(f'Review {id} not found or already moderated.', 'warning')
     except Exception as e: flash(f'Error approving review: {str(e)}', 'danger')
@@ -944,7 +988,7 @@ def delete_avis(id):
     try:
         conn = get_db_connection()
         result = conn.execute('DELETE FROM avis WHERE id_avis = ?', (id,))
-        conn.commit(); conn.close()
+        conn.commit()
         if result.rowcount > 0: flash(f'Review {id} deleted.', 'success')
         else: flash(f'Review {id} not found.', 'warning')
     except Exception as e: flash(f'Error deleting review: {str(e)}', 'danger')
@@ -960,9 +1004,11 @@ def forbidden(e):
     return render_template('unauthorized.html', required_role='unknown'), 403
 @app.errorhandler(500)
 def internal_server_error(e):
-    # Log the actual error for debugging
-    print(f"!!! Internal Server Error: {e}")
-    # import traceback; traceback.print_exc() # Uncomment for full traceback in console
+    # Unhandled exceptions were already logged with their traceback by Flask (app.logger)
+    if e.original_exception is None:
+        app.logger.error('Internal Server Error on %s %s: %s', request.method, request.path, e.description)
+    metrics.inc('gesthotel_http_exceptions_total', endpoint=request.endpoint or 'unmatched',
+                exception=type(e.original_exception or e).__name__)
     flash('An unexpected server error occurred. Please contact support if the problem persists.', 'danger')
     return render_template('500.html'), 500
 @app.errorhandler(405) # Method Not Allowed
@@ -970,13 +1016,36 @@ def method_not_allowed(e):
     flash(f'Action not allowed for this URL ({request.method}).', 'warning')
     return redirect(request.referrer or url_for('home'))
 
+# --- Night Audit ---
+def start_night_audit(reloader=False):
+    """Starts the daily night audit thread (night_audit.py), except in the debug reloader's parent process."""
+    if reloader and os.environ.get('WERKZEUG_RUN_MAIN') != 'true':
+        return None # That process only watches files; its child serves requests
+    scheduler = night_audit.NightAuditScheduler(DATABASE, on_run=lambda summary: availability.complete_before(summary['business_date']))
+    scheduler.start()
+    return scheduler
+
+# Under a WSGI server the audit runs in the workers started with NIGHT_AUDIT_SCHEDULER=1
+# (several are safe: a business date is audited once), or in 'python night_audit.py --loop'
+if __name__ != '__main__' and os.environ.get('NIGHT_AUDIT_SCHEDULER') == '1':
+    start_night_audit()
+
 # --- Main Execution ---
 if __name__ == '__main__':
-    db_file = 'gesthotel.db'
+    db_file = DATABASE
     if not os.path.exists(db_file):
          print(f"FATAL ERROR: Database file '{db_file}' not found.")
-         print("Please run 'python database.py' first to create and populate the database.")
+         print("Please run 'python create_db.py' first to create and populate the database.")
          exit(1)
+    with closing(connect(db_file)) as check_conn:
+        pending = migrate.pending_migrations(check_conn)
+    if pending:
+        print(f"WARNING: {len(pending)} pending schema migration(s). Run 'python migrate.py upgrade'.")
+
+    # Night audit thread, on by default here; off when a separate worker runs 'python night_audit.py --loop' (NIGHT_AUDIT_SCHEDULER=0)
+    use_reloader = True # Development ONLY, like debug below
+    if os.environ.get('NIGHT_AUDIT_SCHEDULER', '1') == '1':
+        start_night_audit(reloader=use_reloader)
 
     port = int(os.environ.get('PORT', 5000))
     print(f"--- Starting Gest'Hôtel Flask Server ---")
@@ -985,7 +1054,7 @@ if __name__ == '__main__':
     print(f"-----------------------------------------")
     try:
         # Use debug=True for development ONLY. Turn off for production.
-        app.run(debug=True, host='127.0.0.1', port=port)
+        app.run(debug=True, use_reloader=use_reloader, host='127.0.0.1', port=port)
     except OSError as e:
         if "address already in use" in str(e).lower():
             print(f"\nFATAL ERROR: Port {port} is already in use.")
@@ -0,0 +1,188 @@
+# auth.py - Users, roles, password hashing and API tokens for Gest'Hôtel
+#
+# Roles are ordered: admin > staff > client; a role may use everything the
+# roles below it may. The HTML views keep the cookie session; API clients send
+# the token returned by POST /api/v1/login in the Authorization header.
+#
+# Passwords are stored as PBKDF2-SHA256 hashes, "pbkdf2_sha256$<iterations>$<salt>$<hash>".
+# The work factor for new hashes comes from GESTHOTEL_PASSWORD_ITERATIONS; run
+# `python auth.py calibrate` to measure this machine and pick it. Older hashes
+# are upgraded to the current work factor at the user's next login.
+#
+# API tokens are signed (HMAC-SHA256 with the app's secret key) and expiring
+# (API_TOKEN_MAX_AGE seconds, default 8 hours), and carry the user id, name and
+# role, so checking one needs no database access. Recently verified tokens are
+# kept in a small LRU to skip re-checking the signature. Logging out revokes a
+# token: its id goes into revoked_tokens, and each worker re-reads that list
+# only when its version (versions.py) changes.
+#
+# Usage:
+#   python auth.py calibrate                 # Iterations for ~100 ms per hash on this machine
+#   python auth.py calibrate --target-ms 50
+
+import argparse
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+import versions
+from db import connect
+
+ROLE_LEVELS = {'client': 1, 'staff': 2, 'admin': 3}
+TOKEN_MAX_AGE = int(os.environ.get('API_TOKEN_MAX_AGE', 8 * 3600))
+TOKEN_CACHE_SIZE = int(os.environ.get('API_TOKEN_CACHE_SIZE', 1024))
+PASSWORD_ITERATIONS = int(os.environ.get('GESTHOTEL_PASSWORD_ITERATIONS', 300_000))
+_HASH_SCHEME = 'pbkdf2_sha256'
+
+def role_allows(user_role, required_role):
+    """True if `user_role` meets `required_role` (includes inheritance)."""
+    return ROLE_LEVELS.get(user_role, 0) >= ROLE_LEVELS.get(required_role, 99)
+
+# --- Passwords ---
+def _b64(raw):
+    return base64.b64encode(raw).decode().rstrip('=')
+
+def _unb64(text):
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+def hash_password(password, iterations=None):
+    iterations = iterations or PASSWORD_ITERATIONS
+    salt = secrets.token_bytes(16)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations)
+    return f'{_HASH_SCHEME}${iterations}${_b64(salt)}${_b64(digest)}'
+
+def is_password_hash(stored):
+    return stored.startswith(_HASH_SCHEME + '$')
+
+def check_password(stored, password):
+    """Constant-time check of `password` against a stored hash."""
+    try:
+        scheme, iterations, salt, digest = stored.split('$')
+        if scheme != _HASH_SCHEME:
+            return False
+        candidate = hashlib.pbkdf2_hmac('sha256', password.encode(), _unb64(salt), int(iterations))
+        return hmac.compare_digest(candidate, _unb64(digest))
+    except ValueError:
+        return False
+
+def needs_rehash(stored):
+    return not is_password_hash(stored) or int(stored.split('$')[1]) != PASSWORD_ITERATIONS
+
+def authenticate(conn, username, password):
+    """Returns the users row (id_user, username, role) matching the credentials, or None."""
+    user = conn.execute('SELECT id_user, username, role, password FROM users WHERE username = ?', (username,)).fetchone()
+    if not user or not check_password(user['password'], password):
+        if not user: # Same work as a real check, so response time does not reveal which usernames exist
+            check_password(_dummy_hash(), password)
+        return None
+    if needs_rehash(user['password']):
+        conn.execute('UPDATE users SET password = ? WHERE id_user = ?', (hash_password(password), user['id_user']))
+        conn.commit()
+    return user
+
+_dummy = []
+
+def _dummy_hash():
+    if not _dummy:
+        _dummy.append(hash_password(secrets.token_urlsafe(16)))
+    return _dummy[0]
+
+def calibrate(target_ms=100, probe_iterations=50_000):
+    """PBKDF2 iterations that take about `target_ms` per hash on this machine."""
+    started = time.perf_counter()
+    hashlib.pbkdf2_hmac('sha256', b'calibration', b'0' * 16, probe_iterations)
+    per_iteration_ms = (time.perf_counter() - started) * 1000 / probe_iterations
+    return max(10_000, int(target_ms / per_iteration_ms) // 1000 * 1000)
+
+# --- API Tokens ---
+class RevocationList:
+    """Ids of revoked, unexpired tokens, re-read from revoked_tokens when its version changes."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._revoked = frozenset()
+
+    def current(self):
+        version = versions.cache.current().get('revoked_tokens', (0, 0))[0]
+        with self._lock:
+            if version != self._version:
+                conn = connect()
+                try:
+                    rows = conn.execute('SELECT jti FROM revoked_tokens WHERE expires_at > ?', (int(time.time()),)).fetchall()
+                finally:
+                    conn.close()
+                self._revoked = frozenset(row['jti'] for row in rows)
+                self._version = version
+            return self._revoked
+
+revocations = RevocationList()
+_serializer = None
+_verified = OrderedDict() # token -> claims, most recently used last
+_verified_lock = threading.Lock()
+
+def init_app(app):
+    """Signs API tokens with the app's secret key."""
+    global _serializer
+    _serializer = URLSafeTimedSerializer(app.secret_key, salt='gesthotel-api-token',
+                                         signer_kwargs={'digest_method': hashlib.sha256})
+
+def issue_token(user):
+    """Creates a signed API token for a users row; returns the token string."""
+    claims = {'id_user': user['id_user'], 'username': user['username'], 'role': user['role'],
+              'jti': secrets.token_urlsafe(8), 'exp': int(time.time()) + TOKEN_MAX_AGE}
+    return _serializer.dumps(claims)
+
+def verify_token(token):
+    """Returns the claims of a valid, unrevoked token (id_user, username, role, jti, exp), or None."""
+    with _verified_lock:
+        claims = _verified.get(token)
+        if claims is not None:
+            _verified.move_to_end(token)
+    if claims is None:
+        try:
+            claims = _serializer.loads(token, max_age=TOKEN_MAX_AGE)
+        except BadSignature: # Also raised for expired tokens
+            return None
+        with _verified_lock:
+            _verified[token] = claims
+            while len(_verified) > TOKEN_CACHE_SIZE:
+                _verified.popitem(last=False)
+    if claims['exp'] <= time.time() or claims['jti'] in revocations.current():
+        return None
+    return claims
+
+def claims_from_header(value):
+    """Claims of the token in an Authorization header ("Bearer <token>" or the bare token), or None."""
+    token = (value or '').strip()
+    if token.lower().startswith('bearer '):
+        token = token[7:].strip()
+    return verify_token(token) if token else None
+
+def revoke_token(conn, claims):
+    """Revokes a token in every worker until it would have expired anyway."""
+    conn.execute('INSERT OR IGNORE INTO revoked_tokens (jti, expires_at) VALUES (?, ?)', (claims['jti'], claims['exp']))
+    conn.execute('DELETE FROM revoked_tokens WHERE expires_at <= ?', (int(time.time()),)) # Nothing left to revoke
+    conn.commit()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Gest'Hôtel password hashing calibration")
+    parser.add_argument('command', choices=['calibrate'])
+    parser.add_argument('--target-ms', type=float, default=100, help='time per hash (default: %(default)s ms)')
+    args = parser.parse_args()
+    iterations = calibrate(args.target_ms)
+    started = time.perf_counter()
+    hash_password('calibration', iterations)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    print(f"{iterations} iterations: {elapsed_ms:.1f} ms per hash, about {1000 / elapsed_ms:.0f} logins/s per core "
+          f"(current setting: {PASSWORD_ITERATIONS})")
+    print(f"export GESTHOTEL_PASSWORD_ITERATIONS={iterations}")
+    sys.exit(0)
@@ -0,0 +1,265 @@
+# availability.py - In-process room availability index for Gest'Hôtel
+#
+# Keeps every 'Confirmée' reservation as a half-open night interval
+# [date_debut, date_fin) per room, in arrays sorted by check-in date. Conflict
+# checks and "is room X free from A to B" are answered with a bisect over these
+# arrays, without a round trip to SQLite.
+#
+# The index is per worker process. Writes made through this process keep it
+# current (add / remove / complete_before). Writes from other workers are caught
+# up by ensure_fresh(): when the reservations version (versions.py) has moved, it
+# reloads the rooms of the reservations written since its change_log position
+# (cdc.py), or the whole index if the log was truncated past it. A full reload
+# also runs every AVAILABILITY_RELOAD_SECONDS as a safety net. Booking writes
+# still verify inside their write transaction, so a stale index can never
+# double-book.
+#
+# Usage:
+#   python availability.py check    # Compare the index with the database
+
+import bisect
+import os
+import sys
+import threading
+import time
+from datetime import date
+
+import versions
+
+RELOAD_SECONDS = float(os.environ.get('AVAILABILITY_RELOAD_SECONDS', 60))
+
+def _day(value):
+    """Accepts a date or an ISO string and returns its ordinal (one int per night)."""
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str):
+        value = date.fromisoformat(value[:10])
+    return value.toordinal()
+
+class _RoomSchedule:
+    """Sorted booking intervals of one room.
+
+    `max_end[i]` is the latest check-out among the first i+1 intervals, so the
+    overlap test only needs the predecessor of the requested check-out.
+    """
+    __slots__ = ('starts', 'ends', 'ids', 'max_end')
+
+    def __init__(self):
+        self.starts, self.ends, self.ids, self.max_end = [], [], [], []
+
+    def insert(self, start, end, id_reservation):
+        i = bisect.bisect_right(self.starts, start)
+        self.starts.insert(i, start)
+        self.ends.insert(i, end)
+        self.ids.insert(i, id_reservation)
+        self.max_end.insert(i, 0)
+        self._refresh_max(i)
+
+    def delete(self, id_reservation, start):
+        i = bisect.bisect_left(self.starts, start)
+        while i < len(self.starts) and self.starts[i] == start:
+            if self.ids[i] == id_reservation:
+                for column in (self.starts, self.ends, self.ids, self.max_end):
+                    del column[i]
+                self._refresh_max(i)
+                return True
+            i += 1
+        return False
+
+    def _refresh_max(self, i):
+        running = self.max_end[i - 1] if i > 0 else 0
+        for j in range(i, len(self.ends)):
+            running = max(running, self.ends[j])
+            self.max_end[j] = running
+
+    def overlaps(self, start, end):
+        i = bisect.bisect_left(self.starts, end) - 1 # Last stay arriving before our check-out
+        return i >= 0 and self.max_end[i] > start
+
+    def overlapping_ids(self, start, end):
+        found = []
+        i = bisect.bisect_left(self.starts, end) - 1
+        while i >= 0 and self.max_end[i] > start:
+            if self.ends[i] > start:
+                found.append(self.ids[i])
+            i -= 1
+        return found
+
+class AvailabilityIndex:
+    """Per-room interval index over confirmed reservations."""
+
+    def __init__(self, reload_seconds=RELOAD_SECONDS):
+        self.reload_seconds = reload_seconds
+        self._lock = threading.RLock()
+        self._rooms = {}
+        self._by_id = {} # id_reservation -> (id_chambre, start, end)
+        self.loaded_at = None
+        self.load_ms = 0.0
+        self.table_version = None # reservations version (versions.py) the index is in step with
+        self.log_position = 0 # Last change_log version applied
+        self.catch_ups = 0
+        self.version = 0 # Bumped on every change, lets consumers cache derived data
+
+    # --- Loading ---
+    def load(self, conn):
+        """(Re)builds the whole index from the reservations table."""
+        started = time.perf_counter()
+        table_version = versions.cache.current().get('reservations', (0,))[0]
+        position = conn.execute('SELECT COALESCE(MAX(version), 0) FROM change_log').fetchone()[0] # Read before the rows
+        rows = conn.execute('''SELECT id_reservation, id_chambre, date_debut, date_fin FROM reservations
+                               WHERE statut = 'Confirmée' ORDER BY id_chambre, date_debut''').fetchall()
+        rooms, by_id = {}, {}
+        for id_reservation, id_chambre, debut, fin in rows:
+            start, end = _day(debut), _day(fin)
+            schedule = rooms.get(id_chambre)
+            if schedule is None:
+                schedule = rooms[id_chambre] = _RoomSchedule()
+            # Rows arrive sorted by check-in, so appending keeps the arrays ordered
+            schedule.starts.append(start)
+            schedule.ends.append(end)
+            schedule.ids.append(id_reservation)
+            schedule.max_end.append(max(end, schedule.max_end[-1]) if schedule.max_end else end)
+            by_id[id_reservation] = (id_chambre, start, end)
+        with self._lock:
+            self._rooms, self._by_id = rooms, by_id
+            self.version += 1
+            self.table_version, self.log_position = table_version, position
+            self.loaded_at = time.monotonic()
+            self.load_ms = (time.perf_counter() - started) * 1000
+
+    def reload_room(self, conn, id_chambre):
+        """Refreshes a single room, e.g. after a write from another worker was detected."""
+        rows = conn.execute('''SELECT id_reservation, date_debut, date_fin FROM reservations
+                               WHERE id_chambre = ? AND statut = 'Confirmée' ''', (id_chambre,)).fetchall()
+        with self._lock:
+            for id_reservation in self._rooms.pop(id_chambre, _RoomSchedule()).ids:
+                self._by_id.pop(id_reservation, None)
+            self.version += 1
+            for id_reservation, debut, fin in rows:
+                self._add_locked(id_chambre, id_reservation, _day(debut), _day(fin))
+
+    def catch_up(self, conn):
+        """Reloads the rooms of the reservations written since log_position; False if the log no longer has them."""
+        position = self.log_position
+        horizon = conn.execute("SELECT value FROM change_log_state WHERE name = 'horizon'").fetchone()
+        if horizon and position < horizon[0]:
+            return False # Truncated or invalidated (bulk load): only a full load is safe
+        latest = conn.execute('SELECT COALESCE(MAX(version), 0) FROM change_log').fetchone()[0]
+        ids = [row[0] for row in conn.execute('''SELECT DISTINCT pk FROM change_log
+                                                 WHERE table_name = 'reservations' AND version > ? AND version <= ?''',
+                                              (position, latest))]
+        rooms = set()
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            rooms.update(row[0] for row in conn.execute(
+                f"SELECT DISTINCT id_chambre FROM reservations WHERE id_reservation IN ({', '.join('?' for _ in chunk)})", chunk))
+        with self._lock:
+            rooms.update(self._by_id[i][0] for i in ids if i in self._by_id) # Deleted, or moved to another room
+        for id_chambre in rooms:
+            self.reload_room(conn, id_chambre)
+        self.log_position = max(position, latest)
+        self.catch_ups += 1
+        return True
+
+    def ensure_fresh(self, conn):
+        """Loads the index on first use, catches up with writes of other workers and reloads it
+        once it is older than reload_seconds."""
+        if self.loaded_at is None or time.monotonic() - self.loaded_at > self.reload_seconds:
+            self.load(conn)
+            return
+        table_version = versions.cache.current().get('reservations', (0,))[0]
+        if table_version != self.table_version: # Someone wrote reservations (this process included)
+            if not self.catch_up(conn):
+                self.load(conn)
+                return
+            self.table_version = table_version
+
+    # --- Queries ---
+    def is_free(self, id_chambre, start, end):
+        """True when no confirmed stay of the room overlaps the nights [start, end)."""
+        with self._lock:
+            schedule = self._rooms.get(int(id_chambre))
+            return schedule is None or not schedule.overlaps(_day(start), _day(end))
+
+    def conflicts(self, id_chambre, start, end):
+        """Ids of the confirmed reservations overlapping [start, end) for a room."""
+        with self._lock:
+            schedule = self._rooms.get(int(id_chambre))
+            return schedule.overlapping_ids(_day(start), _day(end)) if schedule else []
+
+    def free_rooms(self, room_ids, start, end):
+        """Filters `room_ids` down to the rooms free for the whole stay."""
+        start, end = _day(start), _day(end)
+        with self._lock:
+            return [r for r in room_ids if r not in self._rooms or not self._rooms[r].overlaps(start, end)]
+
+    def intervals(self):
+        """All indexed stays as parallel lists (id_chambre, start ordinal, end ordinal)."""
+        with self._lock:
+            entries = list(self._by_id.values())
+        return [e[0] for e in entries], [e[1] for e in entries], [e[2] for e in entries]
+
+    # --- Write-through maintenance ---
+    def add(self, id_chambre, id_reservation, start, end):
+        with self._lock:
+            self._add_locked(int(id_chambre), id_reservation, _day(start), _day(end))
+
+    def _add_locked(self, id_chambre, id_reservation, start, end):
+        schedule = self._rooms.get(id_chambre)
+        if schedule is None:
+            schedule = self._rooms[id_chambre] = _RoomSchedule()
+        schedule.insert(start, end, id_reservation)
+        self._by_id[id_reservation] = (id_chambre, start, end)
+        self.version += 1
+
+    def remove(self, id_reservation):
+        """Drops a reservation (cancelled or completed). Unknown ids are ignored."""
+        with self._lock:
+            entry = self._by_id.pop(id_reservation, None)
+            if entry:
+                self._rooms[entry[0]].delete(id_reservation, entry[1])
+                self.version += 1
+
+    def complete_before(self, day):
+        """Mirrors `UPDATE ... SET statut = 'Terminée' WHERE date_fin < day`."""
+        cutoff = _day(day)
+        with self._lock:
+            done = [rid for rid, (_, _, end) in self._by_id.items() if end < cutoff]
+            for id_reservation in done:
+                self.remove(id_reservation)
+        return len(done)
+
+    # --- Diagnostics ---
+    def check_consistency(self, conn):
+        """Compares the index with the database; returns the differences found."""
+        rows = conn.execute('''SELECT id_reservation, id_chambre, date_debut, date_fin FROM reservations
+                               WHERE statut = 'Confirmée' ''').fetchall()
+        expected = {r[0]: (r[1], _day(r[2]), _day(r[3])) for r in rows}
+        with self._lock:
+            actual = dict(self._by_id)
+        missing = sorted(set(expected) - set(actual))
+        extra = sorted(set(actual) - set(expected))
+        changed = sorted(rid for rid in set(expected) & set(actual) if expected[rid] != actual[rid])
+        return {'consistent': not (missing or extra or changed), 'indexed': len(actual), 'in_database': len(expected),
+                'missing': missing, 'extra': extra, 'changed': changed}
+
+    def stats(self):
+        with self._lock:
+            return {'rooms': len(self._rooms), 'reservations': len(self._by_id), 'load_ms': round(self.load_ms, 2),
+                    'catch_ups': self.catch_ups,
+                    'age_seconds': round(time.monotonic() - self.loaded_at, 1) if self.loaded_at else None}
+
+index = AvailabilityIndex()
+
+if __name__ == '__main__':
+    from db import connect
+    if sys.argv[1:] != ['check']:
+        print("Usage: python availability.py check")
+        sys.exit(2)
+    conn = connect()
+    index.load(conn)
+    report = index.check_consistency(conn)
+    conn.close()
+    print(f"Indexed {report['indexed']} confirmed reservations in {index.load_ms:.1f} ms "
+          f"({report['in_database']} in database): {'consistent' if report['consistent'] else 'INCONSISTENT'}")
+    sys.exit(0 if report['consistent'] else 1)
@@ -0,0 +1,32 @@
+# baselines.py - Saved performance baselines shared by loadtest.py and queryplans.py
+#
+# A baseline is one JSON file, DIRECTORY/NAME.json, holding the name, creation
+# time, git commit and settings of a run next to its results, so a later run
+# with --compare NAME can tell what it is measured against.
+
+import json
+import os
+import subprocess
+from datetime import datetime
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def git_commit():
+    """Short hash of the checked-out commit, or None outside a git checkout."""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+def load(directory, name):
+    with open(os.path.join(directory, f'{name}.json'), encoding='utf-8') as f:
+        return json.load(f)
+
+def save(directory, name, settings, **results):
+    """Writes baseline NAME (results as keyword sections, e.g. routes=...); returns its path."""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{name}.json')
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'name': name, 'created': datetime.now().isoformat(timespec='seconds'), 'commit': git_commit(),
+                   'settings': settings, **results}, f, indent=2, ensure_ascii=False)
+    return path
@@ -0,0 +1,64 @@
+# bench_api.py - Compares the JSON API with the HTML views, in process
+#
+# Drives both through Flask's test client (no network), logged in as an admin,
+# and reports requests per second, mean latency and response size per pair.
+# List pairs ask for a page of 50 rows (?per_page=50 on the HTML views,
+# ?limit=50 on /api/v1); /chambres renders every room, as it is not paginated.
+#
+# Usage:
+#   python bench_api.py                    # Against GESTHOTEL_DB (default gesthotel.db)
+#   python bench_api.py --requests 500
+#   python bench_api.py --db /tmp/big.db   # Any migrated database
+
+import argparse
+import os
+import time
+
+PAIRS = [
+    ('chambres', '/chambres', '/api/v1/chambres?limit=50'),
+    ('clients', '/clients?per_page=50', '/api/v1/clients?limit=50'),
+    ('reservations', '/reservations?per_page=50', '/api/v1/reservations?limit=50'),
+    ('factures', '/factures?per_page=50', '/api/v1/factures?limit=50'),
+    ('avis', '/avis?per_page=50', '/api/v1/avis?limit=50'),
+    ('dashboard', '/dashboard', '/api/v1/dashboard'),
+]
+
+def measure(client, path, requests, headers=None):
+    """Returns (requests/s, mean ms, bytes per response) for `requests` GETs of `path`."""
+    client.get(path, headers=headers) # Warm-up (pool, caches, template compilation)
+    size = 0
+    started = time.perf_counter()
+    for _ in range(requests):
+        response = client.get(path, headers=headers)
+        size = len(response.get_data())
+    elapsed = time.perf_counter() - started
+    return requests / elapsed, elapsed / requests * 1000, size
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Gest'Hôtel JSON API vs HTML benchmark")
+    parser.add_argument('--requests', type=int, default=200, help='requests per route (default: %(default)s)')
+    parser.add_argument('--db', default=None, help='database file (default: GESTHOTEL_DB)')
+    args = parser.parse_args()
+    if args.db:
+        os.environ['GESTHOTEL_DB'] = args.db # Must be set before db.py is imported
+
+    import auth
+    from app import app
+    from db import connect
+
+    conn = connect()
+    admin = conn.execute("SELECT id_user, username, role FROM users WHERE role = 'admin' LIMIT 1").fetchone()
+    conn.close()
+    if not admin:
+        raise SystemExit('No admin user in the database.')
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session.update(user_id=admin['id_user'], username=admin['username'], role=admin['role'])
+    headers = {'Authorization': f'Bearer {auth.issue_token(admin)}'}
+
+    print(f"{'route':<14}{'HTML req/s':>12}{'API req/s':>12}{'speed-up':>10}{'HTML ms':>10}{'API ms':>9}{'HTML KiB':>10}{'API KiB':>9}")
+    for name, html_path, api_path in PAIRS:
+        html_rps, html_ms, html_size = measure(client, html_path, args.requests)
+        api_rps, api_ms, api_size = measure(client, api_path, args.requests, headers)
+        print(f'{name:<14}{html_rps:>12.0f}{api_rps:>12.0f}{api_rps / html_rps:>9.1f}x'
+              f'{html_ms:>10.2f}{api_ms:>9.2f}{html_size / 1024:>10.1f}{api_size / 1024:>9.1f}')
@@ -0,0 +1,71 @@
+# billing.py - Set-based batch invoicing for Gest'Hôtel
+#
+# Invoices every reservation that still needs one (confirmed or completed, not
+# yet invoiced) with a single INSERT ... SELECT over their running folios
+# (folio.py), written in one transaction. Amounts match generate_facture in
+# app.py, which reads the same folio.
+#
+# Usage:
+#   python billing.py                      # Invoice everything eligible
+#   python billing.py --until 2026-01-31   # Only stays checked out by that date
+#   python billing.py --dry-run            # Count and total without writing
+
+import argparse
+import sys
+import time
+from contextlib import closing
+from datetime import date
+
+import metrics
+from db import connect
+
+def _invoices_sql(until):
+    """SELECT producing one invoice row per eligible reservation, from its running folio."""
+    sql = '''
+        SELECT r.id_reservation, fo.montant_chambre, fo.montant_services, fo.montant_consommations,
+               ROUND(fo.montant_chambre + fo.montant_services + fo.montant_consommations, 2) AS montant_total,
+               :today AS date_emission, 'Non payée' AS statut
+        FROM reservations r JOIN folios fo ON fo.id_reservation = r.id_reservation
+        WHERE r.statut IN ('Confirmée', 'Terminée')
+        AND NOT EXISTS (SELECT 1 FROM factures f WHERE f.id_reservation = r.id_reservation)'''
+    return sql + ' AND r.date_fin <= :until' if until else sql
+
+def generate_invoices(conn, until=None, dry_run=False, today=None):
+    """Invoices all eligible reservations in one transaction.
+
+    `until` limits the batch to stays with date_fin on or before that date.
+    Returns a summary with the count, total amount and throughput.
+    """
+    params = {'today': (today or date.today()).isoformat(), 'until': until.isoformat() if until else None}
+    started = time.perf_counter()
+    conn.execute('BEGIN IMMEDIATE') # Eligibility is evaluated under the write lock: no duplicate invoices
+    try:
+        if dry_run:
+            count, total = conn.execute(f'SELECT COUNT(*), COALESCE(SUM(montant_total), 0) FROM ({_invoices_sql(until)})', params).fetchone()
+            conn.rollback()
+        else:
+            first_id = conn.execute('SELECT COALESCE(MAX(id_facture), 0) FROM factures').fetchone()[0]
+            conn.execute(f'''INSERT INTO factures (id_reservation, montant_chambre, montant_services, montant_consommations,
+                                                   montant_total, date_emission, statut)
+                             {_invoices_sql(until)}''', params)
+            count, total = conn.execute('SELECT COUNT(*), COALESCE(SUM(montant_total), 0) FROM factures WHERE id_facture > ?',
+                                        (first_id,)).fetchone()
+            conn.commit()
+            metrics.inc('gesthotel_invoices_generated_total', count, mode='batch')
+    except Exception:
+        conn.rollback()
+        raise
+    elapsed = time.perf_counter() - started
+    return {'invoices': count, 'montant_total': round(total, 2), 'dry_run': dry_run,
+            'elapsed_ms': round(elapsed * 1000, 2), 'per_second': round(count / elapsed) if elapsed > 0 else None}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Gest'Hôtel batch invoicing")
+    parser.add_argument('--until', type=date.fromisoformat, default=None, help='only stays checked out on or before this date (YYYY-MM-DD)')
+    parser.add_argument('--dry-run', action='store_true', help='compute without writing invoices')
+    args = parser.parse_args()
+    with closing(connect()) as conn:
+        summary = generate_invoices(conn, until=args.until, dry_run=args.dry_run)
+    print(f"{'Would generate' if args.dry_run else 'Generated'} {summary['invoices']} invoice(s), "
+          f"total {summary['montant_total']:.2f} €, in {summary['elapsed_ms']} ms ({summary['per_second']} invoices/s)")
+    sys.exit(0)
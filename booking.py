@@ -0,0 +1,213 @@
+# booking.py - Reservation and invoice operations shared by the HTML routes and the JSON API
+#
+# Each function validates its input, performs the write in one transaction and
+# keeps the in-process caches (availability index, analytics) in step. Business
+# rule violations raise BookingError carrying a user-facing message and the HTTP
+# status the API answers with; the HTML routes flash the message instead.
+
+import logging
+from datetime import date, datetime
+
+import analytics
+import folio
+import metrics
+import tariff_rules
+
+log = logging.getLogger(__name__)
+
+# A confirmed stay of the room overlapping [date_debut, date_fin); hot statement checked by queryplans.py
+CONFLICT_SQL = '''SELECT 1 FROM reservations WHERE id_chambre = ? AND statut = 'Confirmée'
+                  AND date_debut < ? AND date_fin > ? LIMIT 1'''
+# Reservation lookups of app.py routes (hot statements checked by queryplans.py)
+# Confirmed stay in the room on the reading date, to link a consumption reading to it
+ACTIVE_RESERVATION_SQL = '''SELECT id_reservation FROM reservations WHERE id_chambre = ? AND statut = 'Confirmée'
+                            AND date_debut <= ? AND date_fin > ?
+                            ORDER BY id_reservation DESC LIMIT 1'''
+# Completed stays of a client not reviewed yet; NOT EXISTS probes avis by its unique id_reservation
+# (a NOT IN list scanned every review of the table)
+REVIEWABLE_RESERVATIONS_SQL = '''SELECT r.id_reservation, r.date_fin, ch.numero_chambre
+                                 FROM reservations r JOIN chambres ch ON r.id_chambre = ch.id_chambre
+                                 WHERE r.id_client = ? AND r.statut = 'Terminée'
+                                 AND NOT EXISTS (SELECT 1 FROM avis a WHERE a.id_reservation = r.id_reservation AND a.id_client = ?)
+                                 ORDER BY r.date_fin DESC'''
+
+class BookingError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+def calculate_applied_price(base_price, reduction_percentage):
+    """Calculates price after percentage reduction, ensuring valid inputs."""
+    try:
+        base = float(base_price)
+        reduction = float(reduction_percentage)
+        discount = max(0.0, min(100.0, reduction)) # Clamp reduction between 0 and 100
+        applied = base * (1 - discount / 100.0)
+        return round(applied, 2)
+    except (ValueError, TypeError):
+        # Return base price or raise an error if inputs are invalid
+        log.warning('Invalid input for price calculation: base=%r, reduction=%r', base_price, reduction_percentage)
+        metrics.inc('gesthotel_price_calculation_errors_total')
+        return base_price # Fallback to base price
+
+# --- Reservations ---
+def create_reservation(conn, availability, id_client, id_chambre, id_tarif, date_debut, date_fin):
+    """Books a room. Returns (id_reservation, prix_applique, tariff_rules.Rule applied).
+
+    Without `id_tarif` the applicable tariff with the largest reduction is chosen;
+    an explicit tariff must apply to the stay. `date_debut` / `date_fin` are dates
+    or ISO strings (ValueError if malformed).
+    """
+    date_debut, date_fin = date.fromisoformat(str(date_debut)), date.fromisoformat(str(date_fin))
+    today = date.today()
+    if date_debut < today:
+        raise BookingError('Check-in date cannot be in the past.')
+    if date_debut >= date_fin:
+        raise BookingError('Check-out date must be after check-in date.')
+
+    # Check for booking conflicts for the chosen room (in-memory index, no query while it says free)
+    availability.ensure_fresh(conn)
+    if not availability.is_free(id_chambre, date_debut, date_fin):
+        # A hit is only a hint: another worker may have cancelled since the index caught up
+        if conn.execute(CONFLICT_SQL, (id_chambre, date_fin.isoformat(), date_debut.isoformat())).fetchone():
+            metrics.inc('gesthotel_reservation_conflicts_total', check='index')
+            raise BookingError('Room conflict: This room is already booked for the selected dates.', 409)
+        availability.reload_room(conn, int(id_chambre))
+
+    # Fetch data needed for price calculation
+    chambre = conn.execute('SELECT prix_nuit_base FROM chambres WHERE id_chambre = ?', (id_chambre,)).fetchone()
+    client = conn.execute('SELECT statut_fidelite FROM clients WHERE id_client = ?', (id_client,)).fetchone()
+    if not chambre or not client:
+        raise BookingError('Invalid room or client selected.')
+
+    # --- Apply Tariff Logic: conditions compiled once by tariff_rules.py ---
+    stay = tariff_rules.stay(client['statut_fidelite'], date_debut, date_fin, today)
+    if id_tarif:
+        try:
+            tarif = tariff_rules.engine.rule(conn, int(id_tarif)) # None for an unknown tariff or an unparseable condition
+        except (TypeError, ValueError):
+            tarif = None # Not an id: must not pass for a date error
+        if not tarif:
+            raise BookingError('Invalid tariff selected.')
+        if not tarif.applies(stay):
+            raise BookingError(f'Tariff "{tarif.nom_tarif}" does not apply to this stay (condition: {tarif.condition}).')
+    else:
+        tarif = tariff_rules.engine.best(conn, stay)
+        if not tarif:
+            raise BookingError('No tariff applies to this stay.')
+    id_tarif = tarif.id_tarif
+    prix_applique = calculate_applied_price(chambre['prix_nuit_base'], tarif.reduction)
+
+    # Re-check under the write lock: another worker may have booked the room since our index was loaded
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conflict = conn.execute(CONFLICT_SQL, (id_chambre, date_fin.isoformat(), date_debut.isoformat())).fetchone()
+        if conflict:
+            conn.rollback()
+            availability.reload_room(conn, int(id_chambre))
+            metrics.inc('gesthotel_reservation_conflicts_total', check='write_lock')
+            raise BookingError('Room conflict: This room is already booked for the selected dates.', 409)
+
+        # Insert the reservation
+        cursor = conn.cursor()
+        cursor.execute('''INSERT INTO reservations
+                          (id_client, id_chambre, id_tarif, date_debut, date_fin, prix_nuit_applique, statut)
+                          VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                       (id_client, id_chambre, id_tarif, date_debut.isoformat(), date_fin.isoformat(), prix_applique, 'Confirmée'))
+        id_reservation = cursor.lastrowid
+
+        # Update room status if reservation starts today
+        if date_debut == today:
+            cursor.execute('UPDATE chambres SET statut = ? WHERE id_chambre = ?', ('Occupé', id_chambre))
+        conn.commit()
+    except BookingError:
+        raise
+    except Exception:
+        conn.rollback()
+        raise
+    availability.add(id_chambre, id_reservation, date_debut, date_fin)
+    metrics.inc('gesthotel_reservations_created_total')
+    return id_reservation, prix_applique, tarif
+
+def cancel_reservation(conn, availability, id_reservation):
+    """Cancels a confirmed reservation and frees its room if nobody else is staying tonight."""
+    reservation = conn.execute('SELECT id_chambre, statut, date_debut FROM reservations WHERE id_reservation = ?',
+                               (id_reservation,)).fetchone()
+    if not reservation:
+        raise BookingError('Reservation not found.', 404)
+    if reservation['statut'] != 'Confirmée':
+        raise BookingError(f'Reservation {id_reservation} is already {reservation["statut"]} and cannot be cancelled.', 409)
+    # Check if cancellation is allowed (before check-in date)
+    # if date.fromisoformat(reservation['date_debut']) <= date.today():
+    #      raise BookingError('Cannot cancel reservation on or after check-in date.')
+
+    id_chambre = reservation['id_chambre']
+    today_str = datetime.now().strftime('%Y-%m-%d')
+    try:
+        conn.execute('UPDATE reservations SET statut = ? WHERE id_reservation = ?', ('Annulée', id_reservation))
+        # Check if room should become 'Libre' (no other *current* confirmed bookings)
+        other_booking = conn.execute('''SELECT 1 FROM reservations WHERE id_chambre = ? AND id_reservation != ? AND statut = 'Confirmée'
+                                        AND date_debut <= ? AND date_fin > ? LIMIT 1''',
+                                     (id_chambre, id_reservation, today_str, today_str)).fetchone()
+        if not other_booking:
+            # Only set to Libre if not currently 'En nettoyage'
+            conn.execute("UPDATE chambres SET statut = 'Libre' WHERE id_chambre = ? AND statut != 'En nettoyage'", (id_chambre,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    availability.remove(id_reservation)
+    if reservation['date_debut'] < today_str:
+        analytics.engine.invalidate() # Past nights changed
+
+# --- Invoices ---
+def generate_invoice(conn, id_reservation):
+    """Issues the invoice of one reservation from its running folio. Returns the invoice as a dict."""
+    # Check if invoice already exists for this reservation
+    if conn.execute('SELECT 1 FROM factures WHERE id_reservation = ?', (id_reservation,)).fetchone():
+        raise BookingError(f'Invoice already exists for reservation {id_reservation}.', 409)
+    reservation = conn.execute('SELECT statut FROM reservations WHERE id_reservation = ?', (id_reservation,)).fetchone()
+    if not reservation or reservation['statut'] == 'Annulée':
+        raise BookingError('Cannot generate invoice: Reservation not found or is cancelled.', 404)
+
+    # --- Invoice Components: the running folio (folio.py), one row read ---
+    folio_row = folio.get_folio(conn, id_reservation)
+    if not folio_row:
+        raise BookingError(f"No folio found for reservation {id_reservation}. Run 'python folio.py reconcile --fix'.", 500)
+    invoice = {
+        'id_reservation': int(id_reservation),
+        'montant_chambre': folio_row['montant_chambre'],
+        'montant_services': folio_row['montant_services'],
+        'montant_consommations': folio_row['montant_consommations'],
+        'montant_total': folio_row['montant_total'],
+        'date_emission': datetime.now().strftime('%Y-%m-%d'),
+        'statut': 'Non payée',
+    }
+    # Insert the new invoice record
+    cursor = conn.execute('''INSERT INTO factures (id_reservation, montant_chambre, montant_services, montant_consommations, montant_total, date_emission, statut)
+                             VALUES (:id_reservation, :montant_chambre, :montant_services, :montant_consommations, :montant_total, :date_emission, :statut)''',
+                          invoice)
+    conn.commit()
+    metrics.inc('gesthotel_invoices_generated_total', mode='single')
+    invoice['id_facture'] = cursor.lastrowid
+    return invoice
+
+VALID_INVOICE_STATUSES = ['Non payée', 'Payée', 'Partiellement payée']
+VALID_PAYMENT_METHODS = ['Carte', 'Espèces', 'Virement', 'Chèque', ''] # Allow empty
+
+def update_invoice(conn, id_facture, new_status, mode_paiement):
+    """Sets the status and payment method of an invoice."""
+    if new_status not in VALID_INVOICE_STATUSES:
+        raise BookingError('Invalid status selected.')
+    if mode_paiement not in VALID_PAYMENT_METHODS:
+        raise BookingError('Invalid payment method selected.')
+    if new_status == 'Payée' and not mode_paiement:
+        raise BookingError('Payment method required when marking invoice as Paid.')
+    if new_status == 'Non payée':
+        mode_paiement = None # Clear payment method if unpaid
+    result = conn.execute('UPDATE factures SET statut = ?, mode_paiement = ? WHERE id_facture = ?',
+                          (new_status, mode_paiement if mode_paiement else None, id_facture))
+    conn.commit()
+    if result.rowcount == 0:
+        raise BookingError(f'Invoice #{id_facture} not found or no change made.', 404)
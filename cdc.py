@@ -0,0 +1,162 @@
+# cdc.py - Change-data capture and delta sync for Gest'Hôtel
+#
+# Triggers installed by migrations/0010_change_log.py append one change_log row
+# (table_name, pk, op, version) for every insert, update or delete of a captured
+# table, whichever route, job or worker makes the write. version is a global,
+# never reused sequence, so a client that remembers the last version it applied
+# can ask for everything after it (GET /api/v1/changes?since=<version>) instead
+# of re-downloading whole tables.
+#
+# Deltas are compacted: each changed row is sent once, with its latest state
+# ('upsert' and the current row, or 'delete'), however often it changed.
+#
+# The log is kept small in two ways, both run by the night audit:
+#   - compaction drops entries superseded by a later change of the same row, which
+#     loses nothing a client could still ask for;
+#   - truncation drops entries older than CDC_RETENTION_DAYS (default 30) and
+#     raises the horizon: a client whose `since` is older must re-download the
+#     tables (410 Gone) before syncing again.
+#
+# A new client bootstraps by reading `latest` first, then downloading the tables,
+# then syncing from that version; rows changed in between come again as upserts.
+#
+# Usage:
+#   python cdc.py status              # Log size, versions and horizon
+#   python cdc.py compact             # Drop superseded entries
+#   python cdc.py truncate --days 7   # Drop entries older than 7 days (and compact)
+
+import argparse
+import os
+import sys
+import time
+from contextlib import closing
+
+# Captured table -> primary key column
+TABLES = {
+    'reservations': 'id_reservation',
+    'chambres': 'id_chambre',
+    'clients': 'id_client',
+    'factures': 'id_facture',
+    'consommations': 'id_consommation',
+    'avis': 'id_avis',
+}
+RETENTION_DAYS = int(os.environ.get('CDC_RETENTION_DAYS', 30))
+LIMIT_DEFAULT = 1000
+LIMIT_MAX = 10000
+_OPS = {'I': 'upsert', 'U': 'upsert', 'D': 'delete'}
+
+class ResyncRequired(Exception):
+    """`since` is older than the truncation horizon: the client must re-download the tables."""
+
+    def __init__(self, since, horizon):
+        super().__init__(f"Changes up to version {horizon} have been truncated (since={since}); "
+                         f"re-download the tables, then sync from 'latest'.")
+        self.horizon = horizon
+
+def horizon(conn):
+    """Oldest `since` still answered: every change after it is in the log."""
+    row = conn.execute("SELECT value FROM change_log_state WHERE name = 'horizon'").fetchone()
+    return row[0] if row else 0
+
+def latest(conn):
+    """Version of the most recent change (0 if none)."""
+    return max(conn.execute('SELECT COALESCE(MAX(version), 0) FROM change_log').fetchone()[0], horizon(conn))
+
+def changes(conn, since, limit=LIMIT_DEFAULT, tables=None):
+    """The compacted changes after version `since`, oldest first, at most `limit` of them.
+
+    Returns {'since', 'next_since', 'latest', 'has_more', 'changes': [{'table', 'pk',
+    'op', 'version', 'row'}]}; `row` is the current row for an 'upsert', None for
+    a 'delete'. Call inside one read transaction so the rows match the log.
+    Raises ResyncRequired if `since` is older than the horizon.
+    """
+    floor = horizon(conn)
+    if since < floor:
+        raise ResyncRequired(since, floor)
+    tables = [t for t in (tables or TABLES) if t in TABLES]
+    # Entries in version order, skipping any row changed again later: stops after `limit` + 1 hits
+    entries = conn.execute(f'''
+        SELECT c.table_name, c.pk, c.op, c.version FROM change_log c
+        WHERE c.version > ? AND c.table_name IN ({', '.join('?' for _ in tables)})
+          AND NOT EXISTS (SELECT 1 FROM change_log n
+                          WHERE n.table_name = c.table_name AND n.pk = c.pk AND n.version > c.version)
+        ORDER BY c.version LIMIT ?''', (since, *tables, limit + 1)).fetchall()
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    rows = {} # (table, pk) -> current row, fetched per table in batches
+    for table in tables:
+        pks = [e['pk'] for e in entries if e['table_name'] == table and e['op'] != 'D']
+        for start in range(0, len(pks), 500):
+            chunk = pks[start:start + 500]
+            for row in conn.execute(f"SELECT * FROM {table} WHERE {TABLES[table]} IN ({', '.join('?' for _ in chunk)})", chunk):
+                rows[(table, row[TABLES[table]])] = dict(row)
+    return {
+        'since': since,
+        'next_since': entries[-1]['version'] if entries else since,
+        'latest': latest(conn),
+        'has_more': has_more,
+        'changes': [{'table': e['table_name'], 'pk': e['pk'], 'op': _OPS[e['op']], 'version': e['version'],
+                     'row': rows.get((e['table_name'], e['pk'])) if e['op'] != 'D' else None} for e in entries],
+    }
+
+def compact(conn):
+    """Deletes entries superseded by a later change of the same row; returns how many. Commits."""
+    deleted = conn.execute('''
+        DELETE FROM change_log WHERE version < (SELECT MAX(n.version) FROM change_log n
+                                                WHERE n.table_name = change_log.table_name AND n.pk = change_log.pk)
+    ''').rowcount
+    conn.commit()
+    return deleted
+
+def truncate(conn, days=RETENTION_DAYS):
+    """Deletes entries older than `days` and raises the horizon past them; returns how many. Commits."""
+    cutoff = int(time.time()) - days * 86400
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        # changed_at grows with version: the last old entry is the one before the first recent one
+        first_recent = conn.execute('SELECT version FROM change_log WHERE changed_at >= ? ORDER BY version LIMIT 1',
+                                    (cutoff,)).fetchone()
+        last_old = (first_recent[0] - 1) if first_recent else \
+            conn.execute('SELECT COALESCE(MAX(version), 0) FROM change_log').fetchone()[0]
+        deleted = conn.execute('DELETE FROM change_log WHERE version <= ?', (last_old,)).rowcount
+        if deleted:
+            conn.execute("UPDATE change_log_state SET value = MAX(value, ?) WHERE name = 'horizon'", (last_old,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return deleted
+
+def invalidate(conn):
+    """After writes that bypassed the triggers (bulk loads): empties the log and moves the
+    horizon past every version issued so far, so all clients re-download. Runs in the
+    caller's transaction."""
+    floor = latest(conn) + 1
+    conn.execute('DELETE FROM change_log')
+    conn.execute("UPDATE change_log_state SET value = ? WHERE name = 'horizon'", (floor,))
+    # New entries must get versions above the horizon
+    if conn.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = 'change_log'", (floor,)).rowcount == 0:
+        conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('change_log', ?)", (floor,))
+
+def status(conn):
+    row = conn.execute('SELECT COUNT(*), MIN(version) FROM change_log').fetchone()
+    per_table = dict(conn.execute('SELECT table_name, COUNT(*) FROM change_log GROUP BY table_name').fetchall())
+    return {'entries': row[0], 'oldest': row[1], 'latest': latest(conn), 'horizon': horizon(conn), 'per_table': per_table}
+
+if __name__ == '__main__':
+    from db import connect
+    parser = argparse.ArgumentParser(description="Gest'Hôtel change-data capture log")
+    parser.add_argument('command', choices=['status', 'compact', 'truncate'])
+    parser.add_argument('--days', type=int, default=RETENTION_DAYS, help='retention for truncate (default: %(default)s)')
+    args = parser.parse_args()
+    with closing(connect()) as conn:
+        if args.command == 'truncate':
+            print(f"Truncated {truncate(conn, args.days)} entries older than {args.days} days.")
+        if args.command in ('compact', 'truncate'):
+            print(f"Compacted {compact(conn)} superseded entries.")
+        info = status(conn)
+    print(f"Change log: {info['entries']} entries, versions {info['oldest']}..{info['latest']}, horizon {info['horizon']}")
+    for table, count in sorted(info['per_table'].items()):
+        print(f"  {table:<16}{count}")
+    sys.exit(0)
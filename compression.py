@@ -0,0 +1,63 @@
+# compression.py - Optional gzip / brotli response compression for Gest'Hôtel
+#
+# Compresses text responses (HTML, JSON, CSS, JS) of at least MIN_SIZE bytes
+# for clients that accept it, preferring brotli when the optional `brotli`
+# package is installed. Streamed responses (the API's JSON arrays) are left
+# alone. A compressed response gets its own strong ETag (suffix -br / -gzip);
+# versions.conditional() accepts those suffixed tags on revalidation.
+#
+# Configuration (environment):
+#   GESTHOTEL_COMPRESSION    'br,gzip' (default), 'gzip', or '' to disable
+#   GESTHOTEL_GZIP_LEVEL     1-9, default 6
+#   GESTHOTEL_BROTLI_QUALITY 0-11, default 4 (fast enough for per-request use)
+
+import gzip
+import os
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MIN_SIZE = 1024
+COMPRESSIBLE = ('text/html', 'text/css', 'text/plain', 'text/csv', 'application/json', 'application/javascript')
+GZIP_LEVEL = int(os.environ.get('GESTHOTEL_GZIP_LEVEL', 6))
+BROTLI_QUALITY = int(os.environ.get('GESTHOTEL_BROTLI_QUALITY', 4))
+
+def _encoders():
+    encoders = {
+        'br': (lambda data: brotli.compress(data, quality=BROTLI_QUALITY)) if brotli else None,
+        'gzip': lambda data: gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0),
+    }
+    wanted = [e.strip() for e in os.environ.get('GESTHOTEL_COMPRESSION', 'br,gzip').split(',') if e.strip()]
+    return [(name, encoders[name]) for name in wanted if encoders.get(name)]
+
+ENCODERS = _encoders() # In order of preference
+
+def compress_response(response, accept_encodings):
+    """Compresses `response` in place with the first encoding the client accepts."""
+    if (not ENCODERS or response.status_code != 200 or response.is_streamed or response.direct_passthrough
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = next(((name, encode) for name, encode in ENCODERS if accept_encodings[name]), None)
+    data = response.get_data()
+    if encoding is None or len(data) < MIN_SIZE:
+        return response
+    name, encode = encoding
+    response.set_data(encode(data))
+    response.headers['Content-Encoding'] = name
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f'{etag}-{name}', weak)
+    return response
+
+def init_app(app):
+    """Compresses eligible responses after every request (no-op if compression is disabled)."""
+    if not ENCODERS:
+        return
+    @app.after_request
+    def compress(response):
+        return compress_response(response, request.accept_encodings)
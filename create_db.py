@@ -1,16 +1,32 @@
 # database.py (Corrected Version - Final)
+import argparse
+import math
+import random
 import sqlite3
+import time
 from datetime import date, timedelta
 import os # For checking if DB exists
 
+import cdc
+import folio
+import kpi
+import migrate
+import rollups
+from auth import hash_password
+from db import DATABASE, connect
+
 # --- Main Database Setup ---
-def setup_database():
-    db_file = 'gesthotel.db'
-    # Check if DB exists, delete if it does to ensure a fresh start
-    # You might want to comment this out if you want to preserve data between runs *after* the schema is stable
-    if os.path.exists(db_file):
+def setup_database(db_file=DATABASE, reset=False):
+    # The schema is owned by the versioned migrations in migrations/ (see migrate.py),
+    # so an existing database is upgraded in place instead of being deleted.
+    if reset and os.path.exists(db_file):
         print(f"Deleting existing database file: {db_file}")
-        os.remove(db_file)
+        for path in (db_file, db_file + '-wal', db_file + '-shm'): # WAL sidecar files too
+            if os.path.exists(path):
+                os.remove(path)
+
+    print(f"Applying schema migrations to '{db_file}'...")
+    migrate.upgrade(db_file)
 
     print(f"Connecting to database '{db_file}'...")
     conn = sqlite3.connect(db_file)
@@ -19,158 +35,10 @@ def setup_database():
     print("Enabling foreign keys...")
     cursor.execute('PRAGMA foreign_keys = ON')
 
-    # --- Table Creation ---
-    print("Creating tables if they don't exist...")
-
-    # Table: clients
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS clients (
-            id_client INTEGER PRIMARY KEY AUTOINCREMENT,
-            nom TEXT NOT NULL,
-            prenom TEXT NOT NULL,
-            telephone TEXT,
-            email TEXT UNIQUE NOT NULL,
-            adresse TEXT,
-            statut_fidelite TEXT DEFAULT 'Standard' NOT NULL CHECK(statut_fidelite IN ('Standard', 'VIP', 'Or'))
-        )
-    ''')
-
-    # Table: chambres
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS chambres (
-            id_chambre INTEGER PRIMARY KEY AUTOINCREMENT,
-            numero_chambre TEXT UNIQUE NOT NULL,
-            type_chambre TEXT NOT NULL CHECK(type_chambre IN ('Simple', 'Double', 'Suite', 'Familiale')),
-            prix_nuit_base REAL NOT NULL CHECK(prix_nuit_base >= 0),
-            statut TEXT NOT NULL CHECK(statut IN ('Libre', 'Occupé', 'En nettoyage'))
-        )
-    ''')
-
-    # Table: tarifs
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS tarifs (
-            id_tarif INTEGER PRIMARY KEY AUTOINCREMENT,
-            nom_tarif TEXT UNIQUE NOT NULL,
-            description TEXT,
-            reduction_pourcentage REAL DEFAULT 0.0 CHECK(reduction_pourcentage >= 0 AND reduction_pourcentage <= 100),
-            condition_application TEXT
-        )
-    ''')
-
-    # Table: reservations
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS reservations (
-            id_reservation INTEGER PRIMARY KEY AUTOINCREMENT,
-            id_client INTEGER NOT NULL,
-            id_chambre INTEGER NOT NULL,
-            id_tarif INTEGER NOT NULL,
-            date_debut TEXT NOT NULL,
-            date_fin TEXT NOT NULL,
-            prix_nuit_applique REAL NOT NULL,
-            statut TEXT NOT NULL CHECK(statut IN ('Confirmée', 'Annulée', 'Terminée', 'En attente')),
-            FOREIGN KEY (id_client) REFERENCES clients(id_client) ON DELETE CASCADE,
-            FOREIGN KEY (id_chambre) REFERENCES chambres(id_chambre) ON DELETE RESTRICT,
-            FOREIGN KEY (id_tarif) REFERENCES tarifs(id_tarif) ON DELETE RESTRICT
-        )
-    ''')
-
-    # Table: services
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS services (
-            id_service INTEGER PRIMARY KEY AUTOINCREMENT,
-            nom_service TEXT UNIQUE NOT NULL,
-            description TEXT,
-            prix REAL NOT NULL CHECK(prix >= 0),
-            disponibilite TEXT NOT NULL CHECK(disponibilite IN ('Disponible', 'Indisponible'))
-        )
-    ''')
-
-    # Table: reservation_services
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS reservation_services (
-            id_reservation INTEGER NOT NULL,
-            id_service INTEGER NOT NULL,
-            quantite INTEGER DEFAULT 1 CHECK(quantite > 0),
-            date_service TEXT,
-            FOREIGN KEY (id_reservation) REFERENCES reservations(id_reservation) ON DELETE CASCADE,
-            FOREIGN KEY (id_service) REFERENCES services(id_service) ON DELETE CASCADE,
-            PRIMARY KEY (id_reservation, id_service)
-        )
-    ''')
-
-    # Table: consommations
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS consommations (
-            id_consommation INTEGER PRIMARY KEY AUTOINCREMENT,
-            id_chambre INTEGER NOT NULL,
-            id_reservation INTEGER,
-            type_consommation TEXT NOT NULL CHECK(type_consommation IN ('Énergie', 'Eau', 'Gaz', 'Minibar')),
-            date_releve TEXT NOT NULL,
-            valeur REAL NOT NULL,
-            unite TEXT NOT NULL,
-            cout_unitaire REAL NOT NULL,
-            FOREIGN KEY (id_chambre) REFERENCES chambres(id_chambre) ON DELETE CASCADE,
-            FOREIGN KEY (id_reservation) REFERENCES reservations(id_reservation) ON DELETE SET NULL
-        )
-    ''')
-
-    # Table: factures
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS factures (
-            id_facture INTEGER PRIMARY KEY AUTOINCREMENT,
-            id_reservation INTEGER UNIQUE NOT NULL,
-            montant_chambre REAL NOT NULL,
-            montant_services REAL NOT NULL,
-            montant_consommations REAL NOT NULL,
-            montant_total REAL NOT NULL,
-            date_emission TEXT NOT NULL,
-            statut TEXT NOT NULL CHECK(statut IN ('Payée', 'Non payée', 'Partiellement payée')),
-            mode_paiement TEXT CHECK(mode_paiement IN ('Carte', 'Espèces', 'Virement', 'Chèque', NULL)),
-            FOREIGN KEY (id_reservation) REFERENCES reservations(id_reservation) ON DELETE RESTRICT
-        )
-    ''')
-
-    # Table: avis
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS avis (
-            id_avis INTEGER PRIMARY KEY AUTOINCREMENT,
-            id_client INTEGER NOT NULL,
-            id_reservation INTEGER UNIQUE NOT NULL,
-            note INTEGER NOT NULL CHECK(note BETWEEN 1 AND 5),
-            commentaire TEXT,
-            date_avis TEXT NOT NULL,
-            moderated INTEGER DEFAULT 0 CHECK(moderated IN (0, 1)),
-            FOREIGN KEY (id_client) REFERENCES clients(id_client) ON DELETE CASCADE,
-            FOREIGN KEY (id_reservation) REFERENCES reservations(id_reservation) ON DELETE CASCADE
-        )
-    ''')
-
-    # Table: users
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id_user INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL, -- REMINDER: HASH PASSWORDS IN PRODUCTION!
-            role TEXT NOT NULL CHECK(role IN ('admin', 'staff', 'client'))
-        )
-    ''')
-
-    print("Tables created successfully.")
-
-    # --- Triggers ---
-    print("Creating triggers...")
-    cursor.execute("DROP TRIGGER IF EXISTS update_room_status_after_reservation")
-    cursor.execute('''
-        CREATE TRIGGER update_room_status_after_reservation
-        AFTER UPDATE OF statut ON reservations
-        WHEN NEW.statut = 'Terminée' AND OLD.statut != 'Terminée'
-        BEGIN
-            UPDATE chambres
-            SET statut = 'En nettoyage'
-            WHERE id_chambre = NEW.id_chambre;
-        END;
-    ''')
-    print("Triggers created successfully.")
+    if cursor.execute('SELECT 1 FROM users LIMIT 1').fetchone():
+        print("Database already holds data; skipping sample data.")
+        conn.close()
+        return
 
     # --- Helper Function for Sample Data Insertion (Simpler Approach) ---
     def insert_if_not_exists(sql, params):
@@ -187,9 +55,9 @@ def setup_database():
     print("Inserting sample data...")
     try:
         # Users
-        insert_if_not_exists("INSERT INTO users (username, password, role) VALUES (?, ?, ?)", ('admin', 'admin123', 'admin'))
-        insert_if_not_exists("INSERT INTO users (username, password, role) VALUES (?, ?, ?)", ('staff', 'staff123', 'staff'))
-        insert_if_not_exists("INSERT INTO users (username, password, role) VALUES (?, ?, ?)", ('client', 'client123', 'client'))
+        insert_if_not_exists("INSERT INTO users (username, password, role) VALUES (?, ?, ?)", ('admin', hash_password('admin123'), 'admin'))
+        insert_if_not_exists("INSERT INTO users (username, password, role) VALUES (?, ?, ?)", ('staff', hash_password('staff123'), 'staff'))
+        insert_if_not_exists("INSERT INTO users (username, password, role) VALUES (?, ?, ?)", ('client', hash_password('client123'), 'client'))
 
         # Tarifs
         tarif_standard_id = insert_if_not_exists("INSERT INTO tarifs (nom_tarif, description, condition_application) VALUES (?, ?, ?)", ('Standard', 'Tarif normal', 'None')) or conn.execute("SELECT id_tarif FROM tarifs WHERE nom_tarif='Standard'").fetchone()[0]
@@ -267,7 +135,227 @@ def setup_database():
         print("Closing database connection.")
         conn.close()
 
+# --- Synthetic Hotel (--scale) ---
+# (type, lowest and highest base price, share of rooms)
+ROOM_TYPES = (('Simple', 65, 95, 30), ('Double', 90, 140, 40), ('Suite', 180, 350, 10), ('Familiale', 120, 180, 20))
+LOYALTY_MIX = (('Standard', 80), ('VIP', 12), ('Or', 8))
+STAY_NIGHTS = ((1, 20), (2, 25), (3, 20), (4, 12), (5, 8), (7, 8), (10, 4), (14, 3))
+GAP_NIGHTS = ((0, 35), (1, 25), (2, 15), (3, 10), (5, 10), (8, 5)) # Empty nights between two stays in a room
+EXTRA_SERVICES = (('Parking', 'Place de parking couverte', 12.0), ('Room service', 'Repas servi en chambre', 25.0),
+                  ('Blanchisserie', 'Lavage et repassage', 18.0), ('Location vélo', 'Vélo à la journée', 15.0))
+FIRST_NAMES = ('Jean', 'Sophie', 'Lucas', 'Emma', 'Hugo', 'Lea', 'Louis', 'Chloe', 'Gabriel', 'Manon', 'Arthur', 'Camille',
+               'Jules', 'Ines', 'Adam', 'Sarah', 'Paul', 'Julie', 'Nathan', 'Alice')
+LAST_NAMES = ('Martin', 'Bernard', 'Dubois', 'Thomas', 'Robert', 'Richard', 'Petit', 'Durand', 'Leroy', 'Moreau', 'Simon',
+              'Laurent', 'Lefebvre', 'Michel', 'Garcia', 'David', 'Bertrand', 'Roux', 'Vincent', 'Fournier')
+REVIEW_NOTES = ((1, 5), (2, 8), (3, 17), (4, 35), (5, 35))
+REVIEW_TEXTS = {1: 'Très déçu, chambre bruyante.', 2: 'Séjour moyen, propreté à revoir.', 3: 'Correct sans plus.',
+                4: 'Séjour agréable, chambre propre.', 5: 'Excellent accueil, nous reviendrons !'}
+BULK_TABLES = ('clients', 'reservations', 'reservation_services', 'consommations', 'avis', 'factures')
+# Bulk-load settings of the generating connection only; the database keeps its normal setup
+LOAD_PRAGMAS = ('PRAGMA synchronous = OFF', 'PRAGMA foreign_keys = OFF', 'PRAGMA temp_store = MEMORY',
+                'PRAGMA cache_size = -524288') # 512 MiB
+
+def _weighted(pairs):
+    """(values, cumulative weights) of (value, weight) pairs, for random.choices."""
+    values, cum, total = [], [], 0
+    for value, weight in pairs:
+        total += weight
+        values.append(value)
+        cum.append(total)
+    return values, cum
+
+def _mean(pairs):
+    return sum(value * weight for value, weight in pairs) / sum(weight for _, weight in pairs)
+
+def generate(db_file, reservations, rooms=None, clients=None, years=3, seed=42, today=None):
+    """Adds a synthetic hotel with about `reservations` stays to a migrated database.
+
+    Rooms (default: enough to fill `years` of history plus six months of bookings),
+    clients (default: one per four stays) with a loyalty mix, non-overlapping stays
+    per room, services, meter readings, invoices and reviews, dated around `today`
+    (default: the current date). The same arguments, `today` included, always
+    produce the same data. Triggers are suspended during the load and the
+    tables they maintain (folios, KPIs, rollups) are rebuilt once at the end.
+    """
+    started = time.perf_counter()
+    rng = random.Random(seed)
+    today = today or date.today()
+    today_ordinal = today.toordinal()
+    first_day, last_day = today_ordinal - round(years * 365), today_ordinal + 180
+    nights_values, nights_cum = _weighted(STAY_NIGHTS)
+    gap_values, gap_cum = _weighted(GAP_NIGHTS)
+    # 3% spare so that few rooms run out of calendar before their share of the stays
+    rooms = rooms or max(1, math.ceil(1.03 * reservations / ((last_day - first_day) / (_mean(STAY_NIGHTS) + _mean(GAP_NIGHTS)))))
+    clients = clients or max(10, reservations // 4)
+    iso_days = {}
+    def day(ordinal):
+        text = iso_days.get(ordinal)
+        if text is None:
+            text = iso_days[ordinal] = date.fromordinal(ordinal).isoformat()
+        return text
+
+    conn = connect(db_file)
+    conn.isolation_level = None # Explicit BEGIN/COMMIT: one large transaction
+    for pragma in LOAD_PRAGMAS:
+        conn.execute(pragma)
+    try:
+        if conn.execute("SELECT 1 FROM chambres WHERE numero_chambre LIKE 'G%' LIMIT 1").fetchone():
+            raise SystemExit(f"'{db_file}' already holds a generated hotel; use --reset or another --db.")
+        conn.execute('BEGIN IMMEDIATE')
+        # Triggers would post every row to folios, KPIs, rollups and the change log: rebuilt in bulk instead
+        triggers = conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger'").fetchall()
+        for trigger in triggers:
+            conn.execute(f"DROP TRIGGER {trigger['name']}")
+        # Secondary indexes of the bulk tables are faster to build once, from sorted data, than to grow row by row
+        indexes = conn.execute(f"""SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL
+                                   AND tbl_name IN ({', '.join(repr(t) for t in BULK_TABLES)})""").fetchall()
+        for index in indexes:
+            conn.execute(f"DROP INDEX {index['name']}")
+
+        # Rooms and clients
+        type_values, type_cum = _weighted([(name, share) for name, _, _, share in ROOM_TYPES])
+        price_ranges = {name: (low, high) for name, low, high, _ in ROOM_TYPES}
+        room_rows = [(f'G{n + 1:05d}', room_type, float(rng.randrange(*price_ranges[room_type], 5)), 'Libre')
+                     for n, room_type in enumerate(rng.choices(type_values, cum_weights=type_cum, k=rooms))]
+        conn.executemany('INSERT INTO chambres (numero_chambre, type_chambre, prix_nuit_base, statut) VALUES (?, ?, ?, ?)', room_rows)
+        room_ids = [row[0] for row in conn.execute("SELECT id_chambre FROM chambres WHERE numero_chambre LIKE 'G%' ORDER BY id_chambre")]
+        loyalty_values, loyalty_cum = _weighted(LOYALTY_MIX)
+        loyalty = rng.choices(loyalty_values, cum_weights=loyalty_cum, k=clients)
+        first_client = conn.execute('SELECT COALESCE(MAX(id_client), 0) FROM clients').fetchone()[0] + 1
+        client_rows = []
+        for n in range(clients):
+            nom, prenom = rng.choice(LAST_NAMES), rng.choice(FIRST_NAMES)
+            client_rows.append((first_client + n, nom, prenom, f'06{rng.randrange(10 ** 8):08d}',
+                                f'{prenom}.{nom}.{n}@example.com'.lower(), loyalty[n]))
+        conn.executemany('INSERT INTO clients (id_client, nom, prenom, telephone, email, statut_fidelite) VALUES (?, ?, ?, ?, ?, ?)',
+                         client_rows)
+
+        # Tariffs come from the sample data; the service catalogue gets a few more entries
+        tarifs = {row['nom_tarif']: (row['id_tarif'], row['reduction_pourcentage'] or 0.0)
+                  for row in conn.execute('SELECT id_tarif, nom_tarif, reduction_pourcentage FROM tarifs')}
+        standard = tarifs.get('Standard') or next(iter(tarifs.values()))
+        vip, weekend = tarifs.get('VIP Discount', standard), tarifs.get('Weekend Promo', standard)
+        for nom, description, prix in EXTRA_SERVICES:
+            conn.execute('''INSERT INTO services (nom_service, description, prix, disponibilite)
+                            SELECT ?, ?, ?, 'Disponible' WHERE NOT EXISTS (SELECT 1 FROM services WHERE nom_service = ?)''',
+                         (nom, description, prix, nom))
+        service_ids = [row[0] for row in conn.execute("SELECT id_service FROM services WHERE disponibilite = 'Disponible'")]
+
+        # Stays: each room's calendar is filled backwards from six months ahead, so every room is busy today
+        stays = []
+        for index, (id_chambre, (_, _, base_price, _)) in enumerate(zip(room_ids, room_rows)):
+            quota = math.ceil((reservations - len(stays)) / (rooms - index)) # Later rooms make up for full calendars
+            if quota <= 0:
+                break
+            cursor = last_day
+            for nights, gap in zip(rng.choices(nights_values, cum_weights=nights_cum, k=quota),
+                                   rng.choices(gap_values, cum_weights=gap_cum, k=quota)):
+                fin = cursor - gap
+                debut = cursor = fin - nights
+                if debut < first_day:
+                    break
+                client = rng.randrange(clients)
+                if loyalty[client] != 'Standard':
+                    id_tarif, reduction = vip
+                elif date.fromordinal(debut).weekday() in (4, 5): # Friday or Saturday arrival
+                    id_tarif, reduction = weekend
+                else:
+                    id_tarif, reduction = standard
+                if rng.random() < 0.05:
+                    statut = 'Annulée'
+                else:
+                    statut = 'Terminée' if fin <= today_ordinal else 'Confirmée'
+                stays.append((debut, fin, first_client + client, id_chambre, id_tarif,
+                              round(base_price * (1 - reduction / 100), 2), statut))
+        stays.sort() # Reservation ids follow arrival dates, as if booked over time
+        first_reservation = conn.execute('''
+            SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'reservations'), 0),
+                       COALESCE((SELECT MAX(id_reservation) FROM reservations), 0))''').fetchone()[0] + 1
+        conn.executemany('''INSERT INTO reservations (id_reservation, id_client, id_chambre, id_tarif, date_debut, date_fin,
+                                                      prix_nuit_applique, statut) VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                         ((first_reservation + n, client, chambre, tarif, day(debut), day(fin), prix, statut)
+                          for n, (debut, fin, client, chambre, tarif, prix, statut) in enumerate(stays)))
+
+        # Services, meter readings and reviews of the stays
+        extras, readings, reviews = [], [], []
+        note_values, note_cum = _weighted(REVIEW_NOTES)
+        for n, (debut, fin, client, chambre, _, _, statut) in enumerate(stays):
+            if statut == 'Annulée':
+                continue
+            id_reservation, nights = first_reservation + n, fin - debut
+            if rng.random() < 0.25:
+                for id_service in rng.sample(service_ids, min(len(service_ids), rng.randint(1, 2))):
+                    extras.append((id_reservation, id_service, rng.randint(1, nights)))
+            if statut != 'Terminée':
+                continue
+            releve = day(fin - 1)
+            if rng.random() < 0.4:
+                readings.append((chambre, id_reservation, 'Énergie', releve, round(nights * rng.uniform(4, 9), 2), 'kWh', 0.18))
+            if rng.random() < 0.2:
+                readings.append((chambre, id_reservation, 'Eau', releve, round(nights * rng.uniform(0.1, 0.3), 3), 'm³', 3.8))
+            if rng.random() < 0.15:
+                readings.append((chambre, id_reservation, 'Minibar', releve, float(rng.randint(1, 6)), 'article', 4.5))
+            if rng.random() < 0.15:
+                note = rng.choices(note_values, cum_weights=note_cum)[0]
+                reviews.append((client, id_reservation, note, REVIEW_TEXTS[note],
+                                day(min(today_ordinal, fin + rng.randint(0, 7))), int(rng.random() < 0.9)))
+        conn.executemany('INSERT INTO reservation_services (id_reservation, id_service, quantite) VALUES (?, ?, ?)', extras)
+        conn.executemany('''INSERT INTO consommations (id_chambre, id_reservation, type_consommation, date_releve, valeur, unite, cout_unitaire)
+                            VALUES (?, ?, ?, ?, ?, ?, ?)''', readings)
+        conn.executemany('''INSERT INTO avis (id_client, id_reservation, note, commentaire, date_avis, moderated)
+                            VALUES (?, ?, ?, ?, ?, ?)''', reviews)
+
+        # Folios, then invoices for nine completed stays in ten (from their folios); recent ones partly unpaid
+        folio.rebuild(conn)
+        conn.execute('''
+            INSERT INTO factures (id_reservation, montant_chambre, montant_services, montant_consommations, montant_total,
+                                  date_emission, statut, mode_paiement)
+            SELECT id_reservation, montant_chambre, montant_services, montant_consommations,
+                   ROUND(montant_chambre + montant_services + montant_consommations, 2), date_fin,
+                   CASE WHEN unpaid THEN 'Non payée' ELSE 'Payée' END,
+                   CASE WHEN unpaid THEN NULL ELSE CASE id_reservation % 4 WHEN 2 THEN 'Virement' WHEN 3 THEN 'Espèces' ELSE 'Carte' END END
+            FROM (SELECT f.*, r.date_fin, r.date_fin >= date(:today, '-30 days') AND r.id_reservation % 3 = 0 AS unpaid
+                  FROM folios f JOIN reservations r ON r.id_reservation = f.id_reservation
+                  WHERE r.id_reservation >= :first AND r.statut = 'Terminée' AND r.id_reservation % 10 != 0)
+        ''', {'today': today.isoformat(), 'first': first_reservation})
+        for index in indexes:
+            conn.execute(index['sql'])
+        conn.execute(f'''UPDATE chambres SET statut = 'Occupé' WHERE numero_chambre LIKE 'G%' AND id_chambre IN (
+                             SELECT id_chambre FROM reservations WHERE statut IN {kpi.COUNTED_STATUSES}
+                             AND date_debut <= :today AND date_fin > :today)''', {'today': today.isoformat()})
+        kpi.rebuild(conn)
+        rollups.rebuild(conn)
+
+        for trigger in triggers:
+            conn.execute(trigger['sql'])
+        # Cached pages (versions.py) and syncing clients (cdc.py) must not keep pre-load data
+        conn.execute("UPDATE table_versions SET version = version + 1, changed_at = CAST(strftime('%s', 'now') AS INTEGER)")
+        cdc.invalidate(conn)
+        conn.execute('COMMIT')
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+    elapsed = time.perf_counter() - started
+    print(f"Generated {len(room_ids)} rooms, {clients} clients, {len(stays)} reservations, {len(extras)} services, "
+          f"{len(readings)} readings and {len(reviews)} reviews in {elapsed:.1f} s (seed {seed}).")
+    return {'rooms': len(room_ids), 'clients': clients, 'reservations': len(stays), 'elapsed_s': round(elapsed, 1)}
+
 if __name__ == '__main__':
-    setup_database()
+    parser = argparse.ArgumentParser(description="Create or upgrade the Gest'Hôtel database and seed sample data.")
+    parser.add_argument('--db', default=DATABASE, help='SQLite database file (default: %(default)s)')
+    parser.add_argument('--reset', action='store_true', help='delete the existing database file first')
+    parser.add_argument('--scale', type=int, metavar='RESERVATIONS', help='also generate a synthetic hotel with this many reservations')
+    parser.add_argument('--rooms', type=int, help='--scale: number of rooms (default: enough for --years of history)')
+    parser.add_argument('--clients', type=int, help='--scale: number of clients (default: one per four reservations)')
+    parser.add_argument('--years', type=float, default=3, help='--scale: years of history (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=42, help='--scale: random seed (default: %(default)s)')
+    parser.add_argument('--today', type=date.fromisoformat, help='--scale: date the history is anchored on (default: today)')
+    args = parser.parse_args()
+    setup_database(args.db, reset=args.reset)
+    if args.scale:
+        generate(args.db, args.scale, rooms=args.rooms, clients=args.clients, years=args.years, seed=args.seed, today=args.today)
     print("\nDatabase setup process finished.")
-    print(f"Database file '{'gesthotel.db'}' should now be updated/created.")
\ No newline at end of file
+    print(f"Database file '{args.db}' should now be updated/created.")
@@ -0,0 +1,113 @@
+# db.py - SQLite connection management for Gest'Hôtel
+
+import os
+import sqlite3
+import threading
+
+# --- Configuration ---
+DATABASE = os.environ.get('GESTHOTEL_DB', 'gesthotel.db')
+POOL_MAX_IDLE = int(os.environ.get('GESTHOTEL_POOL_SIZE', 8))
+BUSY_TIMEOUT_MS = int(os.environ.get('GESTHOTEL_BUSY_TIMEOUT_MS', 5000))
+MMAP_SIZE = int(os.environ.get('GESTHOTEL_MMAP_SIZE', 256 * 1024 * 1024)) # 256 MiB
+CACHE_SIZE_KIB = int(os.environ.get('GESTHOTEL_CACHE_SIZE_KIB', 32 * 1024)) # 32 MiB page cache
+
+# --- Connection Setup ---
+def configure_connection(conn):
+    """Applies the per-connection pragmas. Runs once when a connection is opened."""
+    conn.row_factory = sqlite3.Row # Access columns by name
+    conn.execute("PRAGMA foreign_keys = ON") # Ensure FK constraints are active
+    conn.execute("PRAGMA journal_mode = WAL") # Readers no longer block the writer
+    conn.execute("PRAGMA synchronous = NORMAL") # Safe with WAL, far fewer fsyncs
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KIB}") # Negative value = size in KiB
+    return conn
+
+def connect(db_file=None, factory=sqlite3.Connection):
+    """Opens a new configured connection outside of the pool (CLI scripts, jobs)."""
+    conn = sqlite3.connect(db_file or DATABASE, check_same_thread=False, factory=factory)
+    return configure_connection(conn)
+
+# --- Connection Pool ---
+class ConnectionPool:
+    """A small per-process pool of configured SQLite connections.
+
+    Connections are handed out LIFO so the most recently used (warmest) one is
+    reused first. The pool notices a fork (e.g. a pre-forking WSGI server) and
+    starts over with fresh connections in the child worker.
+    """
+
+    def __init__(self, db_file=None, max_idle=POOL_MAX_IDLE):
+        self.db_file = db_file or DATABASE
+        self.max_idle = max_idle
+        self.factory = sqlite3.Connection # Connection class; querylog.py swaps in its traced one
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = []
+        self.hits = 0
+        self.misses = 0
+        self.discarded = 0
+        self.in_use = 0
+
+    def acquire(self):
+        """Returns a pooled connection, opening a new one if none is idle."""
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset() # Never share SQLite handles across a fork
+            self.in_use += 1
+            if self._idle:
+                self.hits += 1
+                return self._idle.pop()
+            self.misses += 1
+        try:
+            return connect(self.db_file, self.factory)
+        except sqlite3.Error:
+            with self._lock:
+                self.in_use -= 1
+            raise
+
+    def release(self, conn):
+        """Returns a connection to the pool, rolling back any open transaction."""
+        try:
+            if conn.in_transaction:
+                conn.rollback() # Error paths that never committed
+        except sqlite3.Error:
+            conn.close()
+            with self._lock:
+                self.in_use -= 1
+                self.discarded += 1
+            return
+        with self._lock:
+            self.in_use -= 1
+            if self._pid == os.getpid() and len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+            self.discarded += 1
+        conn.close()
+
+    def close_all(self):
+        """Closes every idle connection (e.g. before swapping the database file)."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def stats(self):
+        """Hit/miss counters for the pool of the current worker process."""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'pid': self._pid,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total * 100, 2) if total else 0.0,
+                'discarded': self.discarded,
+                'in_use': self.in_use,
+                'idle': len(self._idle),
+                'max_idle': self.max_idle,
+            }
+
+pool = ConnectionPool()
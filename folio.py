@@ -0,0 +1,87 @@
+# folio.py - Running guest folios for Gest'Hôtel
+#
+# Each reservation has a folio row holding its running room, services and
+# consumption charges. Triggers installed by migrations/0006_guest_folios.py
+# post every change to reservations, reservation_services, consommations (via
+# their id_reservation link) and service prices in the same transaction as the
+# write, so a balance or an invoice is a single primary-key read.
+# reconcile() recomputes the charges from scratch to detect (and fix) drift.
+#
+# Usage:
+#   python folio.py reconcile          # Report folios that drifted
+#   python folio.py reconcile --fix    # ...and rewrite them from the base tables
+
+import argparse
+import sys
+from contextlib import closing
+
+TOLERANCE = 0.005 # Below a cent: float rounding of incremental sums, not drift
+
+# Charges recomputed from the base tables, one row per reservation; set-based (one
+# grouped pass per table), as consommations has no index on id_reservation
+RECOMPUTE_SQL = '''
+    SELECT r.id_reservation,
+           MAX(1, CAST(julianday(r.date_fin) - julianday(r.date_debut) AS INTEGER)) * r.prix_nuit_applique AS montant_chambre,
+           COALESCE(sv.total, 0) AS montant_services,
+           COALESCE(co.total, 0) AS montant_consommations
+    FROM reservations r
+    LEFT JOIN (SELECT rs.id_reservation, SUM(s.prix * rs.quantite) AS total
+               FROM reservation_services rs JOIN services s ON rs.id_service = s.id_service
+               GROUP BY rs.id_reservation) sv ON sv.id_reservation = r.id_reservation
+    LEFT JOIN (SELECT id_reservation, SUM(valeur * cout_unitaire) AS total FROM consommations
+               WHERE id_reservation IS NOT NULL GROUP BY id_reservation) co ON co.id_reservation = r.id_reservation'''
+
+# Invoice amounts: one primary-key read (hot statement checked by queryplans.py)
+FOLIO_SQL = 'SELECT * FROM folios WHERE id_reservation = ?'
+
+def get_folio(conn, id_reservation):
+    """The folio of a reservation with its total, or None."""
+    row = conn.execute(FOLIO_SQL, (id_reservation,)).fetchone()
+    if row is None:
+        return None
+    folio = dict(row)
+    folio['montant_total'] = round(folio['montant_chambre'] + folio['montant_services'] + folio['montant_consommations'], 2)
+    return folio
+
+def rebuild(conn):
+    """Rewrites every folio from the base tables (bulk loads). Runs in the caller's transaction."""
+    conn.execute('DELETE FROM folios')
+    conn.execute(f'''INSERT INTO folios (id_reservation, montant_chambre, montant_services, montant_consommations, updated_at)
+                     SELECT *, datetime('now') FROM ({RECOMPUTE_SQL})''')
+
+def reconcile(conn, fix=False):
+    """Compares every folio with a full recomputation.
+
+    Returns {'checked', 'drifted': [ids], 'missing': [ids], 'fixed'}. With `fix`,
+    drifted and missing folios are rewritten in one transaction.
+    """
+    expected = {row[0]: row[1:] for row in conn.execute(RECOMPUTE_SQL)}
+    stored = {row[0]: row[1:] for row in conn.execute(
+        'SELECT id_reservation, montant_chambre, montant_services, montant_consommations FROM folios')}
+    missing = sorted(set(expected) - set(stored))
+    drifted = sorted(rid for rid in set(expected) & set(stored)
+                     if any(abs(a - b) > TOLERANCE for a, b in zip(expected[rid], stored[rid])))
+    if fix and (missing or drifted):
+        ids = missing + drifted
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany('''INSERT OR REPLACE INTO folios (id_reservation, montant_chambre, montant_services, montant_consommations, updated_at)
+                                VALUES (?, ?, ?, ?, datetime('now'))''', [(rid, *expected[rid]) for rid in ids])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return {'checked': len(expected), 'drifted': drifted, 'missing': missing, 'fixed': bool(fix and (missing or drifted))}
+
+if __name__ == '__main__':
+    from db import connect
+    parser = argparse.ArgumentParser(description="Gest'Hôtel guest folios")
+    parser.add_argument('command', choices=['reconcile'])
+    parser.add_argument('--fix', action='store_true', help='rewrite drifted folios from the base tables')
+    args = parser.parse_args()
+    with closing(connect()) as conn:
+        report = reconcile(conn, fix=args.fix)
+    problems = len(report['drifted']) + len(report['missing'])
+    print(f"Checked {report['checked']} folios: {len(report['drifted'])} drifted, {len(report['missing'])} missing"
+          + (' (fixed)' if report['fixed'] else ''))
+    sys.exit(1 if problems and not report['fixed'] else 0)
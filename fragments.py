@@ -0,0 +1,117 @@
+# fragments.py - Rendered-fragment cache and template precompilation for Gest'Hôtel
+#
+# Expensive template blocks that rarely change (navigation, the client / room /
+# tariff dropdowns) are wrapped in a {% call fragment(...) %} block. Their HTML is
+# kept in a per-process LRU cache keyed on the versions of the tables they show
+# (versions.py), so a block is re-rendered only after one of those tables has
+# been written to:
+#
+#   {% call fragment('client_options', 'clients') %}
+#       {% for client in clients %}...{% endfor %}
+#   {% endcall %}
+#   {% call fragment('room_filter', 'chambres', key=request.args.id_chambre) %}...{% endcall %}
+#
+# `key` adds whatever else the block depends on (selected value, dates, role).
+# Views pass the block's rows as Lazy(...) so a cache hit skips the query too.
+#
+# init_app() also compiles every template at startup, through a Jinja bytecode
+# cache on disk (GESTHOTEL_JINJA_CACHE, default: Jinja's private per-user folder
+# in the temp directory) that later workers and restarts load instead of
+# re-parsing.
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
+
+import versions
+
+CACHE_SIZE = int(os.environ.get('GESTHOTEL_FRAGMENT_CACHE_SIZE', 512)) # Fragments kept per process
+BYTECODE_DIR = os.environ.get('GESTHOTEL_JINJA_CACHE') or None
+
+class FragmentCache:
+    """LRU map of (name, table versions, key) -> rendered HTML."""
+
+    def __init__(self, max_size=CACHE_SIZE):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, name, tables, key, render):
+        """Returns the cached HTML of a fragment, calling `render()` on a miss."""
+        current = versions.cache.current() if tables else {}
+        cache_key = (name, tuple(current.get(table, (0,))[0] for table in tables), key)
+        with self._lock:
+            html = self._entries.get(cache_key)
+            if html is not None:
+                self._entries.move_to_end(cache_key)
+                self.hits += 1
+                return html
+            self.misses += 1
+        html = str(render()) # Rendered outside the lock; a concurrent miss just renders twice
+        with self._lock:
+            self._entries[cache_key] = html
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return html
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {'entries': len(self._entries), 'max_size': self.max_size, 'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': round(self.hits / total * 100, 2) if total else 0.0}
+
+cache = FragmentCache()
+
+def fragment(name, *tables, key=None, caller=None):
+    """Jinja global: {% call fragment(name, *tables, key=...) %}block{% endcall %}."""
+    return Markup(cache.render(name, tables, key, caller))
+
+class Lazy:
+    """Rows fetched on first use, so a template block served from the cache never runs the query."""
+
+    def __init__(self, fetch):
+        self._fetch = fetch
+        self._rows = None
+
+    @property
+    def rows(self):
+        if self._rows is None:
+            self._rows = list(self._fetch())
+        return self._rows
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __bool__(self):
+        return bool(self.rows)
+
+def precompile(app):
+    """Compiles every template now (and into the bytecode cache); returns (count, elapsed ms)."""
+    started = time.perf_counter()
+    names = app.jinja_env.list_templates(extensions=['html'])
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names), round((time.perf_counter() - started) * 1000, 2)
+
+def init_app(app):
+    """Installs the fragment() global and the bytecode cache, then precompiles the templates."""
+    if BYTECODE_DIR:
+        os.makedirs(BYTECODE_DIR, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(BYTECODE_DIR)
+    app.jinja_env.globals['fragment'] = fragment
+    count, elapsed_ms = precompile(app)
+    app.logger.info('Templates: %d compiled in %s ms (bytecode cache: %s)', count, elapsed_ms, app.jinja_env.bytecode_cache.directory)
@@ -1,10 +1,61 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 import streamlit as st
 import requests
 import pandas as pd
 from datetime import datetime
 
+# Versioned JSON API served by app.py (see api.py)
+BASE_URL = os.environ.get('GESTHOTEL_API_URL', "http://localhost:5000/api/v1")
+CACHE_TTL_SECONDS = int(os.environ.get('GESTHOTEL_FRONTEND_CACHE_TTL', 30)) # How long read sections are reused across reruns
+REQUEST_TIMEOUT = 10
+
 st.title("Gest'Hôtel - Hotel Management System")
 
+# --- HTTP Helpers ---
+@st.cache_resource
+def http_session():
+    """One keep-alive session (connection pool) shared by every rerun."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=16)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def auth_headers(token):
+    return {"Authorization": f"Bearer {token}"} if token else {}
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS, show_spinner=False)
+def fetch_sections(paths, token):
+    """GETs all read sections concurrently. Cached per token, so users never see each other's data.
+
+    Returns {path: (status_code, json)}; status_code is None if the backend could not be reached.
+    """
+    session = http_session()
+    def fetch(path):
+        try:
+            response = session.get(f"{BASE_URL}{path}", headers=auth_headers(token), timeout=REQUEST_TIMEOUT)
+            return response.status_code, response.json() if response.status_code == 200 else None
+        except requests.RequestException:
+            return None, None
+    with ThreadPoolExecutor(max_workers=len(paths)) as pool:
+        return dict(zip(paths, pool.map(fetch, paths)))
+
+def api_call(method, path, **kwargs):
+    """Sends a write request; a successful one invalidates the cached read sections."""
+    response = http_session().request(method, f"{BASE_URL}{path}", headers=auth_headers(st.session_state.token),
+                                      timeout=REQUEST_TIMEOUT, **kwargs)
+    if response.status_code in (200, 201):
+        fetch_sections.clear()
+    return response
+
+def error_message(response, default='Access denied'):
+    try:
+        return response.json().get('error', default)
+    except ValueError:
+        return default
+
 # Session state for authentication
 if 'logged_in' not in st.session_state:
     st.session_state.logged_in = False
@@ -12,6 +63,8 @@ if 'token' not in st.session_state:
     st.session_state.token = None
 if 'username' not in st.session_state:
     st.session_state.username = None
+if 'role' not in st.session_state:
+    st.session_state.role = None
 
 # Login Section
 st.header("Login")
@@ -19,286 +72,276 @@ if not st.session_state.logged_in:
     username = st.text_input("Username")
     password = st.text_input("Password", type="password")
     if st.button("Login"):
-        response = requests.post(f"http://localhost:5000/login", json={"username": username, "password": password})
-        if response.status_code == 200:
+        try:
+            response = http_session().post(f"{BASE_URL}/login", json={"username": username, "password": password}, timeout=REQUEST_TIMEOUT)
+        except requests.RequestException:
+            response = None
+        if response is not None and response.status_code == 200:
             st.session_state.logged_in = True
             st.session_state.token = response.json()['token']
             st.session_state.username = username
+            st.session_state.role = response.json()['role']
             st.success("Logged in successfully!")
+        elif response is None:
+            st.error("Cannot connect to the backend. Ensure Flask is running.")
         else:
             st.error("Invalid credentials")
 else:
     st.write(f"Logged in as {st.session_state.username}")
     if st.button("Logout"):
+        try:
+            api_call('POST', '/logout') # Revokes the token server-side
+        except requests.RequestException:
+            pass
+        fetch_sections.clear()
         st.session_state.logged_in = False
         st.session_state.token = None
         st.session_state.username = None
+        st.session_state.role = None
         st.success("Logged out successfully!")
 
-# Dynamic base URL and headers
-BASE_URL = "http://localhost:5000"
-headers = {"Authorization": st.session_state.token} if st.session_state.token else {}
+is_staff = st.session_state.logged_in and st.session_state.role in ['staff', 'admin']
+is_admin = st.session_state.logged_in and st.session_state.role == 'admin'
+
+# Fetch every section this user can see in one concurrent, cached round trip
+sections = {}
+if st.session_state.logged_in:
+    paths = ['/chambres', '/services', '/avis']
+    if is_staff:
+        paths += ['/clients', '/reservations', '/factures']
+    if is_admin:
+        paths.append('/dashboard')
+    sections = fetch_sections(tuple(paths), st.session_state.token)
+    if any(status is None for status, _ in sections.values()):
+        fetch_sections.clear() # Do not keep a connection failure for the whole TTL
+
+def show_section(path, name, render):
+    status, data = sections.get(path, (None, None))
+    if status == 200:
+        render(data)
+    elif status is None:
+        st.error(f"Cannot connect to the backend for {name}. Ensure Flask is running.")
+    else:
+        st.error("Access denied or server error")
 
 # Rooms Section
 st.header("Rooms")
 if st.session_state.logged_in:
-    try:
-        response = requests.get(f"{BASE_URL}/chambres", headers=headers)
-        if response.status_code == 200:
-            chambres = response.json()
-            for chambre in chambres:
-                st.write(f"Room {chambre['numero_chambre']} - {chambre['type_chambre']} - €{chambre['prix_nuit']} - {chambre['statut']}")
-        else:
-            st.error("Access denied or server error")
-    except requests.RequestException:
-        st.error("Cannot connect to the backend for rooms. Ensure Flask is running.")
+    def render_rooms(chambres):
+        for chambre in chambres:
+            st.write(f"Room {chambre['numero_chambre']} - {chambre['type_chambre']} - €{chambre['prix_nuit']} - {chambre['statut']}")
+    show_section('/chambres', 'rooms', render_rooms)
 else:
     st.warning("Please log in to view rooms.")
 
 st.header("Add a New Room")
-if st.session_state.logged_in and st.session_state.username == 'admin':
+if is_admin:
     numero = st.text_input("Room Number")
     type_chambre = st.selectbox("Room Type", ["Simple", "Double", "Suite"])
     prix_nuit = st.number_input("Price per Night", min_value=0.0, value=100.0)
     statut = st.selectbox("Status", ["Libre", "Occupé", "En nettoyage"])
     if st.button("Add Room"):
-        response = requests.post(f"{BASE_URL}/chambres", json={
+        response = api_call('POST', '/chambres', json={
             'numero_chambre': numero,
             'type_chambre': type_chambre,
             'prix_nuit': prix_nuit,
             'statut': statut
-        }, headers=headers)
+        })
         if response.status_code == 201:
             st.success("Room added successfully!")
         else:
-            st.error(f"Failed to add room: {response.json().get('error', 'Access denied')}")
+            st.error(f"Failed to add room: {error_message(response)}")
 
 # Clients Section
 st.header("Clients")
-try:
-    response = requests.get(f"{BASE_URL}/clients")
-    if response.status_code == 200:
-        clients = response.json()
+if is_staff:
+    def render_clients(clients):
         for client in clients:
             st.write(f"Client {client['nom']} {client['prenom']} - Email: {client['email']}")
-    else:
-        st.error("Server error")
-except requests.RequestException:
-    st.error("Cannot connect to the backend for clients. Ensure Flask is running.")
-
-st.header("Add a New Client")
-nom = st.text_input("Last Name")
-prenom = st.text_input("First Name")
-telephone = st.text_input("Phone")
-email = st.text_input("Email")
-adresse = st.text_input("Address")
-if st.button("Add Client"):
-    response = requests.post(f"{BASE_URL}/clients", json={
-        'nom': nom,
-        'prenom': prenom,
-        'telephone': telephone,
-        'email': email,
-        'adresse': adresse
-    })
-    if response.status_code == 201:
-        st.success("Client added successfully!")
-    else:
-        st.error(f"Failed to add client: {response.json().get('error', 'Unknown error')}")
+    show_section('/clients', 'clients', render_clients)
+
+    st.header("Add a New Client")
+    nom = st.text_input("Last Name")
+    prenom = st.text_input("First Name")
+    telephone = st.text_input("Phone")
+    email = st.text_input("Email")
+    adresse = st.text_input("Address")
+    if st.button("Add Client"):
+        response = api_call('POST', '/clients', json={
+            'nom': nom,
+            'prenom': prenom,
+            'telephone': telephone,
+            'email': email,
+            'adresse': adresse
+        })
+        if response.status_code == 201:
+            st.success("Client added successfully!")
+        else:
+            st.error(f"Failed to add client: {error_message(response, 'Unknown error')}")
+else:
+    st.warning("Staff access required to view clients.")
 
 # Reservations Section
 st.header("Reservations")
-if st.session_state.logged_in:
-    try:
-        response = requests.get(f"{BASE_URL}/reservations", headers=headers)
-        if response.status_code == 200:
-            reservations = response.json()
-            for reservation in reservations:
-                st.write(f"Reservation {reservation['id_reservation']} - Client: {reservation['client_name']} - Room: {reservation['numero_chambre']} - From {reservation['date_debut']} to {reservation['date_fin']} - Status: {reservation['statut']}")
-        else:
-            st.error("Access denied or server error")
-    except requests.RequestException:
-        st.error("Cannot connect to the backend for reservations. Ensure Flask is running.")
+if is_staff:
+    def render_reservations(reservations):
+        for reservation in reservations:
+            st.write(f"Reservation {reservation['id_reservation']} - Client: {reservation['client_name']} - Room: {reservation['numero_chambre']} - From {reservation['date_debut']} to {reservation['date_fin']} - Status: {reservation['statut']}")
+    show_section('/reservations', 'reservations', render_reservations)
 
 st.header("Add a New Reservation")
-if st.session_state.logged_in and st.session_state.username in ['staff', 'admin']:
+if is_staff:
     client_id = st.number_input("Client ID", min_value=1, step=1)
     room_id = st.number_input("Room ID", min_value=1, step=1)
     date_debut = st.date_input("Start Date")
     date_fin = st.date_input("End Date")
     if st.button("Add Reservation"):
-        response = requests.post(f"{BASE_URL}/reservations", json={
+        response = api_call('POST', '/reservations', json={
             'id_client': client_id,
             'id_chambre': room_id,
             'date_debut': str(date_debut),
             'date_fin': str(date_fin),
-            'statut': 'Confirmée'
-        }, headers=headers)
+        })
         if response.status_code == 201:
             st.success("Reservation added successfully!")
         else:
-            st.error(f"Failed to add reservation: {response.json().get('error', 'Access denied')}")
+            st.error(f"Failed to add reservation: {error_message(response)}")
 
 st.header("Cancel a Reservation")
-if st.session_state.logged_in and st.session_state.username in ['staff', 'admin']:
+if is_staff:
     reservation_id_cancel = st.number_input("Reservation ID (to cancel)", min_value=1, step=1)
     if st.button("Cancel Reservation"):
-        response = requests.delete(f"{BASE_URL}/reservations/{reservation_id_cancel}", headers=headers)
+        response = api_call('DELETE', f"/reservations/{reservation_id_cancel}")
         if response.status_code == 200:
             st.success("Reservation cancelled successfully!")
         else:
-            st.error(f"Failed to cancel reservation: {response.json().get('error', 'Access denied')}")
+            st.error(f"Failed to cancel reservation: {error_message(response)}")
 
 # Services Section
 st.header("Services")
 if st.session_state.logged_in:
-    try:
-        response = requests.get(f"{BASE_URL}/services", headers=headers)
-        if response.status_code == 200:
-            services = response.json()
-            for service in services:
-                st.write(f"Service {service['nom_service']} - {service['description']} - €{service['prix']} - {service['disponibilite']}")
-        else:
-            st.error("Access denied or server error")
-    except requests.RequestException:
-        st.error("Cannot connect to the backend for services. Ensure Flask is running.")
+    def render_services(services):
+        for service in services:
+            st.write(f"Service {service['nom_service']} - {service['description']} - €{service['prix']} - {service['disponibilite']}")
+    show_section('/services', 'services', render_services)
 
 st.header("Add a New Service")
-if st.session_state.logged_in and st.session_state.username == 'admin':
+if is_admin:
     nom_service = st.text_input("Service Name")
     description = st.text_input("Description")
     prix = st.number_input("Price", min_value=0.0, value=10.0)
     disponibilite = st.selectbox("Availability", ["Disponible", "Indisponible"])
     if st.button("Add Service"):
-        response = requests.post(f"{BASE_URL}/services", json={
+        response = api_call('POST', '/services', json={
             'nom_service': nom_service,
             'description': description,
             'prix': prix,
             'disponibilite': disponibilite
-        }, headers=headers)
+        })
         if response.status_code == 201:
             st.success("Service added successfully!")
         else:
-            st.error(f"Failed to add service: {response.json().get('error', 'Access denied')}")
+            st.error(f"Failed to add service: {error_message(response)}")
 
 # Associate Service with Reservation
 st.header("Associate Service with Reservation")
-if st.session_state.logged_in and st.session_state.username in ['staff', 'admin']:
+if is_staff:
     reservation_id_service = st.number_input("Reservation ID (for service association)", min_value=1, step=1)
     service_id = st.number_input("Service ID", min_value=1, step=1)
     if st.button("Associate Service"):
-        response = requests.post(f"{BASE_URL}/reservation_services", json={
+        response = api_call('POST', '/reservation_services', json={
             'id_reservation': reservation_id_service,
             'id_service': service_id
-        }, headers=headers)
+        })
         if response.status_code == 201:
             st.success("Service associated with reservation successfully!")
         else:
-            st.error(f"Failed to associate service: {response.json().get('error', 'Access denied')}")
+            st.error(f"Failed to associate service: {error_message(response)}")
 
 # Factures Section
 st.header("Invoices")
-if st.session_state.logged_in:
-    try:
-        response = requests.get(f"{BASE_URL}/factures", headers=headers)
-        if response.status_code == 200:
-            factures = response.json()
-            for facture in factures:
-                st.write(f"Invoice {facture['id_facture']} - Reservation ID: {facture['id_reservation']} - Client: {facture['client_name']} - Total: €{facture['montant_total']} - Issued: {facture['date_emission']} - Status: {facture['statut']}")
-        else:
-            st.error("Access denied or server error")
-    except requests.RequestException:
-        st.error("Cannot connect to the backend for invoices. Ensure Flask is running.")
+if is_staff:
+    def render_invoices(factures):
+        for facture in factures:
+            st.write(f"Invoice {facture['id_facture']} - Reservation ID: {facture['id_reservation']} - Client: {facture['client_name']} - Total: €{facture['montant_total']} - Issued: {facture['date_emission']} - Status: {facture['statut']}")
+    show_section('/factures', 'invoices', render_invoices)
 
 st.header("Generate a New Invoice")
-if st.session_state.logged_in and st.session_state.username in ['staff', 'admin']:
+if is_staff:
     reservation_id_facture = st.number_input("Reservation ID (for invoice)", min_value=1, step=1)
     if st.button("Generate Invoice"):
-        response = requests.post(f"{BASE_URL}/factures", json={
+        response = api_call('POST', '/factures', json={
             'id_reservation': reservation_id_facture
-        }, headers=headers)
+        })
         if response.status_code == 201:
             st.success(f"Invoice generated successfully! Total: €{response.json().get('montant_total')}")
         else:
-            st.error(f"Failed to generate invoice: {response.json().get('error', 'Access denied')}")
+            st.error(f"Failed to generate invoice: {error_message(response)}")
 
 st.header("Update Invoice Status")
-if st.session_state.logged_in and st.session_state.username in ['staff', 'admin']:
+if is_staff:
     facture_id = st.number_input("Invoice ID (to update)", min_value=1, step=1)
+    mode_paiement = st.selectbox("Payment Method", ["Carte", "Espèces", "Virement", "Chèque"])
     if st.button("Mark as Paid"):
-        response = requests.put(f"{BASE_URL}/factures/{facture_id}", json={}, headers=headers)
+        response = api_call('PUT', f"/factures/{facture_id}", json={'statut': 'Payée', 'mode_paiement': mode_paiement})
         if response.status_code == 200:
             st.success("Invoice status updated to Payée!")
         else:
-            st.error(f"Failed to update invoice: {response.json().get('error', 'Access denied')}")
+            st.error(f"Failed to update invoice: {error_message(response)}")
 
 # Avis (Reviews) Section
 st.header("Reviews")
 if st.session_state.logged_in:
-    try:
-        response = requests.get(f"{BASE_URL}/avis", headers=headers)
-        if response.status_code == 200:
-            avis = response.json()
-            for review in avis:
+    def render_reviews(avis):
+        for review in avis:
+            if review.get('moderated', 1):
                 st.write(f"Review {review['id_avis']} - Client: {review['client_name']} - Reservation ID: {review['id_reservation']} - Rating: {review['note']}/5 - Comment: {review['commentaire']} - Date: {review['date_avis']}")
-        else:
-            st.error("Access denied or server error")
-    except requests.RequestException:
-        st.error("Cannot connect to the backend for reviews. Ensure Flask is running.")
+    show_section('/avis', 'reviews', render_reviews)
 
 st.header("Add a New Review")
-client_id_avis = st.number_input("Client ID (for review)", min_value=1, step=1)
-reservation_id_avis = st.number_input("Reservation ID (for review)", min_value=1, step=1)
-note = st.slider("Rating (1-5)", min_value=1, max_value=5, step=1)
-commentaire = st.text_area("Comment")
-if st.button("Submit Review"):
-    response = requests.post(f"{BASE_URL}/avis", json={
-        'id_client': client_id_avis,
-        'id_reservation': reservation_id_avis,
-        'note': note,
-        'commentaire': commentaire
-    })
-    if response.status_code == 201:
-        st.success("Review submitted for moderation!")
-    else:
-        st.error(f"Failed to submit review: {response.json().get('error', 'Access denied')}")
+if st.session_state.logged_in:
+    client_id_avis = st.number_input("Client ID (for review)", min_value=1, step=1)
+    reservation_id_avis = st.number_input("Reservation ID (for review)", min_value=1, step=1)
+    note = st.slider("Rating (1-5)", min_value=1, max_value=5, step=1)
+    commentaire = st.text_area("Comment")
+    if st.button("Submit Review"):
+        response = api_call('POST', '/avis', json={
+            'id_client': client_id_avis,
+            'id_reservation': reservation_id_avis,
+            'note': note,
+            'commentaire': commentaire
+        })
+        if response.status_code == 201:
+            st.success("Review submitted for moderation!")
+        else:
+            st.error(f"Failed to submit review: {error_message(response)}")
 
 st.header("Moderate Reviews")
-if st.session_state.logged_in and st.session_state.username == 'admin':
-    try:
-        response = requests.get(f"{BASE_URL}/avis", headers=headers)
-        if response.status_code == 200:
-            avis = response.json()
-            pending_reviews = [r for r in avis if r.get('moderated', 0) == 0]
-            for review in pending_reviews:
-                st.write(f"Pending Review {review['id_avis']} - Client: {review['client_name']} - Rating: {review['note']}/5 - Comment: {review['commentaire']}")
-                if st.button(f"Approve Review {review['id_avis']}"):
-                    resp = requests.put(f"{BASE_URL}/avis/{review['id_avis']}/moderate", headers=headers)
-                    if resp.status_code == 200:
-                        st.success(f"Review {review['id_avis']} approved!")
-                    else:
-                        st.error(f"Failed to approve review: {resp.json().get('error')}")
-        else:
-            st.error("Access denied or server error")
-    except requests.RequestException:
-        st.error("Cannot connect to the backend for reviews. Ensure Flask is running.")
+if is_admin:
+    # Admins get pending reviews in the same /avis response (moderated = 0)
+    def render_pending(avis):
+        pending_reviews = [r for r in avis if r.get('moderated', 0) == 0]
+        for review in pending_reviews:
+            st.write(f"Pending Review {review['id_avis']} - Client: {review['client_name']} - Rating: {review['note']}/5 - Comment: {review['commentaire']}")
+            if st.button(f"Approve Review {review['id_avis']}"):
+                resp = api_call('PUT', f"/avis/{review['id_avis']}/moderate")
+                if resp.status_code == 200:
+                    st.success(f"Review {review['id_avis']} approved!")
+                else:
+                    st.error(f"Failed to approve review: {error_message(resp)}")
+    show_section('/avis', 'reviews', render_pending)
 
 # Dashboard Section
 st.header("Dashboard")
-if st.session_state.logged_in and st.session_state.username == 'admin':
-    try:
-        response = requests.get(f"{BASE_URL}/dashboard", headers=headers)
-        if response.status_code == 200:
-            data = response.json()
-            st.write(f"Occupancy Rate: {data['occupancy_rate']}%")
-            st.write(f"Average Rating: {data['average_rating']}/5")
-
-            # Create a simple chart
-            chart_data = pd.DataFrame({
-                'Metric': ['Occupancy Rate', 'Average Rating'],
-                'Value': [data['occupancy_rate'], data['average_rating'] * 20]  # Scale rating to 0-100 for consistency
-            })
-            st.bar_chart(chart_data.set_index('Metric'))
-        else:
-            st.error("Access denied or server error")
-    except requests.RequestException:
-        st.error("Cannot connect to the backend for dashboard. Ensure Flask is running.")
\ No newline at end of file
+if is_admin:
+    def render_dashboard(data):
+        st.write(f"Occupancy Rate: {data['occupancy_rate']}%")
+        st.write(f"Average Rating: {data['average_rating']}/5")
+
+        # Create a simple chart
+        chart_data = pd.DataFrame({
+            'Metric': ['Occupancy Rate', 'Average Rating'],
+            'Value': [data['occupancy_rate'], data['average_rating'] * 20]  # Scale rating to 0-100 for consistency
+        })
+        st.bar_chart(chart_data.set_index('Metric'))
+    show_section('/dashboard', 'dashboard', render_dashboard)
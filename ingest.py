@@ -0,0 +1,188 @@
+# ingest.py - Bulk streaming import of meter readings into consommations
+#
+# Reads CSV or JSON Lines one chunk at a time (constant memory whatever the
+# file size), validates each record, resolves the active reservation of every
+# reading in the chunk with a single range join, and inserts the chunk with
+# executemany inside its own short transaction. A chunk the database refuses
+# (e.g. its room was deleted meanwhile) is retried row by row, so only the
+# offending rows are rejected.
+#
+# Accepted fields (CSV header or JSON keys):
+#   id_chambre or numero_chambre, type_consommation, date_releve (YYYY-MM-DD),
+#   valeur, unite, cout_unitaire
+#
+# Usage:
+#   python ingest.py readings.csv
+#   python ingest.py readings.jsonl --chunk-size 10000
+#   bms-export | python ingest.py - --format jsonl
+
+import argparse
+import csv
+import io
+import itertools
+import json
+import math
+import sqlite3
+import sys
+import time
+from contextlib import closing
+from datetime import date
+
+from db import connect
+
+CHUNK_SIZE = 5000
+MAX_REPORTED_ERRORS = 20
+TYPES = ('Énergie', 'Eau', 'Gaz', 'Minibar')
+
+def detect_format(filename, default='csv'):
+    name = (filename or '').lower()
+    if name.endswith(('.jsonl', '.ndjson', '.json')):
+        return 'jsonl'
+    return 'csv' if name.endswith('.csv') else default
+
+def iter_records(stream, fmt):
+    """Yields (line_number, record_dict or error message) from a text stream."""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+    elif fmt == 'jsonl':
+        for line_number, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield line_number, f'invalid JSON: {e}'
+                continue
+            yield line_number, record if isinstance(record, dict) else 'expected a JSON object'
+    else:
+        raise ValueError(f"Unknown format '{fmt}' (use csv or jsonl).")
+
+def _parse(record, rooms_by_id, rooms_by_number):
+    """Validates one record; returns (id_chambre, type, date_releve, valeur, unite, cout_unitaire)."""
+    if isinstance(record, str):
+        raise ValueError(record)
+    if record.get('id_chambre') not in (None, ''):
+        id_chambre = int(record['id_chambre'])
+        if id_chambre not in rooms_by_id:
+            raise ValueError(f'unknown room id {id_chambre}')
+    elif record.get('numero_chambre') not in (None, ''):
+        id_chambre = rooms_by_number.get(str(record['numero_chambre']))
+        if id_chambre is None:
+            raise ValueError(f"unknown room number {record['numero_chambre']}")
+    else:
+        raise ValueError('id_chambre or numero_chambre is required')
+    type_conso = record.get('type_consommation')
+    if type_conso not in TYPES:
+        raise ValueError(f'invalid type_consommation {type_conso!r}')
+    date_releve = date.fromisoformat(str(record.get('date_releve', ''))[:10]).isoformat()
+    valeur = float(record['valeur'])
+    cout_unitaire = float(record['cout_unitaire'])
+    if not (math.isfinite(valeur) and math.isfinite(cout_unitaire)):
+        raise ValueError('valeur and cout_unitaire must be finite numbers')
+    if cout_unitaire < 0:
+        raise ValueError('cout_unitaire must not be negative')
+    unite = str(record.get('unite') or '').strip()
+    if not unite:
+        raise ValueError('unite is required')
+    return id_chambre, type_conso, date_releve, valeur, unite, cout_unitaire
+
+def _resolve_reservations(conn, rows):
+    """Active confirmed reservation per row (or None), for the whole chunk in one query."""
+    conn.execute('DELETE FROM _ingest_chunk')
+    conn.executemany('INSERT INTO _ingest_chunk (seq, id_chambre, date_releve) VALUES (?, ?, ?)',
+                     ((seq, row[0], row[2]) for seq, row in enumerate(rows)))
+    # Same rule as add_consommation: latest confirmed stay of the room covering the reading date
+    found = dict(conn.execute('''SELECT b.seq, MAX(r.id_reservation) FROM _ingest_chunk b
+                                 JOIN reservations r ON r.id_chambre = b.id_chambre AND r.statut = 'Confirmée'
+                                  AND r.date_debut <= b.date_releve AND r.date_fin > b.date_releve
+                                 GROUP BY b.seq'''))
+    return [found.get(seq) for seq in range(len(rows))]
+
+INSERT_SQL = '''INSERT INTO consommations
+                (id_chambre, type_consommation, date_releve, valeur, unite, cout_unitaire, id_reservation)
+                VALUES (?, ?, ?, ?, ?, ?, ?)'''
+
+def _reject(report, line_number, error):
+    report['rejected'] += 1
+    if len(report['errors']) < MAX_REPORTED_ERRORS:
+        report['errors'].append({'line': line_number, 'error': error})
+
+def _insert_chunk(conn, rows, lines, report):
+    """Inserts a chunk in one transaction; rows the database refuses are rejected one by one."""
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        links = _resolve_reservations(conn, rows)
+        try:
+            conn.executemany(INSERT_SQL, (row + (link,) for row, link in zip(rows, links)))
+            inserted = list(zip(rows, links))
+        except sqlite3.IntegrityError:
+            conn.rollback()
+            conn.execute('BEGIN IMMEDIATE')
+            links = _resolve_reservations(conn, rows)
+            inserted = []
+            for row, link, line_number in zip(rows, links, lines):
+                conn.execute('SAVEPOINT ingest_row')
+                try:
+                    conn.execute(INSERT_SQL, row + (link,))
+                    inserted.append((row, link))
+                except sqlite3.IntegrityError as e:
+                    conn.execute('ROLLBACK TO ingest_row')
+                    _reject(report, line_number, str(e))
+                conn.execute('RELEASE ingest_row')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    report['inserted'] += len(inserted)
+    report['linked'] += sum(link is not None for _, link in inserted)
+
+def import_readings(conn, stream, fmt='csv', chunk_size=CHUNK_SIZE):
+    """Streams readings from `stream` into consommations. Returns a summary report."""
+    started = time.perf_counter()
+    rooms_by_id, rooms_by_number = set(), {}
+    for id_chambre, numero in conn.execute('SELECT id_chambre, numero_chambre FROM chambres'):
+        rooms_by_id.add(id_chambre)
+        rooms_by_number[str(numero)] = id_chambre
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS _ingest_chunk (seq INTEGER PRIMARY KEY, id_chambre INTEGER, date_releve TEXT)')
+    report = {'read': 0, 'inserted': 0, 'linked': 0, 'rejected': 0, 'errors': []}
+    records = iter_records(stream, fmt)
+    while True:
+        chunk = list(itertools.islice(records, chunk_size))
+        if not chunk:
+            break
+        rows, lines = [], []
+        for line_number, record in chunk:
+            try:
+                rows.append(_parse(record, rooms_by_id, rooms_by_number))
+                lines.append(line_number)
+            except (ValueError, TypeError, KeyError) as e:
+                _reject(report, line_number, str(e) if not isinstance(e, KeyError) else f'missing field {e}')
+        report['read'] += len(chunk)
+        if rows:
+            _insert_chunk(conn, rows, lines, report)
+    elapsed = time.perf_counter() - started
+    report['elapsed_ms'] = round(elapsed * 1000, 2)
+    report['rows_per_second'] = round(report['read'] / elapsed) if elapsed > 0 else None
+    return report
+
+def text_stream(binary):
+    """Wraps an uploaded/binary stream for line-by-line decoding (a BOM is skipped)."""
+    return io.TextIOWrapper(binary, encoding='utf-8-sig', newline='')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Gest'Hôtel bulk consumption import")
+    parser.add_argument('file', help="CSV or JSONL file, or '-' for stdin")
+    parser.add_argument('--format', choices=['csv', 'jsonl'], default=None, help='default: from the file extension (csv)')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='rows per transaction (default: %(default)s)')
+    args = parser.parse_args()
+    fmt = args.format or detect_format(args.file)
+    source = text_stream(sys.stdin.buffer) if args.file == '-' else open(args.file, encoding='utf-8-sig', newline='')
+    with source, closing(connect()) as conn:
+        report = import_readings(conn, source, fmt, args.chunk_size)
+    print(f"Read {report['read']} rows: {report['inserted']} inserted ({report['linked']} linked to a stay), "
+          f"{report['rejected']} rejected, in {report['elapsed_ms']} ms ({report['rows_per_second']} rows/s)")
+    for error in report['errors']:
+        print(f"   line {error['line']}: {error['error']}")
+    sys.exit(1 if report['rejected'] else 0)
@@ -0,0 +1,96 @@
+# kpi.py - Incrementally maintained dashboard KPIs for Gest'Hôtel
+#
+# Triggers installed by migrations/0005_dashboard_kpis.py keep three small
+# summary tables in step with every write, whichever route or worker makes it:
+#   kpi_totals           running counters: rooms_total, rating_sum, rating_count
+#   kpi_daily_occupancy  rooms occupied per night (non-cancelled stays)
+#   kpi_calendar         one row per day, lets triggers expand a stay into nights
+# The dashboard then reads a handful of primary-key rows instead of scanning
+# reservations and reviews.
+#
+# Usage:
+#   python kpi.py check      # Compare the counters with a full recount
+#   python kpi.py rebuild    # Recompute every counter from scratch
+
+import sys
+from contextlib import closing
+from datetime import date, timedelta
+
+# Nights outside this range are not counted (kpi_calendar bounds)
+CALENDAR_FIRST = '2000-01-01'
+CALENDAR_LAST = '2099-12-31'
+
+# Stays that occupy their room, for occupancy counting
+COUNTED_STATUSES = "('Confirmée', 'Terminée')"
+
+# Dashboard statements (hot statements checked by queryplans.py)
+OCCUPANCY_SQL = 'SELECT rooms_occupied FROM kpi_daily_occupancy WHERE jour = ?'
+UPCOMING_CHECKINS_SQL = '''SELECT r.id_reservation, r.date_debut, c.nom, c.prenom, ch.numero_chambre
+                           FROM reservations r JOIN clients c ON r.id_client = c.id_client JOIN chambres ch ON r.id_chambre = ch.id_chambre
+                           WHERE r.statut = 'Confirmée' AND r.date_debut BETWEEN ? AND ?
+                           ORDER BY r.date_debut ASC LIMIT ?'''
+
+def dashboard_kpis(conn, today):
+    """Occupancy rate and average rating from the summary tables (a few PK lookups)."""
+    totals = {row['name']: row['value'] for row in conn.execute('SELECT name, value FROM kpi_totals')}
+    occupied = conn.execute(OCCUPANCY_SQL, (today,)).fetchone()
+    rooms_total = totals.get('rooms_total', 0)
+    rating_count = totals.get('rating_count', 0)
+    return {
+        'rooms_total': int(rooms_total),
+        'rooms_occupied': occupied['rooms_occupied'] if occupied else 0,
+        'occupancy_rate': (occupied['rooms_occupied'] / rooms_total * 100) if occupied and rooms_total else 0,
+        'average_rating': totals.get('rating_sum', 0) / rating_count if rating_count else 0,
+    }
+
+def upcoming_checkins(conn, today, days=7, limit=5):
+    """Next confirmed arrivals: a LIMIT seek on idx_reservations_statut_debut, independent of history size."""
+    until = (date.fromisoformat(today) + timedelta(days=days)).isoformat()
+    return conn.execute(UPCOMING_CHECKINS_SQL, (today, until, limit)).fetchall()
+
+def _recount_totals(conn):
+    return {
+        'rooms_total': conn.execute('SELECT COUNT(*) FROM chambres').fetchone()[0],
+        'rating_sum': conn.execute('SELECT COALESCE(SUM(note), 0) FROM avis WHERE moderated = 1').fetchone()[0],
+        'rating_count': conn.execute('SELECT COUNT(*) FROM avis WHERE moderated = 1').fetchone()[0],
+    }
+
+_RECOUNT_OCCUPANCY = f'''SELECT k.jour, COUNT(*) FROM kpi_calendar k
+                         JOIN reservations r ON k.jour >= r.date_debut AND k.jour < r.date_fin
+                         WHERE r.statut IN {COUNTED_STATUSES}
+                         GROUP BY k.jour'''
+
+def rebuild(conn):
+    """Recomputes every counter from the base tables. Runs in the caller's transaction."""
+    if conn.execute('SELECT COUNT(*) FROM kpi_calendar').fetchone()[0] == 0:
+        conn.execute('''INSERT INTO kpi_calendar (jour)
+                        WITH RECURSIVE days(jour) AS (SELECT ? UNION ALL SELECT date(jour, '+1 day') FROM days WHERE jour < ?)
+                        SELECT jour FROM days''', (CALENDAR_FIRST, CALENDAR_LAST))
+    conn.execute('DELETE FROM kpi_totals')
+    conn.executemany('INSERT INTO kpi_totals (name, value) VALUES (?, ?)', _recount_totals(conn).items())
+    conn.execute('DELETE FROM kpi_daily_occupancy')
+    conn.execute(f'INSERT INTO kpi_daily_occupancy (jour, rooms_occupied) {_RECOUNT_OCCUPANCY}')
+
+def check(conn):
+    """Compares the maintained counters with a full recount; returns the differences."""
+    stored = {row[0]: row[1] for row in conn.execute('SELECT name, value FROM kpi_totals')}
+    totals = {name: (stored.get(name), value) for name, value in _recount_totals(conn).items() if stored.get(name) != value}
+    stored_days = {row[0]: row[1] for row in conn.execute('SELECT jour, rooms_occupied FROM kpi_daily_occupancy WHERE rooms_occupied != 0')}
+    expected_days = dict(conn.execute(_RECOUNT_OCCUPANCY).fetchall())
+    days = sorted(d for d in set(stored_days) | set(expected_days) if stored_days.get(d) != expected_days.get(d))
+    return {'consistent': not (totals or days), 'totals': totals, 'days': days}
+
+if __name__ == '__main__':
+    from db import connect
+    if sys.argv[1:] not in (['check'], ['rebuild']):
+        print("Usage: python kpi.py check|rebuild")
+        sys.exit(2)
+    with closing(connect()) as conn:
+        if sys.argv[1] == 'rebuild':
+            rebuild(conn)
+            conn.commit()
+            print("Dashboard KPIs rebuilt.")
+        report = check(conn)
+    print(f"Dashboard KPIs: {'consistent' if report['consistent'] else 'INCONSISTENT'}"
+          + ('' if report['consistent'] else f" (totals: {report['totals']}, days: {len(report['days'])})"))
+    sys.exit(0 if report['consistent'] else 1)
@@ -0,0 +1,303 @@
+# loadtest.py - End-to-end HTTP load test of the Gest'Hôtel Flask routes
+#
+# Serves the app from a throwaway copy of a database (by default a synthetic
+# hotel from create_db.generate) on a local threaded server, then runs --workers processes
+# that each repeat a weighted mix of staff actions for --duration seconds:
+#
+#   browse     GET  /reservations (first page, with or without filters)
+#   reserve    POST /reservations/add on a few "hot" rooms, so bookings conflict
+#   invoice    POST /factures/generate for stays without an invoice
+#   reading    POST /consommations/add
+#   dashboard  GET  /dashboard
+#
+# Workers authenticate with an admin API token instead of a session cookie, so
+# the session cookie of each response holds only that request's flash message,
+# which classifies the outcome: ok, conflict (a booking refused as the rules
+# require), locked (SQLite busy / locked) or error.
+#
+# For every route it reports throughput, p50/p95/p99 latency and the outcome
+# counts. --save stores the results as a named baseline (in loadtest_baselines/);
+# --compare reports the change against one and exits 1 on a regression.
+#
+# Usage:
+#   python loadtest.py                                    # 4 workers x 20 s on a synthetic hotel
+#   python loadtest.py --workers 8 --duration 60 --mix browse=60,reserve=40
+#   python loadtest.py --db gesthotel.db --username admin --password admin123
+#   python loadtest.py --url http://127.0.0.1:5000 --db gesthotel.db   # An already running server on that database
+#   python loadtest.py --save before                      # ... change something ...
+#   python loadtest.py --compare before
+
+import argparse
+import base64
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from contextlib import closing
+from datetime import date, timedelta
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+
+import baselines
+import create_db
+import migrate
+from db import connect
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE_DIR = os.path.join(HERE, 'loadtest_baselines')
+DEFAULT_MIX = {'browse': 40, 'reserve': 20, 'invoice': 10, 'reading': 20, 'dashboard': 10}
+READING_UNITS = {'Énergie': ('kWh', 0.15), 'Eau': ('m³', 3.5), 'Gaz': ('m³', 0.9), 'Minibar': ('article', 4.0)}
+
+def load_plan(db_file, hot_rooms):
+    """The ids the workers pick from, read once from the database under test."""
+    with closing(connect(db_file)) as conn:
+        rooms = [row[0] for row in conn.execute('SELECT id_chambre FROM chambres ORDER BY id_chambre')]
+        return {
+            'rooms': rooms,
+            'hot_rooms': rooms[:hot_rooms],
+            'clients': [row[0] for row in conn.execute('SELECT id_client FROM clients')],
+            'id_tarif': conn.execute("SELECT id_tarif FROM tarifs ORDER BY nom_tarif != 'Standard', id_tarif").fetchone()[0],
+            'uninvoiced': [row[0] for row in conn.execute('''
+                SELECT id_reservation FROM reservations WHERE statut IN ('Confirmée', 'Terminée')
+                AND id_reservation NOT IN (SELECT id_reservation FROM factures) ORDER BY id_reservation DESC LIMIT 20000''')],
+        }
+
+# --- Server ---
+def free_port():
+    with closing(socket.socket()) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def start_server(db_file, log_file):
+    """Runs the app on a free local port (threaded server, no reloader); returns (process, base URL)."""
+    port = free_port()
+    env = {**os.environ, 'GESTHOTEL_DB': db_file, 'NIGHT_AUDIT_SCHEDULER': '0'}
+    process = subprocess.Popen([sys.executable, '-m', 'flask', '--app', 'app', 'run', '--port', str(port),
+                                '--with-threads', '--no-reload', '--no-debugger'],
+                               cwd=HERE, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f'Server exited with code {process.returncode}; see {log_file.name}')
+        try:
+            requests.get(base_url + '/login', timeout=1)
+            return process, base_url
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    process.terminate()
+    raise SystemExit('Server did not start within 60 s.')
+
+# --- Workers ---
+def flashes(response):
+    """The (category, message) flashes in a response's session cookie (read, not verified)."""
+    cookie = response.cookies.get('session')
+    if not cookie:
+        return []
+    payload = cookie.lstrip('.').split('.')[0]
+    data = base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4))
+    if cookie.startswith('.'): # Compressed by itsdangerous
+        data = zlib.decompress(data)
+    return [tuple(f[' t'] if isinstance(f, dict) else f) for f in json.loads(data).get('_flashes', [])]
+
+def outcome(response):
+    """ok, conflict, locked or error."""
+    messages = flashes(response)
+    text = ' '.join(message for _, message in messages).lower()
+    if 'locked' in text or 'busy' in text:
+        return 'locked'
+    if response.status_code >= 400:
+        return 'locked' if b'locked' in response.content else 'error'
+    if any(category == 'success' for category, _ in messages):
+        return 'ok'
+    if 'conflict' in text or 'already' in text:
+        return 'conflict'
+    return 'error' if messages else 'ok'
+
+def run_worker(worker_id, base_url, token, plan, mix, duration, seed_value):
+    """One staff user repeating the mix for `duration` seconds; returns [(route, outcome, ms)]."""
+    rng = random.Random(seed_value * 1000 + worker_id)
+    http = requests.Session()
+    http.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[])) # Never send a session back
+    http.headers['Authorization'] = f'Bearer {token}'
+    invoices = plan['uninvoiced'][worker_id::plan['workers']]
+    today = date.today()
+
+    def browse():
+        params = rng.choice([{}, {'statut': 'Confirmée'}, {'id_chambre': rng.choice(plan['rooms'])}])
+        return http.get(f'{base_url}/reservations', params={'per_page': 50, **params})
+
+    def reserve():
+        start = today + timedelta(days=rng.randint(1, 60))
+        return http.post(f'{base_url}/reservations/add', allow_redirects=False, data={
+            'id_client': rng.choice(plan['clients']), 'id_chambre': rng.choice(plan['hot_rooms']), 'id_tarif': plan['id_tarif'],
+            'date_debut': start.isoformat(), 'date_fin': (start + timedelta(days=rng.randint(1, 5))).isoformat()})
+
+    def invoice():
+        # Each stay is invoiced once; after that, re-submissions are refused as conflicts
+        id_reservation = invoices.pop() if invoices else rng.choice(plan['uninvoiced'] or [0])
+        return http.post(f'{base_url}/factures/generate', allow_redirects=False, data={'id_reservation': id_reservation})
+
+    def reading():
+        kind = rng.choice(list(READING_UNITS))
+        unite, cout = READING_UNITS[kind]
+        return http.post(f'{base_url}/consommations/add', allow_redirects=False, data={
+            'id_chambre': rng.choice(plan['rooms']), 'type_consommation': kind,
+            'date_releve': (today - timedelta(days=rng.randint(0, 30))).isoformat(),
+            'valeur': round(rng.uniform(0.1, 20), 2), 'unite': unite, 'cout_unitaire': cout})
+
+    def dashboard():
+        return http.get(f'{base_url}/dashboard')
+
+    actions = {'browse': browse, 'reserve': reserve, 'invoice': invoice, 'reading': reading, 'dashboard': dashboard}
+    routes, weights = list(mix), list(mix.values())
+    samples = []
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        route = rng.choices(routes, weights)[0]
+        started = time.perf_counter()
+        try:
+            result = outcome(actions[route]())
+        except requests.RequestException:
+            result = 'error'
+        samples.append((route, result, (time.perf_counter() - started) * 1000))
+    return samples
+
+# --- Report ---
+def summarize(samples, duration):
+    """Per-route (and 'all') throughput, latency percentiles and outcome counts."""
+    by_route = {}
+    for route, result, ms in samples:
+        by_route.setdefault(route, []).append((result, ms))
+    by_route['all'] = [(result, ms) for _, result, ms in samples]
+    report = {}
+    for route, rows in by_route.items():
+        latencies = sorted(ms for _, ms in rows)
+        cuts = statistics.quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else latencies * 99
+        counts = {kind: sum(1 for result, _ in rows if result == kind) for kind in ('ok', 'conflict', 'locked', 'error')}
+        report[route] = {'requests': len(rows), 'rps': round(len(rows) / duration, 1),
+                         'p50_ms': round(cuts[49], 2), 'p95_ms': round(cuts[94], 2), 'p99_ms': round(cuts[98], 2), **counts}
+    return report
+
+def print_report(report):
+    print(f"{'route':<11}{'requests':>9}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"{'ok':>8}{'conflict':>9}{'locked':>8}{'error':>7}")
+    for route, r in sorted(report.items(), key=lambda item: item[0] == 'all'):
+        print(f"{route:<11}{r['requests']:>9}{r['rps']:>9.1f}{r['p50_ms']:>9.2f}{r['p95_ms']:>9.2f}{r['p99_ms']:>9.2f}"
+              f"{r['ok']:>8}{r['conflict']:>9}{r['locked']:>8}{r['error']:>7}")
+
+def compare(report, baseline, tolerance, settings):
+    """Prints the change per route against a baseline; returns the regressions found."""
+    regressions = []
+    print(f"\nAgainst baseline '{baseline['name']}' ({baseline['created']}, {baseline.get('commit') or 'unknown commit'}):")
+    if any(baseline['settings'].get(k) != v for k, v in settings.items()):
+        print(f"WARNING: the baseline was run with other settings ({baseline['settings']}).")
+    print(f"{'route':<11}{'req/s':>16}{'p95 ms':>18}{'locked':>12}")
+    for route, r in report.items():
+        base = baseline['routes'].get(route)
+        if not base:
+            continue
+        rps_change = (r['rps'] / base['rps'] - 1) * 100 if base['rps'] else 0.0
+        p95_change = (r['p95_ms'] / base['p95_ms'] - 1) * 100 if base['p95_ms'] else 0.0
+        print(f"{route:<11}{base['rps']:>8.1f}{rps_change:>+7.1f}%{base['p95_ms']:>9.2f}{p95_change:>+8.1f}%"
+              f"{base['locked']:>6} -> {r['locked']}")
+        if p95_change > tolerance * 100:
+            regressions.append(f'{route}: p95 {base["p95_ms"]} -> {r["p95_ms"]} ms')
+        if rps_change < -tolerance * 100:
+            regressions.append(f'{route}: throughput {base["rps"]} -> {r["rps"]} req/s')
+        if r['locked'] / max(r['requests'], 1) > base['locked'] / max(base['requests'], 1):
+            regressions.append(f'{route}: lock errors {base["locked"]} -> {r["locked"]}')
+    return regressions
+
+def parse_mix(text):
+    mix = dict(DEFAULT_MIX) if not text else {}
+    for part in filter(None, (text or '').split(',')):
+        route, _, weight = part.partition('=')
+        if route not in DEFAULT_MIX:
+            raise SystemExit(f"Unknown route '{route}' in --mix (routes: {', '.join(DEFAULT_MIX)}).")
+        mix[route] = float(weight or 1)
+    return {route: weight for route, weight in mix.items() if weight > 0}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Gest'Hôtel HTTP load test")
+    parser.add_argument('--db', help='database to test on (copied first unless --url is given; default: a synthetic hotel)')
+    parser.add_argument('--url', help='test an already running server instead of starting one')
+    parser.add_argument('--workers', type=int, default=4, help='concurrent worker processes (default: %(default)s)')
+    parser.add_argument('--duration', type=float, default=20, help='seconds of load (default: %(default)s)')
+    parser.add_argument('--mix', help=f"route weights, e.g. browse=60,reserve=40 (default: "
+                                      f"{','.join(f'{k}={v}' for k, v in DEFAULT_MIX.items())})")
+    parser.add_argument('--hot-rooms', type=int, default=10, help='rooms that new bookings compete for (default: %(default)s)')
+    parser.add_argument('--scale', type=int, default=20000, help='synthetic hotel: reservations (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=42, help='random seed for the data and the workers (default: %(default)s)')
+    parser.add_argument('--today', type=date.fromisoformat, default=date.today(),
+                        help='synthetic hotel: date its history is anchored on (default: today)')
+    parser.add_argument('--username', default='admin')
+    parser.add_argument('--password', default='admin123')
+    parser.add_argument('--save', metavar='NAME', help='store the results as baseline NAME')
+    parser.add_argument('--compare', metavar='NAME', help='compare with baseline NAME; exit 1 on a regression')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed p95 / throughput change (default: %(default)s)')
+    parser.add_argument('--baseline-dir', default=BASELINE_DIR)
+    args = parser.parse_args()
+    mix = parse_mix(args.mix)
+
+    workdir = tempfile.mkdtemp(prefix='gesthotel-loadtest-')
+    server = log_file = None
+    try:
+        if args.url:
+            if not args.db:
+                raise SystemExit('--url needs --db, the database that server uses (to pick rooms, clients and stays).')
+            db_file, base_url = args.db, args.url.rstrip('/')
+        else:
+            db_file = os.path.join(workdir, 'loadtest.db')
+            if args.db:
+                with closing(connect(args.db)) as source, closing(sqlite3.connect(db_file)) as copy:
+                    source.backup(copy) # Consistent copy, WAL included
+                migrate.upgrade(db_file, verbose=False)
+            else:
+                create_db.setup_database(db_file)
+                create_db.generate(db_file, args.scale, seed=args.seed, today=args.today)
+            log_file = open(os.path.join(workdir, 'server.log'), 'w')
+            server, base_url = start_server(db_file, log_file)
+        plan = {**load_plan(db_file, args.hot_rooms), 'workers': args.workers}
+        login = requests.post(f'{base_url}/api/v1/login', json={'username': args.username, 'password': args.password}, timeout=30)
+        if login.status_code != 200:
+            raise SystemExit(f"Login as '{args.username}' failed ({login.status_code}): {login.text}")
+        token = login.json()['token']
+
+        print(f"{args.workers} workers x {args.duration:g} s against {base_url} (mix: {mix})...")
+        started = time.perf_counter()
+        with multiprocessing.Pool(args.workers) as pool:
+            results = pool.starmap(run_worker, [(w, base_url, token, plan, mix, args.duration, args.seed)
+                                                for w in range(args.workers)])
+        elapsed = time.perf_counter() - started
+        report = summarize([sample for samples in results for sample in samples], elapsed)
+        print_report(report)
+
+        settings = {'workers': args.workers, 'duration': args.duration, 'mix': mix, 'hot_rooms': args.hot_rooms,
+                    'db': args.db or f'synthetic, {args.scale} reservations, anchored on {args.today.isoformat()}'}
+        regressions = []
+        if args.compare:
+            regressions = compare(report, baselines.load(args.baseline_dir, args.compare), args.tolerance, settings)
+            for regression in regressions:
+                print(f"!!! Regression: {regression}")
+        if args.save:
+            path = baselines.save(args.baseline_dir, args.save, settings, routes=report)
+            print(f"Baseline saved to {path}")
+        sys.exit(1 if regressions else 0)
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+        if log_file:
+            log_file.close()
+        shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,234 @@
+# metrics.py - Prometheus-style /metrics endpoint for Gest'Hôtel
+#
+# Counters and histograms live in plain per-process dicts, updated under a
+# process-local lock held for a couple of dict operations (no cross-process
+# locking on the request path). At most once per FLUSH_SECONDS a worker writes
+# a snapshot of its own values to GESTHOTEL_METRICS_DIR/<pid>.json (atomic
+# rename), and GET /metrics sums the snapshots of every worker process, so any
+# worker of a pre-forking server can answer the scrape.
+#
+# Exposed series:
+#   gesthotel_http_requests_total{endpoint,method,status}   and request latency
+#   gesthotel_http_request_duration_seconds{endpoint}         histograms
+#   gesthotel_http_exceptions_total{endpoint,exception}
+#   gesthotel_db_busy_total, gesthotel_db_write_lock_wait_seconds   (SQL trace, querylog.py)
+#   gesthotel_db_connections{state}, gesthotel_db_pool_*             (db.py pool)
+#   gesthotel_reservations_created_total, gesthotel_reservation_conflicts_total{check},
+#   gesthotel_invoices_generated_total{mode}, gesthotel_price_calculation_errors_total
+#
+# Snapshots of exited workers keep counting towards the totals; a restart that
+# reuses a pid looks like a counter reset, which rate() handles. Gauges only sum
+# workers that flushed in the last GAUGE_TTL seconds.
+#
+# Configuration (environment):
+#   GESTHOTEL_METRICS        '1' (default) or '0' to disable
+#   GESTHOTEL_METRICS_DIR    snapshot folder (default: metrics)
+#   GESTHOTEL_METRICS_TOKEN  if set, /metrics requires 'Authorization: Bearer <token>'
+#
+# Usage:
+#   python metrics.py          # Print the aggregated metrics
+#   python metrics.py clear    # Delete the snapshots (all counters restart at 0)
+
+import atexit
+import glob
+import hmac
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+
+from flask import Response, abort, g, request
+
+from db import pool
+
+log = logging.getLogger(__name__)
+
+ENABLED = os.environ.get('GESTHOTEL_METRICS', '1') == '1'
+METRICS_DIR = os.environ.get('GESTHOTEL_METRICS_DIR', 'metrics')
+TOKEN = os.environ.get('GESTHOTEL_METRICS_TOKEN', '')
+FLUSH_SECONDS = 1.0
+GAUGE_TTL = 300
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LOCK_WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0)
+
+# Name -> (type, help[, histogram buckets])
+METRICS = {
+    'gesthotel_http_requests_total': ('counter', 'HTTP requests by Flask endpoint, method and status code.'),
+    'gesthotel_http_request_duration_seconds': ('histogram', 'Time to build the response by Flask endpoint (streamed bodies excluded).', LATENCY_BUCKETS),
+    'gesthotel_http_exceptions_total': ('counter', 'Unhandled exceptions (500 responses) by Flask endpoint and exception type.'),
+    'gesthotel_db_busy_total': ('counter', 'Statements that failed with SQLITE_BUSY / SQLITE_LOCKED after the busy timeout.'),
+    'gesthotel_db_write_lock_wait_seconds': ('histogram', 'Time BEGIN IMMEDIATE spent retrying for the write lock.', LOCK_WAIT_BUCKETS),
+    'gesthotel_db_connections': ('gauge', 'Pooled SQLite connections by state.'),
+    'gesthotel_db_pool_acquires_total': ('counter', 'Pool acquisitions by result (hit: idle connection reused, miss: new connection opened).'),
+    'gesthotel_db_pool_discarded_total': ('counter', 'Connections closed on release (pool full or broken).'),
+    'gesthotel_reservations_created_total': ('counter', 'Reservations booked.'),
+    'gesthotel_reservation_conflicts_total': ('counter', 'Bookings rejected because the room was taken, by the check that caught it.'),
+    'gesthotel_invoices_generated_total': ('counter', 'Invoices issued, one by one or by batch invoicing.'),
+    'gesthotel_price_calculation_errors_total': ('counter', 'Prices that fell back to the base rate because of invalid inputs.'),
+    'gesthotel_metrics_processes': ('gauge', 'Worker processes whose snapshot is recent enough for the gauges.'),
+}
+
+_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_counters = {} # (name, labels) -> value; labels is a tuple of (key, value) pairs
+_histograms = {} # (name, labels) -> [count per bucket..., count above the last bucket, sum]
+_flushed_at = 0.0
+
+# --- Recording ---
+def inc(name, amount=1, **labels):
+    """Adds `amount` to a counter of this process."""
+    key = (name, tuple(labels.items()))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+def observe(name, value, **labels):
+    """Records one value (seconds) in a histogram of this process."""
+    buckets = METRICS[name][2]
+    key = (name, tuple(labels.items()))
+    with _lock:
+        counts = _histograms.get(key)
+        if counts is None:
+            counts = _histograms[key] = [0] * (len(buckets) + 1) + [0.0]
+        counts[bisect_left(buckets, value)] += 1
+        counts[-1] += value
+
+# --- Snapshots ---
+def snapshot():
+    """This process's values, JSON-serializable."""
+    with _lock:
+        counters = [[name, list(labels), value] for (name, labels), value in _counters.items()]
+        histograms = [[name, list(labels), list(counts)] for (name, labels), counts in _histograms.items()]
+    stats = pool.stats()
+    counters += [['gesthotel_db_pool_acquires_total', [['result', 'hit']], stats['hits']],
+                 ['gesthotel_db_pool_acquires_total', [['result', 'miss']], stats['misses']],
+                 ['gesthotel_db_pool_discarded_total', [], stats['discarded']]]
+    gauges = [['gesthotel_db_connections', [['state', 'in_use']], stats['in_use']],
+              ['gesthotel_db_connections', [['state', 'idle']], stats['idle']]]
+    return {'pid': os.getpid(), 'written': time.time(), 'counters': counters, 'histograms': histograms, 'gauges': gauges}
+
+def flush():
+    """Writes this process's snapshot to METRICS_DIR/<pid>.json (replaced atomically)."""
+    global _flushed_at
+    with _flush_lock:
+        _flushed_at = time.monotonic()
+        path = os.path.join(METRICS_DIR, f'{os.getpid()}.json')
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(snapshot(), f, separators=(',', ':'))
+        os.replace(path + '.tmp', path)
+
+def flush_if_due():
+    """Flushes unless this process did so less than FLUSH_SECONDS ago or another thread is at it."""
+    if time.monotonic() - _flushed_at < FLUSH_SECONDS or _flush_lock.locked():
+        return
+    try:
+        flush()
+    except OSError as e:
+        log.warning('Could not write metrics snapshot: %s', e)
+
+def _flush_at_exit():
+    try:
+        flush() # Last values of a worker that exits between flushes
+    except OSError:
+        pass
+
+def collect():
+    """Sums the snapshots of every worker: {'counter'|'gauge': {(name, labels): value}, 'histogram': {...: counts}}."""
+    totals = {'counter': {}, 'gauge': {}, 'histogram': {}}
+    now = time.time()
+    processes = 0
+    for path in glob.glob(os.path.join(METRICS_DIR, '*.json')):
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue # Foreign or unreadable file
+        for name, labels, value in data['counters']:
+            key = (name, tuple(map(tuple, labels)))
+            totals['counter'][key] = totals['counter'].get(key, 0) + value
+        for name, labels, counts in data['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            total = totals['histogram'].get(key)
+            totals['histogram'][key] = counts if total is None else [a + b for a, b in zip(total, counts)]
+        if now - data['written'] <= GAUGE_TTL:
+            processes += 1
+            for name, labels, value in data['gauges']:
+                key = (name, tuple(map(tuple, labels)))
+                totals['gauge'][key] = totals['gauge'].get(key, 0) + value
+    totals['gauge'][('gesthotel_metrics_processes', ())] = processes
+    return totals
+
+# --- Exposition ---
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def render(totals):
+    """Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+    for name, (kind, help_text, *buckets) in METRICS.items():
+        series = sorted((labels, value) for (metric, labels), value in totals[kind].items() if metric == name)
+        if not series and kind != 'counter':
+            continue
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+        if kind != 'histogram':
+            lines += [f'{name}{_labels(labels)} {_number(value)}' for labels, value in series] or [f'{name} 0']
+            continue
+        for labels, counts in series:
+            cumulative = 0
+            for bound, count in zip(buckets[0] + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else _number(bound)
+                lines.append(f'{name}_bucket{_labels(labels, [("le", le)])} {cumulative}')
+            lines += [f'{name}_sum{_labels(labels)} {_number(counts[-1])}', f'{name}_count{_labels(labels)} {cumulative}']
+    return '\n'.join(lines) + '\n'
+
+# --- Flask integration ---
+def init_app(app):
+    """Times and counts every request and serves the aggregated metrics on GET /metrics."""
+    if not ENABLED:
+        return
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    atexit.register(_flush_at_exit)
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        started = g.get('metrics_started')
+        if started is not None:
+            endpoint = request.endpoint or 'unmatched' # 404s: keep the label set bounded
+            observe('gesthotel_http_request_duration_seconds', time.perf_counter() - started, endpoint=endpoint)
+            inc('gesthotel_http_requests_total', endpoint=endpoint, method=request.method, status=str(response.status_code))
+            flush_if_due()
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        if TOKEN and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {TOKEN}'):
+            abort(401)
+        flush() # This worker's latest values, then every worker's snapshot
+        return Response(render(collect()), mimetype='text/plain', content_type='text/plain; version=0.0.4; charset=utf-8')
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['clear']:
+        paths = glob.glob(os.path.join(METRICS_DIR, '*.json'))
+        for path in paths:
+            os.remove(path)
+        print(f"Deleted {len(paths)} metrics snapshot(s) from {METRICS_DIR}.")
+    elif sys.argv[1:]:
+        print("Usage: python metrics.py [clear]")
+        sys.exit(1)
+    else:
+        print(render(collect()), end='')
+    sys.exit(0)
@@ -0,0 +1,340 @@
+# migrate.py - Versioned, non-destructive schema migrations for Gest'Hôtel
+#
+# Usage:
+#   python migrate.py status              # Show applied / pending migrations
+#   python migrate.py upgrade             # Apply every pending migration
+#   python migrate.py upgrade --to 2      # Stop after version 2
+#   python migrate.py upgrade --batch-size 2000
+#   python migrate.py selftest            # Online helpers against concurrent writes (temporary database)
+#
+# Migrations live in migrations/NNNN_description.py and define
+# `upgrade(conn, batch_size)`. A migration with `ONLINE = True` manages its own
+# (short) transactions, e.g. through backfill_in_batches or rebuild_table_online,
+# and must be safe to re-run if interrupted. Every other migration runs inside a
+# single transaction together with its schema_version row.
+
+import argparse
+import importlib.util
+import os
+import random
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from db import DATABASE, connect
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+DEFAULT_BATCH_SIZE = int(os.environ.get('GESTHOTEL_MIGRATION_BATCH', 5000))
+_MIGRATION_FILE = re.compile(r'^(\d{4})_(\w+)\.py$')
+
+# --- Discovery ---
+class Migration:
+    def __init__(self, version, name, path):
+        self.version = version
+        self.name = name
+        self.path = path
+        self._module = None
+
+    @property
+    def module(self):
+        # File names start with digits, so they are loaded by path, not imported
+        if self._module is None:
+            spec = importlib.util.spec_from_file_location(f'migration_{self.version:04d}', self.path)
+            self._module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(self._module)
+        return self._module
+
+    @property
+    def online(self):
+        return getattr(self.module, 'ONLINE', False)
+
+    @property
+    def description(self):
+        return (self.module.__doc__ or self.name).strip().splitlines()[0]
+
+def discover_migrations(directory=MIGRATIONS_DIR):
+    """Returns the migrations found on disk, ordered by version."""
+    migrations = []
+    for filename in sorted(os.listdir(directory)):
+        match = _MIGRATION_FILE.match(filename)
+        if match:
+            migrations.append(Migration(int(match.group(1)), match.group(2), os.path.join(directory, filename)))
+    versions = [m.version for m in migrations]
+    if len(versions) != len(set(versions)):
+        raise RuntimeError(f"Duplicate migration version numbers in {directory}")
+    return migrations
+
+# --- Version Bookkeeping ---
+def ensure_version_table(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TEXT NOT NULL,
+            duration_ms REAL NOT NULL
+        )
+    ''')
+
+def applied_versions(conn):
+    ensure_version_table(conn)
+    return {row[0] for row in conn.execute('SELECT version FROM schema_version')}
+
+def current_version(conn):
+    ensure_version_table(conn)
+    return conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+
+def pending_migrations(conn, migrations=None):
+    done = applied_versions(conn)
+    return [m for m in (migrations or discover_migrations()) if m.version not in done]
+
+def _record(conn, migration, duration_ms):
+    conn.execute('INSERT INTO schema_version (version, name, applied_at, duration_ms) VALUES (?, ?, ?, ?)',
+                 (migration.version, migration.name, datetime.now().isoformat(timespec='seconds'), round(duration_ms, 1)))
+
+# --- Online Helpers (used by migration files) ---
+def backfill_in_batches(conn, table, set_clause, where_clause='1', params=(), batch_size=DEFAULT_BATCH_SIZE):
+    """Runs `UPDATE table SET set_clause WHERE where_clause` one rowid window at a time.
+
+    Each window is its own short write transaction, so other workers can take
+    the write lock between batches. Returns the number of rows updated.
+    """
+    bounds = conn.execute(f'SELECT MIN(rowid), MAX(rowid) FROM {table}').fetchone()
+    if bounds[0] is None:
+        return 0
+    updated = 0
+    low, high = bounds
+    while low <= high:
+        conn.execute('BEGIN IMMEDIATE')
+        cursor = conn.execute(f'UPDATE {table} SET {set_clause} WHERE rowid >= ? AND rowid < ? AND ({where_clause})',
+                              (low, low + batch_size, *params))
+        conn.execute('COMMIT')
+        updated += cursor.rowcount
+        low += batch_size
+    return updated
+
+def create_indexes(conn, statements):
+    """Builds each index in its own transaction so no single lock covers them all."""
+    for sql in statements:
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute(sql)
+        conn.execute('COMMIT')
+
+def rebuild_table_online(conn, table, create_sql, columns, select_exprs=None, batch_size=DEFAULT_BATCH_SIZE,
+                         post_swap_sql=()):
+    """Rewrites `table` into a new shape without holding a long write lock.
+
+    `create_sql` must create `_new_<table>` with the target schema. Rows are
+    copied by primary-key window in bounded transactions; triggers on the old
+    table mirror concurrent writes into the copy, so the final swap (drop, rename,
+    then `post_swap_sql` to recreate indexes and triggers) is one short
+    transaction. `select_exprs` maps each target column to an expression over the
+    old table's columns (defaults to the same column), e.g. to change an encoding.
+    The first of `columns` is the primary key, under the same name in both tables.
+    Re-running after an interruption is safe: rows already in the copy are skipped.
+    """
+    new_table = f'_new_{table}'
+    pk = columns[0]
+    if pk not in {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}:
+        raise ValueError(f"{table} has no column {pk}: the copy is keyed on the primary key of both tables")
+    exprs = select_exprs or {}
+    target_cols = ', '.join(columns)
+    old_exprs = ', '.join(exprs.get(c, c) for c in columns)
+    # The mirror triggers re-read the written row from the old table, so the expressions
+    # see the source columns exactly as the batch copy does
+    mirror = f'INSERT OR REPLACE INTO {new_table} ({target_cols}) SELECT {old_exprs} FROM {table} WHERE {pk} = NEW.{pk};'
+
+    conn.execute('BEGIN IMMEDIATE')
+    conn.execute(create_sql)
+    conn.execute(f'''CREATE TRIGGER IF NOT EXISTS _mig_{table}_ins AFTER INSERT ON {table} BEGIN
+                        {mirror} END''')
+    conn.execute(f'''CREATE TRIGGER IF NOT EXISTS _mig_{table}_upd AFTER UPDATE ON {table} BEGIN
+                        DELETE FROM {new_table} WHERE {pk} = OLD.{pk};
+                        {mirror} END''')
+    conn.execute(f'''CREATE TRIGGER IF NOT EXISTS _mig_{table}_del AFTER DELETE ON {table} BEGIN
+                        DELETE FROM {new_table} WHERE {pk} = OLD.{pk}; END''')
+    conn.execute('COMMIT')
+
+    # Copy in windows; rows already mirrored by the triggers are newer, keep them
+    low, high = conn.execute(f'SELECT COALESCE(MIN({pk}), 0), COALESCE(MAX({pk}), -1) FROM {table}').fetchone()
+    copied = 0
+    while low <= high:
+        conn.execute('BEGIN IMMEDIATE')
+        cursor = conn.execute(f'''INSERT OR IGNORE INTO {new_table} ({target_cols})
+                                  SELECT {old_exprs} FROM {table} WHERE {pk} >= ? AND {pk} < ?''',
+                              (low, low + batch_size))
+        conn.execute('COMMIT')
+        copied += max(cursor.rowcount, 0)
+        low += batch_size
+
+    # Swap. Foreign keys must be off so DROP TABLE does not cascade into children.
+    conn.execute('PRAGMA foreign_keys = OFF')
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        for suffix in ('ins', 'upd', 'del'):
+            conn.execute(f'DROP TRIGGER IF EXISTS _mig_{table}_{suffix}')
+        conn.execute(f'DROP TABLE {table}')
+        conn.execute(f'ALTER TABLE {new_table} RENAME TO {table}')
+        for sql in post_swap_sql:
+            conn.execute(sql)
+        violations = conn.execute('PRAGMA foreign_key_check').fetchall()
+        if violations:
+            raise sqlite3.IntegrityError(f"Foreign key violations after rebuilding {table}: {len(violations)}")
+        conn.execute('COMMIT')
+    except Exception:
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.execute('PRAGMA foreign_keys = ON')
+    return copied
+
+# --- Runner ---
+def upgrade(db_file=None, target=None, batch_size=DEFAULT_BATCH_SIZE, verbose=True):
+    """Applies pending migrations up to `target` (inclusive). Returns the versions applied."""
+    conn = connect(db_file)
+    conn.isolation_level = None # Explicit BEGIN/COMMIT only
+    applied = []
+    try:
+        ensure_version_table(conn)
+        for migration in pending_migrations(conn):
+            if target is not None and migration.version > target:
+                break
+            if verbose:
+                print(f"Applying {migration.version:04d}_{migration.name}: {migration.description}")
+            started = time.perf_counter()
+            if migration.online:
+                migration.module.upgrade(conn, batch_size)
+                conn.execute('BEGIN IMMEDIATE')
+                _record(conn, migration, (time.perf_counter() - started) * 1000)
+                conn.execute('COMMIT')
+            else:
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    migration.module.upgrade(conn, batch_size)
+                    _record(conn, migration, (time.perf_counter() - started) * 1000)
+                    conn.execute('COMMIT')
+                except Exception:
+                    conn.execute('ROLLBACK')
+                    raise
+            applied.append(migration.version)
+            if verbose:
+                print(f"   done in {(time.perf_counter() - started) * 1000:.1f} ms")
+    finally:
+        conn.close()
+    return applied
+
+def status(db_file=None):
+    conn = connect(db_file)
+    try:
+        done = {row['version']: row for row in conn.execute('SELECT * FROM schema_version')} if _has_version_table(conn) else {}
+        for migration in discover_migrations():
+            row = done.get(migration.version)
+            state = f"applied {row['applied_at']} ({row['duration_ms']} ms)" if row else 'PENDING'
+            print(f"{migration.version:04d}_{migration.name:<32} {state}")
+    finally:
+        conn.close()
+
+def _has_version_table(conn):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'").fetchone() is not None
+
+# --- Self-test of the online helpers ---
+def self_test(rows=20000, batch_size=200):
+    """Backfills then rebuilds a scratch table (ISO dates -> Julian day numbers) while another
+    connection keeps inserting, updating and deleting rows; returns (problems, write counts)."""
+    workdir = tempfile.mkdtemp(prefix='gesthotel-migrate-')
+    db_file = os.path.join(workdir, 'selftest.db')
+    conn = connect(db_file)
+    conn.isolation_level = None
+    problems, stats = [], {'writes': 0, 'during_copy': 0}
+    done = threading.Event()
+
+    def writer():
+        # Every write also goes to 'shadow' in the same transaction: the expected content of 't'
+        other = connect(db_file)
+        other.isolation_level = None
+        rng = random.Random(7)
+        try:
+            while not done.is_set():
+                other.execute('BEGIN IMMEDIATE')
+                if not other.execute("SELECT 1 FROM pragma_table_info('t') WHERE name = 'd'").fetchone():
+                    other.execute('ROLLBACK') # Swapped: 't' has its new shape
+                    break
+                copying = other.execute("SELECT 1 FROM sqlite_master WHERE name = '_new_t'").fetchone() is not None
+                id_, day = rng.randint(1, rows * 2), f'2021-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}'
+                for table in ('t', 'shadow'):
+                    if stats['writes'] % 3 == 0:
+                        other.execute(f"INSERT OR REPLACE INTO {table} (id, d, note) VALUES (?, ?, 'w')", (id_, day))
+                    elif stats['writes'] % 3 == 1:
+                        other.execute(f'UPDATE {table} SET d = ? WHERE id = ?', (day, id_))
+                    else:
+                        other.execute(f'DELETE FROM {table} WHERE id = ?', (id_,))
+                other.execute('COMMIT')
+                stats['writes'] += 1
+                stats['during_copy'] += copying
+        except sqlite3.Error as e:
+            problems.append(f'concurrent write failed: {e}')
+        finally:
+            other.close()
+
+    try:
+        for table in ('t', 'shadow'):
+            conn.execute(f'CREATE TABLE {table} (id INTEGER PRIMARY KEY, d TEXT NOT NULL, note TEXT)')
+            conn.execute(f'''INSERT INTO {table} (id, d, note)
+                             WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < ?)
+                             SELECT i, date('2020-01-01', '+' || (i % 2000) || ' days'), 'd' || i FROM n''', (rows,))
+        thread = threading.Thread(target=writer)
+        thread.start()
+        # Rows the writer replaces carry note 'w', so both tables end up alike whatever the interleaving
+        for table in ('t', 'shadow'):
+            backfill_in_batches(conn, table, 'note = upper(note)', "note LIKE 'd%'", batch_size=batch_size)
+        # 'd' also appears in a string literal, which the copy must leave alone
+        rebuild_table_online(conn, 't', 'CREATE TABLE _new_t (id INTEGER PRIMARY KEY, jd INTEGER NOT NULL, note TEXT)',
+                             ['id', 'jd', 'note'], {'jd': 'CAST(julianday(d) AS INTEGER)', 'note': "COALESCE(note, 'd')"},
+                             batch_size=batch_size)
+        done.set()
+        thread.join()
+        expected = "SELECT id, CAST(julianday(d) AS INTEGER), COALESCE(note, 'd') FROM shadow"
+        missing = conn.execute(f'SELECT COUNT(*) FROM ({expected} EXCEPT SELECT id, jd, note FROM t)').fetchone()[0]
+        extra = conn.execute(f'SELECT COUNT(*) FROM (SELECT id, jd, note FROM t EXCEPT {expected})').fetchone()[0]
+        if missing or extra:
+            problems.append(f'rebuilt table differs from the expected rows: {missing} missing or stale, {extra} extra')
+        if not stats['during_copy']:
+            problems.append('no write happened during the copy, nothing was tested')
+        return problems, stats
+    finally:
+        done.set()
+        conn.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gest'Hôtel schema migrations")
+    parser.add_argument('--db', default=DATABASE, help='SQLite database file (default: %(default)s)')
+    sub = parser.add_subparsers(dest='command', required=True)
+    up = sub.add_parser('upgrade', help='apply pending migrations')
+    up.add_argument('--to', type=int, default=None, help='stop after this version')
+    up.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='rows per transaction for online migrations')
+    sub.add_parser('status', help='list applied and pending migrations')
+    sub.add_parser('selftest', help='run the online helpers against concurrent writes on a temporary database')
+    args = parser.parse_args(argv)
+
+    if args.command == 'upgrade':
+        applied = upgrade(args.db, target=args.to, batch_size=args.batch_size)
+        print(f"{len(applied)} migration(s) applied." if applied else "Database is up to date.")
+    elif args.command == 'selftest':
+        problems, stats = self_test()
+        for problem in problems:
+            print(f"!!! {problem}")
+        print(f"{stats['writes']} concurrent writes, {stats['during_copy']} during the copy: "
+              f"{'FAILED' if problems else 'backfill and online rebuild OK'}")
+        return 1 if problems else 0
+    else:
+        status(args.db)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
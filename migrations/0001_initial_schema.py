@@ -0,0 +1,151 @@
+"""Initial Gest'Hôtel schema: core tables and the room-status trigger.
+
+Every statement is idempotent so databases created by the old
+delete-and-recreate setup_database() adopt this version unchanged.
+"""
+
+def upgrade(conn, batch_size):
+    # Table: clients
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS clients (
+            id_client INTEGER PRIMARY KEY AUTOINCREMENT,
+            nom TEXT NOT NULL,
+            prenom TEXT NOT NULL,
+            telephone TEXT,
+            email TEXT UNIQUE NOT NULL,
+            adresse TEXT,
+            statut_fidelite TEXT DEFAULT 'Standard' NOT NULL CHECK(statut_fidelite IN ('Standard', 'VIP', 'Or'))
+        )
+    ''')
+
+    # Table: chambres
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS chambres (
+            id_chambre INTEGER PRIMARY KEY AUTOINCREMENT,
+            numero_chambre TEXT UNIQUE NOT NULL,
+            type_chambre TEXT NOT NULL CHECK(type_chambre IN ('Simple', 'Double', 'Suite', 'Familiale')),
+            prix_nuit_base REAL NOT NULL CHECK(prix_nuit_base >= 0),
+            statut TEXT NOT NULL CHECK(statut IN ('Libre', 'Occupé', 'En nettoyage'))
+        )
+    ''')
+
+    # Table: tarifs
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS tarifs (
+            id_tarif INTEGER PRIMARY KEY AUTOINCREMENT,
+            nom_tarif TEXT UNIQUE NOT NULL,
+            description TEXT,
+            reduction_pourcentage REAL DEFAULT 0.0 CHECK(reduction_pourcentage >= 0 AND reduction_pourcentage <= 100),
+            condition_application TEXT
+        )
+    ''')
+
+    # Table: reservations
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS reservations (
+            id_reservation INTEGER PRIMARY KEY AUTOINCREMENT,
+            id_client INTEGER NOT NULL,
+            id_chambre INTEGER NOT NULL,
+            id_tarif INTEGER NOT NULL,
+            date_debut TEXT NOT NULL,
+            date_fin TEXT NOT NULL,
+            prix_nuit_applique REAL NOT NULL,
+            statut TEXT NOT NULL CHECK(statut IN ('Confirmée', 'Annulée', 'Terminée', 'En attente')),
+            FOREIGN KEY (id_client) REFERENCES clients(id_client) ON DELETE CASCADE,
+            FOREIGN KEY (id_chambre) REFERENCES chambres(id_chambre) ON DELETE RESTRICT,
+            FOREIGN KEY (id_tarif) REFERENCES tarifs(id_tarif) ON DELETE RESTRICT
+        )
+    ''')
+
+    # Table: services
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS services (
+            id_service INTEGER PRIMARY KEY AUTOINCREMENT,
+            nom_service TEXT UNIQUE NOT NULL,
+            description TEXT,
+            prix REAL NOT NULL CHECK(prix >= 0),
+            disponibilite TEXT NOT NULL CHECK(disponibilite IN ('Disponible', 'Indisponible'))
+        )
+    ''')
+
+    # Table: reservation_services
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS reservation_services (
+            id_reservation INTEGER NOT NULL,
+            id_service INTEGER NOT NULL,
+            quantite INTEGER DEFAULT 1 CHECK(quantite > 0),
+            date_service TEXT,
+            FOREIGN KEY (id_reservation) REFERENCES reservations(id_reservation) ON DELETE CASCADE,
+            FOREIGN KEY (id_service) REFERENCES services(id_service) ON DELETE CASCADE,
+            PRIMARY KEY (id_reservation, id_service)
+        )
+    ''')
+
+    # Table: consommations
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS consommations (
+            id_consommation INTEGER PRIMARY KEY AUTOINCREMENT,
+            id_chambre INTEGER NOT NULL,
+            id_reservation INTEGER,
+            type_consommation TEXT NOT NULL CHECK(type_consommation IN ('Énergie', 'Eau', 'Gaz', 'Minibar')),
+            date_releve TEXT NOT NULL,
+            valeur REAL NOT NULL,
+            unite TEXT NOT NULL,
+            cout_unitaire REAL NOT NULL,
+            FOREIGN KEY (id_chambre) REFERENCES chambres(id_chambre) ON DELETE CASCADE,
+            FOREIGN KEY (id_reservation) REFERENCES reservations(id_reservation) ON DELETE SET NULL
+        )
+    ''')
+
+    # Table: factures
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS factures (
+            id_facture INTEGER PRIMARY KEY AUTOINCREMENT,
+            id_reservation INTEGER UNIQUE NOT NULL,
+            montant_chambre REAL NOT NULL,
+            montant_services REAL NOT NULL,
+            montant_consommations REAL NOT NULL,
+            montant_total REAL NOT NULL,
+            date_emission TEXT NOT NULL,
+            statut TEXT NOT NULL CHECK(statut IN ('Payée', 'Non payée', 'Partiellement payée')),
+            mode_paiement TEXT CHECK(mode_paiement IN ('Carte', 'Espèces', 'Virement', 'Chèque', NULL)),
+            FOREIGN KEY (id_reservation) REFERENCES reservations(id_reservation) ON DELETE RESTRICT
+        )
+    ''')
+
+    # Table: avis
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS avis (
+            id_avis INTEGER PRIMARY KEY AUTOINCREMENT,
+            id_client INTEGER NOT NULL,
+            id_reservation INTEGER UNIQUE NOT NULL,
+            note INTEGER NOT NULL CHECK(note BETWEEN 1 AND 5),
+            commentaire TEXT,
+            date_avis TEXT NOT NULL,
+            moderated INTEGER DEFAULT 0 CHECK(moderated IN (0, 1)),
+            FOREIGN KEY (id_client) REFERENCES clients(id_client) ON DELETE CASCADE,
+            FOREIGN KEY (id_reservation) REFERENCES reservations(id_reservation) ON DELETE CASCADE
+        )
+    ''')
+
+    # Table: users
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id_user INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL, -- REMINDER: HASH PASSWORDS IN PRODUCTION!
+            role TEXT NOT NULL CHECK(role IN ('admin', 'staff', 'client'))
+        )
+    ''')
+
+    # Trigger: a completed stay sends the room to cleaning
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS update_room_status_after_reservation
+        AFTER UPDATE OF statut ON reservations
+        WHEN NEW.statut = 'Terminée' AND OLD.statut != 'Terminée'
+        BEGIN
+            UPDATE chambres
+            SET statut = 'En nettoyage'
+            WHERE id_chambre = NEW.id_chambre;
+        END;
+    ''')
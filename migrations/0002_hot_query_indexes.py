@@ -0,0 +1,18 @@
+"""Composite indexes for the reservation, consumption and review hot queries.
+
+Dates are stored as ISO 'YYYY-MM-DD' text, so plain comparisons on the raw
+columns sort correctly and can use these indexes (date(col) cannot).
+"""
+
+from migrate import create_indexes
+
+ONLINE = True # One index per transaction; the others stay writable meanwhile
+
+def upgrade(conn, batch_size):
+    create_indexes(conn, [
+        'CREATE INDEX IF NOT EXISTS idx_reservations_chambre_statut_dates ON reservations (id_chambre, statut, date_debut, date_fin)',
+        'CREATE INDEX IF NOT EXISTS idx_reservations_statut_debut ON reservations (statut, date_debut)',
+        'CREATE INDEX IF NOT EXISTS idx_reservations_client_statut ON reservations (id_client, statut)',
+        'CREATE INDEX IF NOT EXISTS idx_consommations_chambre_date ON consommations (id_chambre, date_releve)',
+        'CREATE INDEX IF NOT EXISTS idx_avis_moderated_date ON avis (moderated, date_avis)',
+    ])
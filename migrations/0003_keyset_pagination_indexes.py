@@ -0,0 +1,17 @@
+"""Indexes matching the ORDER BY keys of the paginated list views.
+
+Each index ends in the table's INTEGER PRIMARY KEY implicitly, so
+(date_debut, id_reservation) style keyset seeks and sorts need no temp B-tree.
+"""
+
+from migrate import create_indexes
+
+ONLINE = True
+
+def upgrade(conn, batch_size):
+    create_indexes(conn, [
+        'CREATE INDEX IF NOT EXISTS idx_reservations_debut ON reservations (date_debut)',
+        'CREATE INDEX IF NOT EXISTS idx_factures_emission ON factures (date_emission)',
+        'CREATE INDEX IF NOT EXISTS idx_consommations_date ON consommations (date_releve)',
+        'CREATE INDEX IF NOT EXISTS idx_clients_nom_prenom ON clients (nom, prenom)',
+    ])
@@ -0,0 +1,14 @@
+"""Run log of the night-audit job (see night_audit.py)."""
+
+def upgrade(conn, batch_size):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS night_audit_runs (
+            id_run INTEGER PRIMARY KEY AUTOINCREMENT,
+            business_date TEXT UNIQUE NOT NULL,
+            started_at TEXT NOT NULL,
+            duration_ms REAL NOT NULL,
+            reservations_completed INTEGER NOT NULL,
+            rooms_occupied INTEGER NOT NULL,
+            rooms_released INTEGER NOT NULL
+        )
+    ''')
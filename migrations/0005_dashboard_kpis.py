@@ -0,0 +1,57 @@
+"""Trigger-maintained dashboard KPI tables (see kpi.py)."""
+
+# kpi.py's statuses and recount as they were for this migration (it never imports live modules)
+COUNTED_STATUSES = "('Confirmée', 'Terminée')"
+CALENDAR_FIRST, CALENDAR_LAST = '2000-01-01', '2099-12-31'
+
+def _occupancy(row, delta):
+    # Adds `delta` to every night of the OLD/NEW stay, if that stay occupies its room
+    return f'''INSERT INTO kpi_daily_occupancy (jour, rooms_occupied)
+               SELECT jour, {delta} FROM kpi_calendar
+               WHERE jour >= {row}.date_debut AND jour < {row}.date_fin AND {row}.statut IN {COUNTED_STATUSES}
+               ON CONFLICT(jour) DO UPDATE SET rooms_occupied = rooms_occupied + ({delta});'''
+
+def _total(name, expr):
+    return f"UPDATE kpi_totals SET value = value + ({expr}) WHERE name = '{name}';"
+
+def upgrade(conn, batch_size):
+    conn.execute('CREATE TABLE IF NOT EXISTS kpi_calendar (jour TEXT PRIMARY KEY) WITHOUT ROWID')
+    conn.execute('CREATE TABLE IF NOT EXISTS kpi_totals (name TEXT PRIMARY KEY, value REAL NOT NULL DEFAULT 0)')
+    conn.execute('''CREATE TABLE IF NOT EXISTS kpi_daily_occupancy (
+                        jour TEXT PRIMARY KEY,
+                        rooms_occupied INTEGER NOT NULL DEFAULT 0
+                    ) WITHOUT ROWID''')
+    # Counters from the base tables
+    if conn.execute('SELECT COUNT(*) FROM kpi_calendar').fetchone()[0] == 0:
+        conn.execute('''INSERT INTO kpi_calendar (jour)
+                        WITH RECURSIVE days(jour) AS (SELECT ? UNION ALL SELECT date(jour, '+1 day') FROM days WHERE jour < ?)
+                        SELECT jour FROM days''', (CALENDAR_FIRST, CALENDAR_LAST))
+    conn.execute('DELETE FROM kpi_totals')
+    conn.execute('''INSERT INTO kpi_totals (name, value)
+                    SELECT 'rooms_total', COUNT(*) FROM chambres
+                    UNION ALL SELECT 'rating_sum', COALESCE(SUM(note), 0) FROM avis WHERE moderated = 1
+                    UNION ALL SELECT 'rating_count', COUNT(*) FROM avis WHERE moderated = 1''')
+    conn.execute('DELETE FROM kpi_daily_occupancy')
+    conn.execute(f'''INSERT INTO kpi_daily_occupancy (jour, rooms_occupied)
+                     SELECT k.jour, COUNT(*) FROM kpi_calendar k
+                     JOIN reservations r ON k.jour >= r.date_debut AND k.jour < r.date_fin
+                     WHERE r.statut IN {COUNTED_STATUSES}
+                     GROUP BY k.jour''')
+
+    triggers = {
+        'kpi_reservation_insert': ('AFTER INSERT ON reservations', _occupancy('NEW', 1)),
+        'kpi_reservation_update': ('AFTER UPDATE OF statut, date_debut, date_fin ON reservations',
+                                   _occupancy('OLD', -1) + _occupancy('NEW', 1)),
+        'kpi_reservation_delete': ('AFTER DELETE ON reservations', _occupancy('OLD', -1)),
+        'kpi_room_insert': ('AFTER INSERT ON chambres', _total('rooms_total', 1)),
+        'kpi_room_delete': ('AFTER DELETE ON chambres', _total('rooms_total', -1)),
+        'kpi_review_insert': ('AFTER INSERT ON avis WHEN NEW.moderated = 1',
+                              _total('rating_sum', 'NEW.note') + _total('rating_count', 1)),
+        'kpi_review_update': ('AFTER UPDATE OF note, moderated ON avis',
+                              _total('rating_sum', '(NEW.moderated = 1) * NEW.note - (OLD.moderated = 1) * OLD.note')
+                              + _total('rating_count', '(NEW.moderated = 1) - (OLD.moderated = 1)')),
+        'kpi_review_delete': ('AFTER DELETE ON avis WHEN OLD.moderated = 1',
+                              _total('rating_sum', '-OLD.note') + _total('rating_count', -1)),
+    }
+    for name, (event, body) in triggers.items():
+        conn.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body} END')
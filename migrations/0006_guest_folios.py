@@ -0,0 +1,67 @@
+"""Trigger-maintained guest folios (see folio.py)."""
+
+# Charges recomputed from the base tables, one row per reservation (a frozen copy of folio.RECOMPUTE_SQL)
+_RECOMPUTE_SQL = '''
+    SELECT r.id_reservation,
+           MAX(1, CAST(julianday(r.date_fin) - julianday(r.date_debut) AS INTEGER)) * r.prix_nuit_applique AS montant_chambre,
+           COALESCE(sv.total, 0) AS montant_services,
+           COALESCE(co.total, 0) AS montant_consommations
+    FROM reservations r
+    LEFT JOIN (SELECT rs.id_reservation, SUM(s.prix * rs.quantite) AS total
+               FROM reservation_services rs JOIN services s ON rs.id_service = s.id_service
+               GROUP BY rs.id_reservation) sv ON sv.id_reservation = r.id_reservation
+    LEFT JOIN (SELECT id_reservation, SUM(valeur * cout_unitaire) AS total FROM consommations
+               WHERE id_reservation IS NOT NULL GROUP BY id_reservation) co ON co.id_reservation = r.id_reservation'''
+
+_ROOM = "MAX(1, CAST(julianday({r}.date_fin) - julianday({r}.date_debut) AS INTEGER)) * {r}.prix_nuit_applique"
+# 0 once the service itself is gone: folio_service_removed has already posted the credit
+_SERVICE = "COALESCE((SELECT prix FROM services WHERE id_service = {r}.id_service), 0) * {r}.quantite"
+_CONSOMMATION = "{r}.valeur * {r}.cout_unitaire"
+
+def _post(column, row, expr, sign):
+    # Adds (sign) expr to one folio column of the row's reservation
+    return (f"UPDATE folios SET {column} = {column} {sign} ({expr.format(r=row)}), updated_at = datetime('now') "
+            f"WHERE id_reservation = {row}.id_reservation;")
+
+def upgrade(conn, batch_size):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS folios (
+            id_reservation INTEGER PRIMARY KEY,
+            montant_chambre REAL NOT NULL DEFAULT 0,
+            montant_services REAL NOT NULL DEFAULT 0,
+            montant_consommations REAL NOT NULL DEFAULT 0,
+            updated_at TEXT NOT NULL,
+            FOREIGN KEY (id_reservation) REFERENCES reservations(id_reservation) ON DELETE CASCADE
+        )
+    ''')
+    conn.execute(f'''INSERT OR IGNORE INTO folios (id_reservation, montant_chambre, montant_services, montant_consommations, updated_at)
+                     SELECT *, datetime('now') FROM ({_RECOMPUTE_SQL})''')
+
+    triggers = {
+        'folio_reservation_insert': ('AFTER INSERT ON reservations',
+            f"INSERT OR IGNORE INTO folios (id_reservation, montant_chambre, updated_at) VALUES (NEW.id_reservation, {_ROOM.format(r='NEW')}, datetime('now'));"),
+        'folio_reservation_update': ('AFTER UPDATE OF date_debut, date_fin, prix_nuit_applique ON reservations',
+            f"UPDATE folios SET montant_chambre = {_ROOM.format(r='NEW')}, updated_at = datetime('now') WHERE id_reservation = NEW.id_reservation;"),
+        'folio_service_insert': ('AFTER INSERT ON reservation_services', _post('montant_services', 'NEW', _SERVICE, '+')),
+        'folio_service_update': ('AFTER UPDATE OF id_reservation, id_service, quantite ON reservation_services',
+            _post('montant_services', 'OLD', _SERVICE, '-') + _post('montant_services', 'NEW', _SERVICE, '+')),
+        'folio_service_delete': ('AFTER DELETE ON reservation_services', _post('montant_services', 'OLD', _SERVICE, '-')),
+        'folio_service_price': ('AFTER UPDATE OF prix ON services',
+            '''UPDATE folios SET montant_services = montant_services + (NEW.prix - OLD.prix) *
+                   (SELECT rs.quantite FROM reservation_services rs WHERE rs.id_reservation = folios.id_reservation AND rs.id_service = NEW.id_service),
+                   updated_at = datetime('now')
+               WHERE id_reservation IN (SELECT id_reservation FROM reservation_services WHERE id_service = NEW.id_service);'''),
+        'folio_service_removed': ('BEFORE DELETE ON services',
+            '''UPDATE folios SET montant_services = montant_services - OLD.prix *
+                   (SELECT rs.quantite FROM reservation_services rs WHERE rs.id_reservation = folios.id_reservation AND rs.id_service = OLD.id_service),
+                   updated_at = datetime('now')
+               WHERE id_reservation IN (SELECT id_reservation FROM reservation_services WHERE id_service = OLD.id_service);'''),
+        'folio_consommation_insert': ('AFTER INSERT ON consommations WHEN NEW.id_reservation IS NOT NULL',
+            _post('montant_consommations', 'NEW', _CONSOMMATION, '+')),
+        'folio_consommation_update': ('AFTER UPDATE OF id_reservation, valeur, cout_unitaire ON consommations',
+            _post('montant_consommations', 'OLD', _CONSOMMATION, '-') + _post('montant_consommations', 'NEW', _CONSOMMATION, '+')),
+        'folio_consommation_delete': ('AFTER DELETE ON consommations WHEN OLD.id_reservation IS NOT NULL',
+            _post('montant_consommations', 'OLD', _CONSOMMATION, '-')),
+    }
+    for name, (event, body) in triggers.items():
+        conn.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body} END')
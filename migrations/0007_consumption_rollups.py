@@ -0,0 +1,55 @@
+"""Trigger-maintained daily and monthly consumption rollups (see rollups.py)."""
+
+# Rollup table -> (period column, period of a date_releve), as rollups.LEVELS was for this migration
+LEVELS = {
+    'conso_daily': ('jour', 'substr(date_releve, 1, 10)'),
+    'conso_monthly': ('mois', 'substr(date_releve, 1, 7)'),
+}
+
+def _add(table, row, sign):
+    period, expr = LEVELS[table]
+    expr = expr.replace('date_releve', f'{row}.date_releve')
+    return f'''INSERT INTO {table} (id_chambre, type_consommation, {period}, total_valeur, total_cout, nb_releves)
+               VALUES ({row}.id_chambre, {row}.type_consommation, {expr}, {sign}{row}.valeur, {sign}{row}.valeur * {row}.cout_unitaire, {sign}1)
+               ON CONFLICT(id_chambre, type_consommation, {period}) DO UPDATE SET
+                   total_valeur = total_valeur + excluded.total_valeur,
+                   total_cout = total_cout + excluded.total_cout,
+                   nb_releves = nb_releves + excluded.nb_releves;'''
+
+def _prune(table, row):
+    period, expr = LEVELS[table]
+    expr = expr.replace('date_releve', f'{row}.date_releve')
+    return (f'DELETE FROM {table} WHERE id_chambre = {row}.id_chambre AND type_consommation = {row}.type_consommation '
+            f'AND {period} = {expr} AND nb_releves = 0;')
+
+def upgrade(conn, batch_size):
+    for table, (period, _) in LEVELS.items():
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                id_chambre INTEGER NOT NULL,
+                type_consommation TEXT NOT NULL,
+                {period} TEXT NOT NULL,
+                total_valeur REAL NOT NULL,
+                total_cout REAL NOT NULL,
+                nb_releves INTEGER NOT NULL,
+                PRIMARY KEY (id_chambre, type_consommation, {period})
+            ) WITHOUT ROWID
+        ''')
+        # Hotel-wide reports filter on the period first
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_{period} ON {table} ({period}, type_consommation)')
+    for table, (period, expr) in LEVELS.items(): # Totals from the readings already stored
+        conn.execute(f'DELETE FROM {table}')
+        conn.execute(f'''INSERT INTO {table} (id_chambre, type_consommation, {period}, total_valeur, total_cout, nb_releves)
+                         SELECT id_chambre, type_consommation, {expr}, SUM(valeur), SUM(valeur * cout_unitaire), COUNT(*)
+                         FROM consommations GROUP BY id_chambre, type_consommation, {expr}''')
+
+    insert = ''.join(_add(table, 'NEW', '') for table in LEVELS)
+    remove = ''.join(_add(table, 'OLD', '-') + _prune(table, 'OLD') for table in LEVELS)
+    triggers = {
+        'rollup_consommation_insert': ('AFTER INSERT ON consommations', insert),
+        'rollup_consommation_update': ('AFTER UPDATE OF id_chambre, type_consommation, date_releve, valeur, cout_unitaire ON consommations',
+                                       remove + insert),
+        'rollup_consommation_delete': ('AFTER DELETE ON consommations', remove),
+    }
+    for name, (event, body) in triggers.items():
+        conn.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body} END')
@@ -0,0 +1,24 @@
+"""Per-table change versions for conditional GET (see versions.py)."""
+
+# Tracked tables and trigger text as of this migration; versions.py may move on
+TRACKED_TABLES = ('chambres', 'clients', 'tarifs', 'services', 'reservations', 'reservation_services',
+                  'consommations', 'factures', 'avis')
+
+def install_triggers(conn, table):
+    # Registers `table` in table_versions and bumps its version on every write
+    conn.execute('INSERT OR IGNORE INTO table_versions (name, version) VALUES (?, 1)', (table,))
+    bump = (f"UPDATE table_versions SET version = version + 1, changed_at = CAST(strftime('%s', 'now') AS INTEGER) "
+            f"WHERE name = '{table}';")
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        conn.execute(f'CREATE TRIGGER IF NOT EXISTS version_{table}_{event.lower()} AFTER {event} ON {table} BEGIN {bump} END')
+
+def upgrade(conn, batch_size):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS table_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0,
+            changed_at INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))
+        ) WITHOUT ROWID
+    ''')
+    for table in TRACKED_TABLES:
+        install_triggers(conn, table)
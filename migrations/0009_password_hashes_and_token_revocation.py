@@ -0,0 +1,36 @@
+"""Hashed passwords and the API token revocation list (see auth.py)."""
+
+import base64
+import hashlib
+import secrets
+
+# auth.py's hash format at the time; it rehashes at the next login when its configured work factor differs
+_HASH_SCHEME = 'pbkdf2_sha256'
+ITERATIONS = 300_000
+
+def _b64(raw):
+    return base64.b64encode(raw).decode().rstrip('=')
+
+def hash_password(password):
+    salt = secrets.token_bytes(16)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, ITERATIONS)
+    return f'{_HASH_SCHEME}${ITERATIONS}${_b64(salt)}${_b64(digest)}'
+
+def upgrade(conn, batch_size):
+    # Existing plain-text passwords become PBKDF2 hashes
+    for id_user, password in conn.execute('SELECT id_user, password FROM users').fetchall():
+        if not password.startswith(_HASH_SCHEME + '$'):
+            conn.execute('UPDATE users SET password = ? WHERE id_user = ?', (hash_password(password), id_user))
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS revoked_tokens (
+            jti TEXT PRIMARY KEY,
+            expires_at INTEGER NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    # Workers reload their revocation list when this version moves
+    conn.execute("INSERT OR IGNORE INTO table_versions (name, version) VALUES ('revoked_tokens', 1)")
+    bump = ("UPDATE table_versions SET version = version + 1, changed_at = CAST(strftime('%s', 'now') AS INTEGER) "
+            "WHERE name = 'revoked_tokens';")
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        conn.execute(f'CREATE TRIGGER IF NOT EXISTS version_revoked_tokens_{event.lower()} AFTER {event} ON revoked_tokens BEGIN {bump} END')
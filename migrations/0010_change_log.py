@@ -0,0 +1,42 @@
+"""Change-data capture log for incremental sync (see cdc.py)."""
+
+# Captured table -> primary key column, and the capture triggers, as of this migration; cdc.py may move on
+TABLES = {
+    'reservations': 'id_reservation',
+    'chambres': 'id_chambre',
+    'clients': 'id_client',
+    'factures': 'id_facture',
+    'consommations': 'id_consommation',
+    'avis': 'id_avis',
+}
+
+def install_capture(conn, table):
+    # Logs every write of `table` into change_log
+    log = "INSERT INTO change_log (table_name, pk, op) VALUES ('{table}', {row}.{pk}, '{op}');"
+    for event, row in (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD')):
+        statement = log.format(table=table, row=row, pk=TABLES[table], op=event[0])
+        conn.execute(f'CREATE TRIGGER IF NOT EXISTS cdc_{table}_{event.lower()} AFTER {event} ON {table} BEGIN {statement} END')
+
+def upgrade(conn, batch_size):
+    # AUTOINCREMENT: versions are never reused, even after the newest entries are compacted away
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS change_log (
+            version INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT NOT NULL,
+            pk INTEGER NOT NULL,
+            op TEXT NOT NULL CHECK (op IN ('I', 'U', 'D')),
+            changed_at INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))
+        )
+    ''')
+    # Latest change of a row: compaction and the "changed again later?" check of each delta
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_change_log_row ON change_log (table_name, pk, version)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS change_log_state (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    # Rows written before this migration are not in the log: clients start from a full download
+    conn.execute("INSERT OR IGNORE INTO change_log_state (name, value) VALUES ('horizon', 0)")
+    for table in TABLES:
+        install_capture(conn, table)
@@ -0,0 +1,140 @@
+# night_audit.py - Nightly state transitions for Gest'Hôtel
+#
+# Completes expired stays and flips room statuses for the business date in a
+# handful of set-based statements, so GET routes never have to write. Each run
+# is logged in night_audit_runs; a business date is audited once, which keeps
+# the job safe to schedule from several workers at the same time.
+#
+# Usage:
+#   python night_audit.py            # Audit today (no-op if already done)
+#   python night_audit.py --force    # Re-run today's audit
+#   python night_audit.py --loop     # Worker process: audit daily at NIGHT_AUDIT_AT
+
+import argparse
+import logging
+import os
+import threading
+import time
+from contextlib import closing
+from datetime import date, datetime, timedelta
+
+import cdc
+import folio
+from db import connect
+
+log = logging.getLogger(__name__)
+
+AUDIT_AT = os.environ.get('NIGHT_AUDIT_AT', '02:00') # Local time, HH:MM
+
+# Rooms with a confirmed stay covering the night of :today
+_IN_HOUSE = '''SELECT id_chambre FROM reservations
+               WHERE statut = 'Confirmée' AND date_debut <= :today AND date_fin > :today'''
+
+def run_night_audit(conn, business_date=None, force=False):
+    """Runs the audit for `business_date` (default today) and returns its summary.
+
+    Returns None when that date was already audited and `force` is not set.
+    """
+    today = (business_date or date.today()).isoformat()
+    started = time.perf_counter()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        if not force and conn.execute('SELECT 1 FROM night_audit_runs WHERE business_date = ?', (today,)).fetchone():
+            conn.rollback()
+            return None
+        # 1. Expired stays; the update_room_status_after_reservation trigger sends their rooms to cleaning
+        completed = conn.execute("UPDATE reservations SET statut = 'Terminée' WHERE statut = 'Confirmée' AND date_fin < :today",
+                                 {'today': today}).rowcount
+        # 2. Today's arrivals (and any in-house stay whose room is not flagged yet)
+        occupied = conn.execute(f"UPDATE chambres SET statut = 'Occupé' WHERE statut != 'Occupé' AND id_chambre IN ({_IN_HOUSE})",
+                                {'today': today}).rowcount
+        # 3. Today's departures and cancellations: rooms flagged occupied with nobody staying tonight
+        released = conn.execute(f"UPDATE chambres SET statut = 'Libre' WHERE statut = 'Occupé' AND id_chambre NOT IN ({_IN_HOUSE})",
+                                {'today': today}).rowcount
+        duration_ms = round((time.perf_counter() - started) * 1000, 2)
+        summary = {'business_date': today, 'started_at': datetime.now().isoformat(timespec='seconds'), 'duration_ms': duration_ms,
+                   'reservations_completed': completed, 'rooms_occupied': occupied, 'rooms_released': released}
+        conn.execute('''INSERT INTO night_audit_runs (business_date, started_at, duration_ms, reservations_completed, rooms_occupied, rooms_released)
+                        VALUES (:business_date, :started_at, :duration_ms, :reservations_completed, :rooms_occupied, :rooms_released)
+                        ON CONFLICT(business_date) DO UPDATE SET started_at = excluded.started_at, duration_ms = excluded.duration_ms,
+                            reservations_completed = excluded.reservations_completed, rooms_occupied = excluded.rooms_occupied,
+                            rooms_released = excluded.rooms_released''', summary)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return summary
+
+def recent_runs(conn, limit=10):
+    return [dict(row) for row in conn.execute('SELECT * FROM night_audit_runs ORDER BY business_date DESC LIMIT ?', (limit,))]
+
+def seconds_until(at=AUDIT_AT, now=None):
+    """Seconds from `now` until the next HH:MM local time."""
+    now = now or datetime.now()
+    hour, minute = (int(part) for part in at.split(':'))
+    target = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if target <= now:
+        target += timedelta(days=1)
+    return (target - now).total_seconds()
+
+# --- Scheduler ---
+class NightAuditScheduler(threading.Thread):
+    """Daemon thread: catches up on startup, then audits once a day at AUDIT_AT.
+
+    `on_run` is called with each summary (e.g. to sync in-process caches).
+    """
+
+    def __init__(self, db_file=None, at=AUDIT_AT, on_run=None):
+        super().__init__(name='night-audit', daemon=True)
+        self.db_file = db_file
+        self.at = at
+        self.on_run = on_run
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.run_once()
+            self._stop_event.wait(seconds_until(self.at))
+
+    def run_once(self):
+        try:
+            conn = connect(self.db_file)
+            try:
+                summary = run_night_audit(conn)
+                if summary:
+                    # Daily folio reconciliation: report drift, repair is a deliberate 'python folio.py reconcile --fix'
+                    drift = folio.reconcile(conn)
+                    if drift['drifted'] or drift['missing']:
+                        log.warning('Folio drift: %d drifted, %d missing (first ids: %s)', len(drift['drifted']),
+                                    len(drift['missing']), (drift['drifted'] + drift['missing'])[:10])
+                    # Keep the change log to the retention window, one entry per changed row
+                    truncated, compacted = cdc.truncate(conn), cdc.compact(conn)
+                    log.info('Change log: %d entries truncated, %d compacted', truncated, compacted)
+            finally:
+                conn.close()
+            if summary:
+                log.info('Night audit %s: %d stays completed, %d rooms occupied, %d released (%s ms)', summary['business_date'],
+                         summary['reservations_completed'], summary['rooms_occupied'], summary['rooms_released'], summary['duration_ms'])
+                if self.on_run:
+                    self.on_run(summary)
+            return summary
+        except Exception as e:
+            log.exception('Night audit failed: %s', e)
+            return None
+
+    def stop(self):
+        self._stop_event.set()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Gest'Hôtel night audit")
+    parser.add_argument('--force', action='store_true', help="re-run today's audit even if already done")
+    parser.add_argument('--loop', action='store_true', help=f'keep running and audit daily at {AUDIT_AT}')
+    args = parser.parse_args()
+    if args.loop:
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+        scheduler = NightAuditScheduler()
+        scheduler.run() # Blocks: this process is the audit worker
+    else:
+        with closing(connect()) as conn:
+            summary = run_night_audit(conn, force=args.force)
+        print(summary or "Today's night audit has already run (use --force to repeat it).")
@@ -0,0 +1,119 @@
+# pagination.py - Keyset (seek) pagination helpers for the Gest'Hôtel list views
+#
+# Instead of OFFSET, each page remembers the ORDER BY key of its last (or first)
+# row in an opaque cursor, and the next query seeks past it with a row-value
+# comparison such as `(r.date_debut, r.id_reservation) < (?, ?)`. With an index
+# on the ORDER BY columns every page costs the same, however deep it is.
+
+import base64
+import json
+from datetime import date
+
+PAGE_SIZE_DEFAULT = 50
+PAGE_SIZE_MAX = 200
+PAGE_SIZE_CHOICES = (25, 50, 100, 200)
+
+def page_size(args):
+    """Reads ?per_page= and clamps it to [1, PAGE_SIZE_MAX]."""
+    try:
+        size = int(args.get('per_page', PAGE_SIZE_DEFAULT))
+    except (TypeError, ValueError):
+        size = PAGE_SIZE_DEFAULT
+    return max(1, min(size, PAGE_SIZE_MAX))
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(',', ':')).encode()).decode().rstrip('=')
+
+def decode_cursor(token):
+    """Returns the key values of a cursor, or None if it is missing or malformed."""
+    if not token:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except (ValueError, TypeError):
+        return None
+    return values if isinstance(values, list) else None
+
+class Page:
+    """One page of rows plus the cursors needed to link to its neighbours."""
+
+    def __init__(self, rows, size, next_cursor=None, prev_cursor=None, filters=None):
+        self.rows = rows
+        self.size = size
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.filters = filters or {}
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+def keyset_page(conn, select_sql, order_by, args, where=(), params=(), filters=None, descending=True):
+    """Runs `select_sql` one keyset page at a time.
+
+    `select_sql` is a SELECT ... FROM ... JOIN ... without WHERE/ORDER BY.
+    `order_by` lists (sql_expression, row_key) pairs forming a unique sort key,
+    e.g. [('r.date_debut', 'date_debut'), ('r.id_reservation', 'id_reservation')].
+    `where` / `params` are the (indexed) filter conditions. The page position
+    comes from ?after= / ?before= cursors in `args`.
+    """
+    size = page_size(args)
+    after = decode_cursor(args.get('after'))
+    before = None if after else decode_cursor(args.get('before'))
+    key_sql = '(' + ', '.join(expr for expr, _ in order_by) + ')'
+    marks = '(' + ', '.join('?' for _ in order_by) + ')'
+    conditions, values = list(where), list(params)
+
+    # Walking backwards flips both the comparison and the sort, then re-reverses the rows
+    backwards = before is not None and len(before) == len(order_by)
+    cursor = before if backwards else after
+    if cursor is not None and len(cursor) == len(order_by):
+        forward_op = '<' if descending else '>'
+        op = ('>' if forward_op == '<' else '<') if backwards else forward_op
+        conditions.append(f'{key_sql} {op} {marks}')
+        values.extend(cursor)
+    else:
+        cursor = None
+    direction = 'DESC' if descending != backwards else 'ASC'
+    sql = select_sql
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(f'({c})' for c in conditions)
+    sql += ' ORDER BY ' + ', '.join(f'{expr} {direction}' for expr, _ in order_by) + ' LIMIT ?'
+    rows = conn.execute(sql, (*values, size + 1)).fetchall()
+
+    has_more = len(rows) > size
+    rows = rows[:size]
+    if backwards:
+        rows.reverse()
+    key = lambda row: [row[name] for _, name in order_by]
+    next_cursor = prev_cursor = None
+    if rows:
+        if has_more or backwards:
+            next_cursor = encode_cursor(key(rows[-1]))
+        if cursor is not None and (has_more or not backwards):
+            prev_cursor = encode_cursor(key(rows[0]))
+    return Page(rows, size, next_cursor, prev_cursor, filters)
+
+def iso_date(value):
+    """Normalises a YYYY-MM-DD filter value (raises ValueError otherwise)."""
+    return date.fromisoformat(value).isoformat()
+
+def build_filters(args, spec):
+    """Turns query-string filters into WHERE conditions.
+
+    `spec` maps an argument name to (condition_sql, converter), e.g.
+    {'statut': ('r.statut = ?', str), 'date_from': ('r.date_debut >= ?', iso_date)}.
+    Returns (filters, where, params); `filters` keeps the raw values so the
+    template can re-fill the form and carry them into the page links.
+    """
+    filters, where, params = {}, [], []
+    for name, (condition, convert) in spec.items():
+        value = args.get(name)
+        if value:
+            converted = convert(value) # A tuple fills several placeholders
+            params.extend(converted if isinstance(converted, tuple) else (converted,))
+            where.append(condition)
+            filters[name] = value
+    return filters, where, params
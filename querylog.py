@@ -0,0 +1,230 @@
+# querylog.py - Per-request SQL instrumentation for Gest'Hôtel
+#
+# init_app() gives the connection pool (db.py) connections whose cursors time
+# every statement and count the rows it returns (or changes) while a request is
+# being served. Each response then carries a Server-Timing header that browser
+# dev tools show in the request's Timing tab:
+#
+#   Server-Timing: db;dur=4.21;desc="7 queries, 112 rows", sql-1;dur=2.50;desc="SELECT r.*, ...", app;dur=9.80
+#
+# "db" is the total time spent in SQLite, "sql-N" the slowest statements and
+# "app" the whole request. The sql-N entries show SQL text, so they are only sent
+# to admin sessions, in debug mode or with GESTHOTEL_SERVER_TIMING_SQL=1; other
+# callers get db and app. Statements slower than GESTHOTEL_SLOW_QUERY_MS
+# (default 100 ms) are appended to the slow-query log (GESTHOTEL_SLOW_QUERY_LOG,
+# default slow_queries.log; "-" prints them) with their parameters (redacted for
+# the credential tables) and EXPLAIN QUERY PLAN. Rows a streamed response fetches after the view returned
+# are not counted. GESTHOTEL_SQL_TRACE=0 turns the instrumentation off.
+#
+# The traced cursors also feed /metrics (metrics.py): statements that failed
+# with SQLITE_BUSY / SQLITE_LOCKED and the time BEGIN IMMEDIATE waited for the
+# write lock.
+
+import contextvars
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app, g, request, session
+
+import metrics
+from db import pool
+
+ENABLED = os.environ.get('GESTHOTEL_SQL_TRACE', '1') == '1'
+SLOW_QUERY_MS = float(os.environ.get('GESTHOTEL_SLOW_QUERY_MS', 100))
+SLOW_QUERY_LOG = os.environ.get('GESTHOTEL_SLOW_QUERY_LOG', 'slow_queries.log')
+TIMING_TOP = int(os.environ.get('GESTHOTEL_SERVER_TIMING_TOP', 3)) # Slowest statements listed in Server-Timing
+TIMING_SQL = os.environ.get('GESTHOTEL_SERVER_TIMING_SQL') == '1' # SQL text in Server-Timing for every caller
+_SECRET_TABLES = re.compile(r'\b(users|revoked_tokens)\b', re.IGNORECASE) # Parameters are hashes, tokens, passwords
+_EXPLAINABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+_current = contextvars.ContextVar('querylog', default=None)
+_next_row = sqlite3.Cursor.__next__
+_log_lock = threading.Lock()
+
+class Statement:
+    """One executed statement: SQL, parameters, seconds spent in SQLite and rows returned or changed."""
+    __slots__ = ('sql', 'params', 'seconds', 'rows', 'conn')
+
+    def __init__(self, sql, params, seconds, rows, conn):
+        self.sql, self.params, self.seconds, self.rows, self.conn = sql, params, seconds, rows, conn
+
+class QueryLog:
+    """The statements of one request."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.statements = []
+
+    def summary(self):
+        return {'queries': len(self.statements), 'db_ms': round(sum(s.seconds for s in self.statements) * 1000, 2),
+                'rows': sum(s.rows for s in self.statements)}
+
+def is_busy(error):
+    """True for 'database is locked' / 'database table is locked' (busy timeout exhausted)."""
+    code = getattr(error, 'sqlite_errorcode', None) # Python 3.11+
+    if code is None:
+        return 'locked' in str(error)
+    return (code & 0xff) in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED) # Extended codes keep the primary code in the low byte
+
+class TracedCursor(sqlite3.Cursor):
+    """Records execute / fetch time and row counts into the active QueryLog, if any."""
+    _statement = None
+
+    def _run(self, method, sql, params, logged_params):
+        log = _current.get()
+        if log is None:
+            self._statement = None
+            return method(sql, params)
+        started = time.perf_counter()
+        try:
+            return method(sql, params)
+        except sqlite3.OperationalError as e:
+            if is_busy(e):
+                metrics.inc('gesthotel_db_busy_total')
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            self._statement = Statement(sql, logged_params, elapsed, max(self.rowcount, 0), self.connection)
+            log.statements.append(self._statement)
+            if sql.startswith('BEGIN IMMEDIATE'): # Time spent in SQLite's busy retries for the write lock
+                metrics.observe('gesthotel_db_write_lock_wait_seconds', elapsed)
+
+    def execute(self, sql, parameters=()):
+        return self._run(super().execute, sql, parameters, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        # Only a list's first parameters can be logged (and explained) without consuming an iterator
+        first = seq_of_parameters[0] if isinstance(seq_of_parameters, (list, tuple)) and seq_of_parameters else None
+        return self._run(super().executemany, sql, seq_of_parameters, first)
+
+    def _fetched(self, rows, started):
+        statement = self._statement
+        if statement is not None:
+            statement.seconds += time.perf_counter() - started
+            statement.rows += rows
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(row is not None, started)
+        return row
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(len(rows), started)
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(len(rows), started)
+        return rows
+
+    def __next__(self):
+        # Iteration only counts rows: timing each row would cost more than fetching it
+        row = _next_row(self) # StopIteration ends the loop
+        statement = self._statement
+        if statement is not None:
+            statement.rows += 1
+        return row
+
+class TracedConnection(sqlite3.Connection):
+    """A connection whose cursors, including those of the execute() shortcuts, are TracedCursors."""
+
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+# --- Reporting ---
+def _quoted(text, limit=60):
+    text = ' '.join(text.split())
+    text = text if len(text) <= limit else text[:limit - 3] + '...'
+    return '"' + text.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+def server_timing(log, with_sql=False):
+    """The Server-Timing header value of a finished request; `with_sql` adds the slowest statements."""
+    summary = log.summary()
+    parts = [f"db;dur={summary['db_ms']};desc=\"{summary['queries']} queries, {summary['rows']} rows\""]
+    if with_sql:
+        slowest = sorted(log.statements, key=lambda s: s.seconds, reverse=True)[:TIMING_TOP]
+        parts += [f'sql-{n};dur={s.seconds * 1000:.2f};desc={_quoted(s.sql)}' for n, s in enumerate(slowest, 1)]
+    parts.append(f'app;dur={(time.perf_counter() - log.started) * 1000:.2f}')
+    return ', '.join(parts)
+
+def query_plan(statement):
+    """EXPLAIN QUERY PLAN of a logged statement as indented lines (empty if it cannot be explained)."""
+    if not statement.sql.lstrip().upper().startswith(_EXPLAINABLE) or statement.params is None:
+        return []
+    try:
+        rows = sqlite3.Connection.execute(statement.conn, 'EXPLAIN QUERY PLAN ' + statement.sql, statement.params).fetchall()
+    except sqlite3.Error as e:
+        return [f'(no plan: {e})']
+    depth = {0: -1}
+    lines = []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, -1) + 1
+        lines.append('  ' * depth[node_id] + detail)
+    return lines
+
+def shows_sql():
+    """Whether this request's caller may see SQL text: admins (session or API token), debug mode or opt-in."""
+    user = g.get('api_user') or {'role': session.get('role')}
+    return TIMING_SQL or current_app.debug or user['role'] == 'admin'
+
+def logged_params(statement):
+    return '<redacted>' if _SECRET_TABLES.search(statement.sql) else repr(statement.params)
+
+def log_slow(log, where):
+    """Appends the request's statements slower than SLOW_QUERY_MS to the slow-query log."""
+    slow = [s for s in log.statements if s.seconds * 1000 >= SLOW_QUERY_MS]
+    if not slow:
+        return
+    entries = []
+    for s in slow:
+        lines = [f"{datetime.now().isoformat(timespec='seconds')} {where} {s.seconds * 1000:.1f} ms, {s.rows} rows",
+                 f"  SQL: {' '.join(s.sql.split())}", f"  Params: {logged_params(s)}"]
+        lines += ['  Plan: ' + line if i == 0 else '        ' + line for i, line in enumerate(query_plan(s))]
+        entries.append('\n'.join(lines) + '\n')
+    if SLOW_QUERY_LOG == '-':
+        print(''.join(entries), end='')
+        return
+    with _log_lock, open(SLOW_QUERY_LOG, 'a', encoding='utf-8') as f:
+        f.write(''.join(entries))
+
+def init_app(app):
+    """Traces the pool's connections and reports each request's statements."""
+    if not ENABLED:
+        return
+    pool.factory = TracedConnection
+    pool.close_all() # Idle connections opened before this are untraced
+
+    @app.before_request
+    def start_query_log():
+        g.query_log = QueryLog()
+        g.query_log_token = _current.set(g.query_log)
+
+    @app.after_request
+    def report_query_log(response):
+        log = g.get('query_log')
+        if log is None:
+            return response
+        response.headers['Server-Timing'] = server_timing(log, shows_sql())
+        log_slow(log, f'{request.method} {request.full_path.rstrip("?")}')
+        return response
+
+    @app.teardown_request
+    def stop_query_log(exception=None):
+        g.pop('query_log', None)
+        token = g.pop('query_log_token', None)
+        if token is not None:
+            _current.reset(token)
@@ -0,0 +1,175 @@
+# queryplans.py - Query-plan regression check for the hot SQL statements of Gest'Hôtel
+#
+# HOT_QUERIES registers the statements every booking, dashboard, invoice, review
+# page and consumption reading runs, by reference to the constants the app
+# executes (so the check follows any edit), with the index each plan must use.
+# Against a scaled database (by default a synthetic hotel from
+# create_db.generate) the check:
+#   - runs EXPLAIN QUERY PLAN on each and fails if the plan scans a table, builds
+#     an automatic index or no longer uses the expected index;
+#   - times each statement (median and p95 of --repeat runs) and, with
+#     --compare NAME, fails when one got slower than the stored baseline by
+#     more than --tolerance (and by more than NOISE_MS).
+# Baselines are stored in queryplan_baselines/NAME.json (--save NAME).
+# Exits 1 on any failure, so it can gate a change.
+#
+# Usage:
+#   python queryplans.py                          # 200000 reservations, plans and timings
+#   python queryplans.py --scale 1000000 --save main
+#   python queryplans.py --compare main           # ... after a change, the same day
+#   python queryplans.py --today 2026-06-01 --save june   # Data anchored on a fixed date: comparable on any day
+#   python queryplans.py --db gesthotel.db        # An existing, migrated database (read only)
+
+import argparse
+import os
+import re
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import closing
+from datetime import date, timedelta
+
+import baselines
+import booking
+import create_db
+import folio
+import kpi
+import migrate
+from db import connect
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE_DIR = os.path.join(HERE, 'queryplan_baselines')
+NOISE_MS = 0.02 # Slowdowns below this are timer noise, whatever the ratio
+
+# name -> (where it runs, SQL, index its plan must use, parameters from the sample rows)
+HOT_QUERIES = {
+    'conflict_check': ('booking.create_reservation', booking.CONFLICT_SQL, 'idx_reservations_chambre_statut_dates',
+                       lambda s: (s['room'], s['in_33_days'], s['in_30_days'])),
+    'dashboard_occupancy': ('kpi.dashboard_kpis', kpi.OCCUPANCY_SQL, 'kpi_daily_occupancy USING PRIMARY KEY',
+                            lambda s: (s['today'],)),
+    'dashboard_checkins': ('kpi.upcoming_checkins', kpi.UPCOMING_CHECKINS_SQL, 'idx_reservations_statut_debut',
+                           lambda s: (s['today'], s['in_7_days'], 5)),
+    'invoice_folio': ('booking.generate_invoice', folio.FOLIO_SQL, 'folios USING INTEGER PRIMARY KEY',
+                      lambda s: (s['reservation'],)),
+    'avis_reviewable': ('app.view_avis', booking.REVIEWABLE_RESERVATIONS_SQL, 'sqlite_autoindex_avis_1',
+                        lambda s: (s['client'], s['client'])),
+    'consommation_stay': ('app.add_consommation', booking.ACTIVE_RESERVATION_SQL, 'idx_reservations_chambre_statut_dates',
+                          lambda s: (s['room'], s['today'], s['today'])),
+}
+
+_SCAN = re.compile(r'^SCAN (\w+)') # A full scan of a table or index ("SCAN (subquery-1)" / "CONSTANT ROW" do not match)
+
+def sample(conn, today):
+    """Parameters that hit real data around `today`: the busiest room, the client with most completed stays, the latest folio."""
+    return {
+        'today': today.isoformat(),
+        'in_7_days': (today + timedelta(days=7)).isoformat(),
+        'in_30_days': (today + timedelta(days=30)).isoformat(),
+        'in_33_days': (today + timedelta(days=33)).isoformat(),
+        'room': conn.execute('SELECT id_chambre FROM reservations GROUP BY id_chambre ORDER BY COUNT(*) DESC LIMIT 1').fetchone()[0],
+        'client': conn.execute('''SELECT id_client FROM reservations WHERE statut = 'Terminée'
+                                  GROUP BY id_client ORDER BY COUNT(*) DESC LIMIT 1''').fetchone()[0],
+        'reservation': conn.execute('SELECT MAX(id_reservation) FROM folios').fetchone()[0],
+    }
+
+def check_plan(conn, sql, params, index):
+    """Returns (plan lines, problems) for one statement."""
+    rows = conn.execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+    plan = [row[3] for row in rows]
+    problems = [f'full scan: {line}' for line in plan if _SCAN.match(line)]
+    problems += [f'automatic index: {line}' for line in plan if 'AUTOMATIC' in line]
+    if not any(index in line for line in plan):
+        problems.append(f'does not use {index}')
+    return plan, problems
+
+def time_query(conn, sql, params, repeat):
+    """Median and p95 of `repeat` executions (rows fetched), in ms."""
+    conn.execute(sql, params).fetchall() # Warm the page cache and the statement cache
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        conn.execute(sql, params).fetchall()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {'median_ms': round(statistics.median(timings), 4), 'p95_ms': round(timings[int(len(timings) * 0.95) - 1], 4)}
+
+def run(db_file, repeat, today):
+    """Checks and times every hot query; returns {name: {'where', 'plan', 'problems', 'median_ms', 'p95_ms'}}."""
+    results = {}
+    with closing(connect(db_file)) as conn:
+        values = sample(conn, today)
+        for name, (where, sql, index, params) in HOT_QUERIES.items():
+            plan, problems = check_plan(conn, sql, params(values), index)
+            results[name] = {'where': where, 'plan': plan, 'problems': problems, **time_query(conn, sql, params(values), repeat)}
+    return results
+
+def print_report(results):
+    print(f"{'query':<22}{'median ms':>11}{'p95 ms':>10}  plan")
+    for name, r in results.items():
+        print(f"{name:<22}{r['median_ms']:>11.4f}{r['p95_ms']:>10.4f}  {'OK' if not r['problems'] else 'FAIL'} ({r['where']})")
+        for line in r['plan']:
+            print(f"{'':<45}{line}")
+        for problem in r['problems']:
+            print(f"!!! {name}: {problem}")
+
+def compare(results, baseline, tolerance, settings):
+    """Prints the timing change per query against a baseline; returns the regressions found."""
+    regressions = []
+    print(f"\nAgainst baseline '{baseline['name']}' ({baseline['created']}, {baseline.get('commit') or 'unknown commit'}):")
+    if baseline['settings'] != settings:
+        print(f"WARNING: the baseline was run with other settings ({baseline['settings']}).")
+    for name, r in results.items():
+        base = baseline['queries'].get(name)
+        if not base:
+            continue
+        change = (r['median_ms'] / base['median_ms'] - 1) * 100 if base['median_ms'] else 0.0
+        print(f"{name:<22}{base['median_ms']:>11.4f} -> {r['median_ms']:.4f} ms ({change:+.1f}%)")
+        if change > tolerance * 100 and r['median_ms'] - base['median_ms'] > NOISE_MS:
+            regressions.append(f"{name}: median {base['median_ms']} -> {r['median_ms']} ms")
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Gest'Hôtel query-plan regression check")
+    parser.add_argument('--db', help='migrated database to check (default: a synthetic hotel)')
+    parser.add_argument('--scale', type=int, default=200000, help='synthetic hotel: reservations (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=42, help='random seed for the synthetic hotel (default: %(default)s)')
+    parser.add_argument('--today', type=date.fromisoformat, default=date.today(),
+                        help='date the synthetic hotel is anchored on and the queries ask about (default: today)')
+    parser.add_argument('--repeat', type=int, default=500, help='timed executions per query (default: %(default)s)')
+    parser.add_argument('--save', metavar='NAME', help='store the timings as baseline NAME')
+    parser.add_argument('--compare', metavar='NAME', help='compare with baseline NAME; exit 1 on a regression')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='allowed median slowdown (default: %(default)s)')
+    parser.add_argument('--baseline-dir', default=BASELINE_DIR)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='gesthotel-queryplans-')
+    try:
+        if args.db:
+            db_file = args.db
+            with closing(connect(db_file)) as conn:
+                if migrate.pending_migrations(conn):
+                    raise SystemExit(f"{db_file} has pending migrations: run 'python migrate.py upgrade' first.")
+        else:
+            db_file = os.path.join(workdir, 'queryplans.db')
+            print(f"Generating {args.scale} reservations...")
+            create_db.setup_database(db_file)
+            create_db.generate(db_file, args.scale, seed=args.seed, today=args.today)
+        results = run(db_file, args.repeat, args.today)
+        print_report(results)
+        failures = [f'{name}: {problem}' for name, r in results.items() for problem in r['problems']]
+
+        settings = {'db': args.db or f'synthetic, {args.scale} reservations', 'repeat': args.repeat, 'today': args.today.isoformat()}
+        if args.compare:
+            regressions = compare(results, baselines.load(args.baseline_dir, args.compare), args.tolerance, settings)
+            for regression in regressions:
+                print(f"!!! Regression: {regression}")
+            failures += regressions
+        if args.save:
+            path = baselines.save(args.baseline_dir, args.save, settings, queries=results)
+            print(f"Baseline saved to {path}")
+        print(f"\n{len(failures)} failure(s)." if failures else f"\nAll {len(HOT_QUERIES)} hot queries use their indexes.")
+        sys.exit(1 if failures else 0)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,88 @@
+# rollups.py - Daily and monthly consumption rollups for Gest'Hôtel
+#
+# conso_daily and conso_monthly hold, per (id_chambre, type_consommation, day or
+# month), the sum of valeur, the cost (valeur x cout_unitaire) and the number of
+# readings. Triggers installed by migrations/0007_consumption_rollups.py keep
+# them current as readings are inserted, corrected or deleted, so reports read a
+# few aggregate rows instead of scanning consommations.
+#
+# Usage:
+#   python rollups.py check      # Compare the rollups with the raw readings
+#   python rollups.py rebuild    # Recompute both rollups from scratch
+
+import sys
+from contextlib import closing
+
+# table -> (period column, expression deriving it from date_releve)
+LEVELS = {
+    'conso_daily': ('jour', 'substr(date_releve, 1, 10)'),
+    'conso_monthly': ('mois', 'substr(date_releve, 1, 7)'),
+}
+GRANULARITIES = {'day': 'conso_daily', 'month': 'conso_monthly'}
+
+def _recount_sql(table):
+    period, expr = LEVELS[table]
+    return f'''SELECT id_chambre, type_consommation, {expr} AS {period}, SUM(valeur), SUM(valeur * cout_unitaire), COUNT(*)
+               FROM consommations GROUP BY id_chambre, type_consommation, {expr}'''
+
+def rebuild(conn):
+    """Recomputes both rollups from consommations. Runs in the caller's transaction."""
+    for table, (period, _) in LEVELS.items():
+        conn.execute(f'DELETE FROM {table}')
+        conn.execute(f'''INSERT INTO {table} (id_chambre, type_consommation, {period}, total_valeur, total_cout, nb_releves)
+                         {_recount_sql(table)}''')
+
+def check(conn, tolerance=1e-6):
+    """Compares the rollups with a full recount; returns the number of mismatched rows per table."""
+    report = {}
+    for table, (period, _) in LEVELS.items():
+        expected = {row[:3]: row[3:] for row in conn.execute(_recount_sql(table))}
+        stored = {row[:3]: row[3:] for row in conn.execute(
+            f'SELECT id_chambre, type_consommation, {period}, total_valeur, total_cout, nb_releves FROM {table} WHERE nb_releves > 0')}
+        report[table] = sum(1 for key in set(expected) | set(stored)
+                            if key not in expected or key not in stored
+                            or any(abs(a - b) > tolerance * max(1, abs(a)) for a, b in zip(expected[key], stored[key])))
+    report['consistent'] = not any(report.values())
+    return report
+
+def summary(conn, granularity='month', date_from=None, date_to=None, id_chambre=None, type_consommation=None, by_room=False):
+    """Consumption totals per period and type (and room if `by_room`), read from the rollups.
+
+    `date_from` / `date_to` are ISO dates; at month granularity they select the
+    months that contain them.
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Unknown granularity '{granularity}' (use {', '.join(GRANULARITIES)}).")
+    table = GRANULARITIES[granularity]
+    period, _ = LEVELS[table]
+    size = 10 if granularity == 'day' else 7
+    where, params = [], []
+    if date_from:
+        where.append(f'{period} >= ?'); params.append(date_from[:size])
+    if date_to:
+        where.append(f'{period} <= ?'); params.append(date_to[:size])
+    if id_chambre:
+        where.append('id_chambre = ?'); params.append(int(id_chambre))
+    if type_consommation:
+        where.append('type_consommation = ?'); params.append(type_consommation)
+    keys = f'{period}, type_consommation' + (', id_chambre' if by_room else '')
+    sql = f'''SELECT {period} AS period, type_consommation{', id_chambre' if by_room else ''},
+                     ROUND(SUM(total_valeur), 4) AS total_valeur, ROUND(SUM(total_cout), 2) AS total_cout, SUM(nb_releves) AS nb_releves
+              FROM {table} {'WHERE ' + ' AND '.join(where) if where else ''}
+              GROUP BY {keys} ORDER BY {keys}'''
+    return [dict(row) for row in conn.execute(sql, params)]
+
+if __name__ == '__main__':
+    from db import connect
+    if sys.argv[1:] not in (['check'], ['rebuild']):
+        print("Usage: python rollups.py check|rebuild")
+        sys.exit(2)
+    with closing(connect()) as conn:
+        if sys.argv[1] == 'rebuild':
+            rebuild(conn)
+            conn.commit()
+            print("Consumption rollups rebuilt.")
+        report = check(conn)
+    print(f"Consumption rollups: {'consistent' if report['consistent'] else 'INCONSISTENT'} "
+          f"({report['conso_daily']} daily / {report['conso_monthly']} monthly rows differ)")
+    sys.exit(0 if report['consistent'] else 1)
@@ -0,0 +1,152 @@
+# room_search.py - Vectorized availability search across all rooms for Gest'Hôtel
+#
+# Builds a rooms x nights occupancy matrix (NumPy bool array) from the
+# chambres table and the in-memory availability index, then answers
+# multi-criteria questions ("which Suites under 200 € are free from the 12th to
+# the 15th, and if none, which nearby dates work?") as array reductions.
+
+import math
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+HORIZON_DAYS = 365
+MAX_FLEX_DAYS = 30
+MAX_STAY_NIGHTS = 365 # Also the furthest check-in date searched, so the matrix stays a few years wide at most
+
+class OccupancyMatrix:
+    """Occupancy of every room for each night in [first_night, first_night + nights)."""
+
+    def __init__(self, rooms, intervals, first_night, nights):
+        self.first_night = first_night
+        self.nights = nights
+        self.room_ids = np.array([r['id_chambre'] for r in rooms], dtype=np.int64)
+        self.numbers = [r['numero_chambre'] for r in rooms]
+        self.types = np.array([r['type_chambre'] for r in rooms], dtype=object)
+        self.prices = np.array([r['prix_nuit_base'] for r in rooms], dtype=np.float64)
+        self.occupied = self._fill(intervals)
+        # busy_prefix[r, k] = occupied nights of room r before offset k (sliding-window sums)
+        self.busy_prefix = np.zeros((len(rooms), nights + 1), dtype=np.int32)
+        np.cumsum(self.occupied, axis=1, out=self.busy_prefix[:, 1:])
+
+    def _fill(self, intervals):
+        """Rasterises stays into the matrix with a difference array (no per-night loop)."""
+        room_col, starts, ends = intervals
+        occupied = np.zeros((len(self.room_ids), self.nights), dtype=bool)
+        if len(room_col) == 0 or len(self.room_ids) == 0:
+            return occupied
+        order = np.argsort(self.room_ids)
+        pos = np.searchsorted(self.room_ids, room_col, sorter=order)
+        pos = np.clip(pos, 0, len(order) - 1)
+        known = self.room_ids[order[pos]] == room_col # Rooms deleted since the index load are dropped
+        rows = order[pos][known]
+        first = self.first_night.toordinal()
+        s = np.clip(starts[known] - first, 0, self.nights)
+        e = np.clip(ends[known] - first, 0, self.nights)
+        keep = s < e
+        width = self.nights + 1
+        size = len(self.room_ids) * width
+        rows = rows[keep] * width
+        diff = (np.bincount(rows + s[keep], minlength=size) - np.bincount(rows + e[keep], minlength=size)).reshape(-1, width)
+        return np.cumsum(diff[:, :-1], axis=1) > 0
+
+    def offset(self, day):
+        return (day - self.first_night).days
+
+    def room_mask(self, type_chambre=None, prix_max=None):
+        mask = np.ones(len(self.room_ids), dtype=bool)
+        if type_chambre:
+            mask &= self.types == type_chambre
+        if prix_max is not None:
+            mask &= self.prices <= prix_max
+        return mask
+
+    def free_for(self, start_offset, length):
+        """Bool per room: free for `length` nights from `start_offset`."""
+        return (self.busy_prefix[:, start_offset + length] - self.busy_prefix[:, start_offset]) == 0
+
+    def free_run(self, start_offset):
+        """Consecutive free nights per room starting at `start_offset` (capped at the horizon)."""
+        tail = self.occupied[:, start_offset:]
+        if tail.shape[1] == 0:
+            return np.zeros(len(self.room_ids), dtype=np.int64)
+        first_busy = tail.argmax(axis=1)
+        return np.where(tail.any(axis=1), first_busy, tail.shape[1])
+
+    def start_counts(self, length, mask):
+        """Rooms (matching `mask`) free for `length` nights, for every possible start offset."""
+        windows = self.busy_prefix[mask, length:] - self.busy_prefix[mask, :-length]
+        return (windows == 0).sum(axis=0)
+
+_interval_cache = {'version': None, 'arrays': None}
+
+def interval_arrays(availability):
+    """NumPy copies of the index's stays, rebuilt only when the index has changed."""
+    if _interval_cache['version'] != availability.version:
+        version = availability.version
+        room_col, starts, ends = availability.intervals()
+        _interval_cache['arrays'] = (np.array(room_col, dtype=np.int64), np.array(starts, dtype=np.int64),
+                                     np.array(ends, dtype=np.int64))
+        _interval_cache['version'] = version
+    return _interval_cache['arrays']
+
+def build_matrix(conn, availability, first_night, nights=HORIZON_DAYS):
+    """Loads rooms from SQLite and stays from the availability index into a matrix."""
+    rooms = conn.execute('SELECT id_chambre, numero_chambre, type_chambre, prix_nuit_base FROM chambres ORDER BY numero_chambre').fetchall()
+    return OccupancyMatrix(rooms, interval_arrays(availability), first_night, nights)
+
+def search(conn, availability, date_debut, date_fin, type_chambre=None, prix_max=None, flex_days=3, min_nights=None):
+    """Answers an availability query.
+
+    Returns the rooms free for the whole stay with their free run from check-in,
+    and, for each start date within +/- flex_days, how many matching rooms could
+    take a stay of the same length (nearest dates first) as alternatives.
+    """
+    started = time.perf_counter()
+    length = (date_fin - date_debut).days
+    if length <= 0:
+        raise ValueError('Check-out date must be after check-in date.')
+    if length > MAX_STAY_NIGHTS:
+        raise ValueError(f'Stays are limited to {MAX_STAY_NIGHTS} nights.')
+    if (date_debut - date.today()).days > HORIZON_DAYS:
+        raise ValueError(f'Check-in date must be within {HORIZON_DAYS} days.')
+    if not 0 <= flex_days <= MAX_FLEX_DAYS:
+        raise ValueError(f'flex must be between 0 and {MAX_FLEX_DAYS} days.')
+    if min_nights is not None and not 0 < min_nights <= MAX_STAY_NIGHTS:
+        raise ValueError(f'min_nights must be between 1 and {MAX_STAY_NIGHTS}.')
+    if prix_max is not None and not math.isfinite(prix_max):
+        raise ValueError('prix_max must be a finite number.')
+    needed = min_nights or length
+    window_start = max(date.today(), date_debut - timedelta(days=flex_days))
+    horizon = max(HORIZON_DAYS, (date_fin - window_start).days + flex_days + needed)
+    matrix = build_matrix(conn, availability, window_start, horizon)
+
+    mask = matrix.room_mask(type_chambre, prix_max)
+    s = matrix.offset(date_debut)
+    free = mask & matrix.free_for(s, length) if s >= 0 else np.zeros_like(mask)
+    runs = matrix.free_run(max(s, 0))
+    matches = [{'id_chambre': int(matrix.room_ids[i]), 'numero_chambre': matrix.numbers[i],
+                'type_chambre': matrix.types[i], 'prix_nuit_base': float(matrix.prices[i]),
+                'free_nights_from_check_in': int(runs[i])}
+               for i in np.flatnonzero(free)]
+
+    counts = matrix.start_counts(length, mask) if mask.any() else np.zeros(0, dtype=np.int64)
+    alternatives = []
+    for shift in sorted(range(-flex_days, flex_days + 1), key=abs):
+        k = s + shift
+        if shift == 0 or k < 0 or k >= len(counts) or counts[k] == 0:
+            continue
+        alt_start = date_debut + timedelta(days=shift)
+        alternatives.append({'date_debut': alt_start.isoformat(), 'date_fin': (alt_start + timedelta(days=length)).isoformat(),
+                             'rooms_available': int(counts[k])})
+
+    if min_nights:
+        matches = [m for m in matches if m['free_nights_from_check_in'] >= min_nights]
+    return {
+        'date_debut': date_debut.isoformat(), 'date_fin': date_fin.isoformat(), 'nights': length,
+        'type_chambre': type_chambre, 'prix_max': prix_max,
+        'rooms': matches, 'alternatives': alternatives,
+        'rooms_considered': int(mask.sum()), 'horizon_nights': matrix.nights,
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 2),
+    }
@@ -0,0 +1,219 @@
+# tariff_rules.py - Compiled tariff conditions for Gest'Hôtel
+#
+# Each tariff's condition_application is parsed once into predicates, and the
+# compiled rules are kept per process until the tarifs table changes:
+# add_tarif / edit_tarif / delete_tarif call engine.invalidate(), other workers
+# notice the new tarifs version in table_versions (versions.cache, which only
+# re-reads it after a commit).
+#
+# Condition syntax: clauses separated by ';' (or '&', 'and'), all must hold,
+# case-insensitive:
+#   None (or empty)                 always applies
+#   VIP, Or, loyalty=VIP|Or         client loyalty status (clients.statut_fidelite)
+#   weekend                         arrival on a Friday or Saturday night
+#   min_nights=3                    stays of at least 3 nights
+#   advance>=30, advance<=7         booked at least 30 / at most 7 days before arrival
+#   season=06-01..08-31             arrival between two month-days (may span the new year)
+#   season=2026-12-20..2027-01-05   arrival between two dates
+# The legacy wordings 'VIP Status' and 'Weekend Booking' are understood.
+#
+# Rules are grouped by the loyalty status they accept and ordered by reduction,
+# so picking the best tariff for a stay walks one short list and stops at the
+# first match, each rule costing a few comparisons.
+#
+# Usage:
+#   python tariff_rules.py                                        # Compiled rules of every tariff
+#   python tariff_rules.py VIP 2026-07-03 2026-07-06              # Best tariff for a stay
+#   python tariff_rules.py VIP 2026-07-03 2026-07-06 2026-05-01   # ...booked on that date
+
+import logging
+import re
+import sys
+import threading
+from collections import namedtuple
+from datetime import date
+
+import versions
+
+log = logging.getLogger(__name__)
+
+LOYALTY_STATUSES = ('Standard', 'VIP', 'Or') # clients.statut_fidelite
+_FILLER = {'status', 'statut', 'booking', 'stay', 'only', 'client', 'clients'} # 'VIP Status', 'Weekend Booking'
+_SEPARATORS = re.compile(r'\s*(?:;|&|\band\b)\s*', re.IGNORECASE)
+_KEY_VALUE = re.compile(r'^(\w+)\s*(>=|<=|=|:)\s*(.+)$')
+
+class ConditionError(ValueError):
+    """A condition_application that cannot be parsed; the message says which clause."""
+
+# What a stay looks like to the predicates, computed once per pricing
+Stay = namedtuple('Stay', 'loyalty arrival nights advance month_day weekend')
+
+def stay(loyalty, date_debut, date_fin, booked_on=None):
+    date_debut, date_fin = date.fromisoformat(str(date_debut)), date.fromisoformat(str(date_fin))
+    return Stay(loyalty, date_debut, (date_fin - date_debut).days, (date_debut - (booked_on or date.today())).days,
+                date_debut.month * 100 + date_debut.day, date_debut.weekday() in (4, 5))
+
+# --- Parsing ---
+def _month_day(text):
+    month, day = (int(part) for part in text.split('-'))
+    date(2000, month, day) # Validates (2000 is a leap year: 02-29 is allowed)
+    return month * 100 + day
+
+def _season(value):
+    start, sep, end = value.partition('..')
+    if not sep:
+        raise ValueError
+    start, end = start.strip(), end.strip()
+    if len(start) == len(end) == 10: # Two dates
+        first, last = date.fromisoformat(start), date.fromisoformat(end)
+        return lambda s: first <= s.arrival <= last
+    first, last = _month_day(start), _month_day(end)
+    if first <= last:
+        return lambda s: first <= s.month_day <= last
+    return lambda s: s.month_day >= first or s.month_day <= last # Spans the new year
+
+def _loyalty(value):
+    wanted = {v.strip().lower() for v in re.split(r'[|/]', value) if v.strip()}
+    statuses = frozenset(s for s in LOYALTY_STATUSES if s.lower() in wanted)
+    if not wanted or len(statuses) != len(wanted):
+        raise ValueError
+    return statuses
+
+def parse(condition):
+    """Parses a condition_application into (loyalty statuses or None, [predicates]).
+
+    Raises ConditionError for any clause it does not understand.
+    """
+    loyalty, predicates = None, []
+    for clause in _SEPARATORS.split((condition or '').strip()):
+        words = [w for w in clause.lower().split() if w not in _FILLER]
+        text = ' '.join(words)
+        try:
+            if text in ('', 'none'):
+                continue
+            if text == 'weekend':
+                predicates.append(lambda s: s.weekend)
+                continue
+            if text in (s.lower() for s in LOYALTY_STATUSES):
+                statuses = _loyalty(text)
+            else:
+                match = _KEY_VALUE.match(text)
+                if not match:
+                    raise ValueError
+                key, op, value = match.groups()
+                if key in ('loyalty', 'fidelite', 'statut_fidelite') and op in ('=', ':'):
+                    statuses = _loyalty(value)
+                elif (key == 'min_nights' and op in ('=', ':')) or (key == 'nights' and op == '>='):
+                    nights = int(value)
+                    predicates.append(lambda s, nights=nights: s.nights >= nights)
+                    continue
+                elif key == 'advance' and op in ('>=', '<='):
+                    days = int(value)
+                    predicates.append((lambda s, days=days: s.advance >= days) if op == '>=' else (lambda s, days=days: s.advance <= days))
+                    continue
+                elif key == 'season' and op in ('=', ':'):
+                    predicates.append(_season(value))
+                    continue
+                else:
+                    raise ValueError
+            loyalty = statuses if loyalty is None else loyalty & statuses
+        except ValueError:
+            raise ConditionError(f"Unknown tariff condition '{clause}'. Use None, VIP, Or, loyalty=VIP|Or, weekend, "
+                                 f"min_nights=N, advance>=N, advance<=N or season=MM-DD..MM-DD (clauses separated by ';').") from None
+    return loyalty, predicates
+
+# --- Compiled rules ---
+class Rule:
+    """A tariff with its compiled condition."""
+    __slots__ = ('id_tarif', 'nom_tarif', 'reduction', 'condition', 'loyalty', 'predicates')
+
+    def __init__(self, row):
+        self.id_tarif, self.nom_tarif = row['id_tarif'], row['nom_tarif']
+        self.reduction = row['reduction_pourcentage'] or 0.0
+        self.condition = row['condition_application'] or 'None'
+        self.loyalty, self.predicates = parse(row['condition_application'])
+
+    def applies(self, s):
+        return (self.loyalty is None or s.loyalty in self.loyalty) and all(p(s) for p in self.predicates)
+
+class TariffEngine:
+    """The compiled rules of the tarifs table, rebuilt when it changes."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rules = None # id_tarif -> Rule
+        self._by_loyalty = {} # loyalty status -> rules it may use, best reduction first
+        self._version = None
+        self.invalid = {} # id_tarif -> ConditionError message, for tariffs never applied
+        self.compiles = 0
+
+    def invalidate(self):
+        """Drops the compiled rules (after add_tarif / edit_tarif / delete_tarif)."""
+        with self._lock:
+            self._rules = None
+
+    def compile(self, conn, version=None):
+        rules, invalid = {}, {}
+        for row in conn.execute('SELECT id_tarif, nom_tarif, reduction_pourcentage, condition_application FROM tarifs'):
+            try:
+                rules[row['id_tarif']] = Rule(row)
+            except ConditionError as e:
+                invalid[row['id_tarif']] = str(e)
+                log.warning('Tariff %s (%s) is never applied: %s', row['id_tarif'], row['nom_tarif'], e)
+        ordered = sorted(rules.values(), key=lambda r: (-r.reduction, r.id_tarif))
+        by_loyalty = {status: [r for r in ordered if r.loyalty is None or status in r.loyalty] for status in LOYALTY_STATUSES}
+        with self._lock:
+            self._rules, self._by_loyalty, self._version, self.invalid = rules, by_loyalty, version, invalid
+            self.compiles += 1
+
+    def ensure_fresh(self, conn):
+        """Compiles on first use and whenever the tarifs version moved (another worker edited a tariff)."""
+        version = versions.cache.current().get('tarifs')
+        with self._lock:
+            fresh = self._rules is not None and version == self._version
+        if not fresh:
+            self.compile(conn, version)
+
+    def rule(self, conn, id_tarif):
+        """The compiled Rule of a tariff, or None (unknown tariff or invalid condition)."""
+        self.ensure_fresh(conn)
+        with self._lock:
+            return self._rules.get(int(id_tarif))
+
+    def best(self, conn, s):
+        """The applicable Rule with the largest reduction for Stay `s`, or None."""
+        self.ensure_fresh(conn)
+        with self._lock:
+            candidates = self._by_loyalty.get(s.loyalty, [])
+        return next((r for r in candidates if all(p(s) for p in r.predicates)), None)
+
+    def applicable(self, conn, s):
+        """Every applicable Rule for Stay `s`, best reduction first."""
+        self.ensure_fresh(conn)
+        with self._lock:
+            candidates = self._by_loyalty.get(s.loyalty, [])
+        return [r for r in candidates if all(p(s) for p in r.predicates)]
+
+engine = TariffEngine()
+
+if __name__ == '__main__':
+    from contextlib import closing
+    from db import connect
+    with closing(connect()) as conn:
+        if len(sys.argv) in (4, 5):
+            booked_on = date.fromisoformat(sys.argv[4]) if len(sys.argv) == 5 else None
+            s = stay(sys.argv[1], sys.argv[2], sys.argv[3], booked_on)
+            for r in engine.applicable(conn, s):
+                print(f"{r.reduction:6.2f}%  {r.nom_tarif:<24}{r.condition}")
+            best = engine.best(conn, s)
+            print(f"Best: {best.nom_tarif} ({best.reduction:g}% off)" if best else "No tariff applies.")
+        elif len(sys.argv) == 1:
+            engine.compile(conn)
+            for r in sorted(engine._rules.values(), key=lambda r: r.id_tarif):
+                print(f"{r.id_tarif:>4}  {r.nom_tarif:<24}{r.reduction:6.2f}%  {r.condition}")
+            for id_tarif, message in engine.invalid.items():
+                print(f"{id_tarif:>4}  INVALID: {message}")
+        else:
+            print("Usage: python tariff_rules.py [LOYALTY DATE_DEBUT DATE_FIN [BOOKED_ON]]")
+            sys.exit(1)
+    sys.exit(0)
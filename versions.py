@@ -0,0 +1,120 @@
+# versions.py - Per-table change versions and conditional GET for Gest'Hôtel
+#
+# Triggers installed by migrations/0008_table_versions.py bump a counter in
+# table_versions (and stamp changed_at) on every insert, update or delete of a
+# tracked table, whichever route, job or worker makes the write.
+#
+# Read views decorated with @conditional('chambres', ...) send a strong ETag
+# built from the versions of the tables they render (plus the URL, the user and
+# the day) and a Last-Modified, and answer a matching If-None-Match or
+# If-Modified-Since with 304 Not Modified without running the view. Checking
+# for changes costs one PRAGMA data_version on a dedicated connection, which
+# reads SQLite's shared WAL index, not the tables; table_versions itself is
+# only re-read after some connection has committed.
+#
+# Usage:
+#   python versions.py    # Print every table's version and last change
+
+import glob
+import hashlib
+import os
+import sys
+import threading
+from datetime import date, datetime, timezone
+from functools import wraps
+
+from flask import g, get_flashed_messages, make_response, request, session
+
+from db import connect
+
+# Part of every ETag: a deployment that changes templates must not match old ETags
+_TEMPLATES = glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates', '*.html'))
+TEMPLATES_MTIME = int(max((os.path.getmtime(p) for p in _TEMPLATES), default=0))
+RELEASE = os.environ.get('GESTHOTEL_RELEASE') or str(TEMPLATES_MTIME)
+
+class VersionCache:
+    """The table_versions rows, re-read only when the database has changed.
+
+    `PRAGMA data_version` on a connection that never writes changes whenever
+    any other connection commits, so an unchanged value means the cached
+    versions are current.
+    """
+
+    def __init__(self, db_file=None):
+        self.db_file = db_file
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._data_version = None
+        self._versions = {}
+        self.reloads = 0
+
+    def current(self):
+        """Returns {table: (version, changed_at)}, changed_at in Unix seconds."""
+        with self._lock:
+            if self._conn is None or self._pid != os.getpid():
+                self._conn = connect(self.db_file) # Never share SQLite handles across a fork
+                self._pid = os.getpid()
+                self._data_version = None
+            data_version = self._conn.execute('PRAGMA data_version').fetchone()[0]
+            if data_version != self._data_version:
+                self._versions = {row['name']: (row['version'], row['changed_at'])
+                                  for row in self._conn.execute('SELECT name, version, changed_at FROM table_versions')}
+                self._data_version = data_version
+                self.reloads += 1
+            return self._versions
+
+cache = VersionCache()
+
+def validators(tables, *extra):
+    """(strong ETag, Last-Modified datetime) for content built from `tables`.
+
+    `extra` values (URL, user, ...) are folded into the ETag as well.
+    """
+    versions = cache.current()
+    state = [versions.get(table, (0, 0)) for table in tables]
+    key = repr((RELEASE, date.today().isoformat(), tuple(tables), [v for v, _ in state], extra))
+    etag = hashlib.blake2b(key.encode(), digest_size=12).hexdigest()
+    # Pages also change with the day (dashboard, default dates) and with the templates
+    midnight = datetime.combine(date.today(), datetime.min.time()).timestamp()
+    changed_at = max([t for _, t in state] + [midnight, TEMPLATES_MTIME])
+    return etag, datetime.fromtimestamp(int(changed_at), timezone.utc)
+
+def conditional(*tables):
+    """Adds ETag / Last-Modified to a GET view rendering `tables` and answers revalidations with 304.
+
+    Place it under the access-control decorator, so only authorised users get a 304.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if request.method != 'GET' or get_flashed_messages():
+                return f(*args, **kwargs) # Pages showing flash messages are one-off
+            user = g.get('api_user') or {'id_user': session.get('user_id'), 'role': session.get('role')}
+            etag, last_modified = validators(tables, request.full_path, user['id_user'], user['role'])
+            if request.if_none_match:
+                # Compressed variants carry the same tag plus an encoding suffix (compression.py)
+                not_modified = any(tag == etag or tag.startswith(etag + '-') for tag in request.if_none_match.as_set())
+            else:
+                not_modified = request.if_modified_since is not None and last_modified <= request.if_modified_since
+            if not_modified:
+                response = make_response('', 304)
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200 or get_flashed_messages():
+                    return response # Error pages (flashed by the view) are not validated
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            response.cache_control.private = True
+            response.cache_control.no_cache = True # Always revalidate; the 304 is cheap
+            return response
+        return decorated_function
+    return decorator
+
+if __name__ == '__main__':
+    from contextlib import closing
+    with closing(connect()) as conn:
+        rows = conn.execute('SELECT name, version, changed_at FROM table_versions ORDER BY name').fetchall()
+    for row in rows:
+        print(f"{row['name']:<22}v{row['version']:<10}{datetime.fromtimestamp(row['changed_at']).isoformat(sep=' ')}")
+    sys.exit(0)